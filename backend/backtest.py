@@ -0,0 +1,230 @@
+import numpy as np
+import pandas as pd
+
+from indicators import sma
+
+# Parameters of each strategy with their defaults, in grid-axis order.
+STRATEGY_PARAMS = {
+    "ma_crossover": {"fast": 10, "slow": 50},
+    "breakout": {"entry": 20, "exit": 10},
+}
+GRID_METRICS = ("sharpe", "totalReturn", "maxDrawdown")
+YEAR_MS = 365.25 * 24 * 3600 * 1000
+# Upper bound on combinations x bars evaluated at once, ~40 MB per float array.
+GRID_CHUNK_CELLS = 5_000_000
+
+
+def resolve_params(strategy, params):
+    """Merge ``params`` over the strategy defaults and validate them."""
+    if strategy not in STRATEGY_PARAMS:
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {', '.join(STRATEGY_PARAMS)}")
+    defaults = STRATEGY_PARAMS[strategy]
+    unknown = set(params) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown parameters for '{strategy}': {', '.join(sorted(unknown))}")
+    resolved = {**defaults, **params}
+    if any(value < 1 for value in resolved.values()):
+        raise ValueError("Strategy windows must be at least 1")
+    if strategy == "ma_crossover" and resolved["fast"] >= resolved["slow"]:
+        raise ValueError("The fast window must be shorter than the slow window")
+    return resolved
+
+
+def resolve_grid(strategy, grid):
+    """Both axes of a parameter grid as sorted unique window arrays."""
+    if strategy not in STRATEGY_PARAMS:
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {', '.join(STRATEGY_PARAMS)}")
+    axes = []
+    for name, default in STRATEGY_PARAMS[strategy].items():
+        values = np.unique(np.asarray(grid.get(name, [default]), dtype=np.int64))
+        if values.size == 0 or values[0] < 1:
+            raise ValueError(f"Grid values for '{name}' must be windows of at least 1")
+        axes.append(values)
+    unknown = set(grid) - set(STRATEGY_PARAMS[strategy])
+    if unknown:
+        raise ValueError(f"Unknown parameters for '{strategy}': {', '.join(sorted(unknown))}")
+    return axes
+
+
+def periods_per_year(timestamps):
+    """Bars per year from the median bar spacing, or None for fewer than two bars."""
+    if len(timestamps) < 2:
+        return None
+    step = float(np.median(np.diff(timestamps.view(np.int64))))
+    return YEAR_MS / step if step > 0 else None
+
+
+def sma_matrix(close, windows):
+    return np.stack([sma(close, int(window)) for window in windows])
+
+
+def channel_matrix(values, windows, how):
+    """Highest high or lowest low of the ``window`` bars before each bar."""
+    rolling = pd.Series(values).rolling
+    return np.stack([getattr(rolling(int(window)), how)().shift(1).to_numpy() for window in windows])
+
+
+def crossover_signal(fast, slow):
+    """Long while the fast average is above the slow one; NaN warm-up is flat."""
+    return (fast > slow).astype(np.float64)
+
+
+def breakout_signal(close, upper, lower):
+    """Long from a close above the entry channel until a close below the exit channel.
+
+    The state is carried forward from the latest event without a Python loop:
+    each bar looks up the index of the most recent entry or exit.
+    """
+    entry = close > upper
+    exit_ = close < lower
+    entry, exit_ = np.broadcast_arrays(entry, exit_)
+    events = entry | exit_
+    n = events.shape[-1]
+    last_event = np.maximum.accumulate(np.where(events, np.arange(n), -1), axis=-1)
+    state = np.take_along_axis(entry, np.maximum(last_event, 0), axis=-1)
+    return np.where(last_event >= 0, state, False).astype(np.float64)
+
+
+def simulate(signal, close, fee):
+    """Positions and per-bar strategy returns for ``signal`` arrays over ``close``.
+
+    A signal decided on a bar's close is held from the next bar, so there is
+    no look-ahead. ``fee`` is a fraction of notional charged per side.
+    """
+    bar_returns = np.zeros(len(close))
+    bar_returns[1:] = close[1:] / close[:-1] - 1.0
+    position = np.zeros_like(signal)
+    position[..., 1:] = signal[..., :-1]
+    turnover = np.abs(np.diff(position, axis=-1, prepend=0.0))
+    return position, position * bar_returns - fee * turnover
+
+
+def summarize(position, returns, per_year):
+    """Metrics over the last axis of per-bar ``returns``."""
+    log_equity = np.cumsum(np.log1p(returns), axis=-1)
+    peak = np.maximum(np.maximum.accumulate(log_equity, axis=-1), 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        volatility = returns.std(axis=-1)
+        sharpe = returns.mean(axis=-1) / volatility * np.sqrt(per_year) if per_year else np.full(volatility.shape, np.nan)
+    sharpe = np.where(volatility > 0, sharpe, np.nan)
+    return {
+        "totalReturn": np.expm1(log_equity[..., -1]),
+        "sharpe": sharpe,
+        "maxDrawdown": np.expm1((log_equity - peak).min(axis=-1)),
+        "trades": (np.diff(position, axis=-1, prepend=0.0) > 0).sum(axis=-1),
+        "exposure": position.mean(axis=-1),
+    }
+
+
+def strategy_signal(strategy, columns, params):
+    close = columns["close"]
+    if strategy == "ma_crossover":
+        return crossover_signal(sma(close, params["fast"]), sma(close, params["slow"]))
+    upper = channel_matrix(columns["high"], [params["entry"]], "max")[0]
+    lower = channel_matrix(columns["low"], [params["exit"]], "min")[0]
+    return breakout_signal(close, upper, lower)
+
+
+def list_trades(signal, columns, fee):
+    """Round trips from signal flips; a position still open closes at the last bar."""
+    close = columns["close"]
+    flips = np.diff(signal, prepend=0.0)
+    entries = np.flatnonzero(flips > 0)
+    exits = np.flatnonzero(flips < 0)
+    times = np.datetime_as_string(columns["datetime"], unit="s", timezone="UTC")
+    trades = []
+    for number, entry in enumerate(entries):
+        exit_ = int(exits[number]) if number < len(exits) else len(close) - 1
+        trades.append({
+            "entryTime": str(times[entry]),
+            "entryPrice": float(close[entry]),
+            "exitTime": str(times[exit_]),
+            "exitPrice": float(close[exit_]),
+            "return": float(close[exit_] / close[entry] * (1.0 - fee) ** 2 - 1.0),
+            "bars": int(exit_ - entry),
+            "open": number >= len(exits),
+        })
+    return trades
+
+
+def run_backtest(strategy, columns, params, fee=0.0):
+    """Backtest one parameter set: stats, trades and aligned equity/return/drawdown arrays."""
+    if len(columns["close"]) == 0:
+        raise ValueError("No bars to backtest")
+    signal = strategy_signal(strategy, columns, params)
+    position, returns = simulate(signal, columns["close"], fee)
+    per_year = periods_per_year(columns["datetime"])
+    stats = {name: _scalar(value) for name, value in summarize(position, returns, per_year).items()}
+    if per_year:
+        years = len(returns) / per_year
+        stats["annualizedReturn"] = float((1.0 + stats["totalReturn"]) ** (1.0 / years) - 1.0) if stats["totalReturn"] > -1 else -1.0
+    trades = list_trades(signal, columns, fee)
+    closed = [trade for trade in trades if not trade["open"]]
+    stats["winRate"] = sum(trade["return"] > 0 for trade in closed) / len(closed) if closed else None
+
+    equity = np.cumprod(1.0 + returns)
+    curve = {
+        "datetime": columns["datetime"],
+        "equity": equity,
+        "returns": returns,
+        "drawdown": equity / np.maximum(np.maximum.accumulate(equity), 1.0) - 1.0,
+        "position": position,
+    }
+    return stats, trades, curve
+
+
+def sweep(strategy, columns, first, second, fee=0.0):
+    """Metrics for every ``first x second`` window pair, as ``{metric: 2-D array}``.
+
+    Indicator rows are computed once per window and the pairs are evaluated
+    by broadcasting them against each other, a block of first-axis windows
+    at a time. Module-level so it can run in a worker process on a slice of
+    ``first``.
+    """
+    close = columns["close"]
+    per_year = periods_per_year(columns["datetime"])
+    if strategy == "ma_crossover":
+        rows, cols = sma_matrix(close, first), sma_matrix(close, second)
+    else:
+        rows, cols = channel_matrix(columns["high"], first, "max"), channel_matrix(columns["low"], second, "min")
+
+    results = {}
+    block = max(1, GRID_CHUNK_CELLS // max(len(second) * len(close), 1))
+    for lo in range(0, len(first), block):
+        upper = rows[lo:lo + block, None, :]
+        if strategy == "ma_crossover":
+            signal = crossover_signal(upper, cols[None, :, :])
+        else:
+            signal = breakout_signal(close, upper, cols[None, :, :])
+        position, returns = simulate(signal, close, fee)
+        for name, values in summarize(position, returns, per_year).items():
+            results.setdefault(name, []).append(values)
+    return {name: np.concatenate(parts) for name, parts in results.items()}
+
+
+def rank_grid(strategy, first, second, metrics, metric="sharpe", top=20):
+    """The ``top`` window pairs by ``metric``; invalid pairs (fast >= slow) are left out."""
+    names = list(STRATEGY_PARAMS[strategy])
+    pairs_first, pairs_second = np.meshgrid(first, second, indexing="ij")
+    valid = ~np.isnan(metrics[metric])
+    if strategy == "ma_crossover":
+        valid &= pairs_first < pairs_second
+    scores = np.where(valid, metrics[metric], -np.inf)
+    # A drawdown is negative, so the best one is also the largest value.
+    order = np.argsort(-scores, axis=None, kind="stable")[:min(top, int(valid.sum()))]
+    ranked = []
+    for flat in order:
+        index = np.unravel_index(flat, scores.shape)
+        ranked.append({
+            names[0]: int(pairs_first[index]),
+            names[1]: int(pairs_second[index]),
+            **{name: _scalar(values[index]) for name, values in metrics.items()},
+        })
+    return ranked, int(valid.sum())
+
+
+def _scalar(value):
+    value = value.item() if isinstance(value, np.generic) or getattr(value, "ndim", None) == 0 else value
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
@@ -0,0 +1,294 @@
+"""Benchmarks for the analytics kernels and HTTP endpoints.
+
+    python benchmark.py                          # kernels + endpoints on the memmap store
+    python benchmark.py --bars 100000 --instruments 50 --repeat 10
+    python benchmark.py --postgres               # endpoints against DATABASE_URL
+    python benchmark.py --compare benchmarks/abc1234.json
+
+Data comes from a seeded random walk, so runs with the same arguments see
+the same bars. Results are written as JSON (one file per commit by default)
+and ``--compare`` reports the p50 change against an earlier file.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from backtest import sweep
+from engine import StrategyState, best_buy_sell, best_trades, moving_average, strategy_batch
+from formats import encode_packed
+from indicators import compute_indicators, parse_indicators
+from ingest import chunked
+from series import columns_to_records, downsample, parse_interval, resample
+
+BENCH_PREFIX = "BENCH"
+# A p50 this much slower than the baseline is reported as a regression.
+REGRESSION_THRESHOLD = 0.10
+
+
+def synthetic_series(length, seed=0, interval="1m", start="2020-01-01", start_price=100.0, volatility=0.001):
+    """Deterministic random-walk OHLCV bars ``interval`` apart.
+
+    Close follows a geometric random walk; each bar opens at the previous
+    close and its high/low extend past the body by a random spread.
+    """
+    rng = np.random.default_rng(seed)
+    step, _ = parse_interval(interval)
+    close = start_price * np.exp(np.cumsum(rng.normal(0.0, volatility, length)))
+    open_ = np.concatenate(([start_price], close[:-1]))[:length]
+    spread = np.abs(rng.normal(0.0, volatility, length)) * close
+    return {
+        "datetime": np.datetime64(start, "ms") + np.arange(length, dtype=np.int64) * step,
+        "open": open_,
+        "high": np.maximum(open_, close) + spread,
+        "low": np.minimum(open_, close) - spread,
+        "close": close,
+        "volume": rng.integers(1_000, 100_000, length, dtype=np.int64),
+    }
+
+
+def synthetic_universe(instruments, length, seed=0, interval="1m"):
+    """``{instrument: columns}`` for ``instruments`` independent walks."""
+    return {
+        f"{BENCH_PREFIX}{index:04d}": synthetic_series(length, seed + index, interval, start_price=50.0 + index % 200)
+        for index in range(instruments)
+    }
+
+
+def measure(fn, repeat, items=1):
+    """Time ``fn`` after one warm-up call, then trace its peak allocations once."""
+    fn()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings = np.array(timings)
+    p50 = float(np.percentile(timings, 50))
+    return {
+        "repeat": repeat,
+        "p50_ms": p50 * 1000,
+        "p99_ms": float(np.percentile(timings, 99)) * 1000,
+        "mean_ms": float(timings.mean()) * 1000,
+        "throughput": items / p50 if p50 else None,
+        "peak_mb": peak / 2**20,
+    }
+
+
+def kernel_benchmarks(columns, universe, repeat, window=3):
+    close = columns["close"]
+    specs = parse_indicators("sma,ema,rsi,macd,bbands,atr")
+    jobs = [(instrument, series["close"]) for instrument, series in universe.items()]
+    universe_bars = sum(len(close_prices) for _, close_prices in jobs)
+    head = {name: array[:-100] for name, array in columns.items()}
+    # Ten years of daily bars, the size a window sweep is usually run on.
+    daily = synthetic_series(2520, interval="1d", volatility=0.02)
+    windows = np.arange(2, 102)
+
+    def incremental():
+        state = StrategyState(window)
+        state.update(head)
+        state.update(columns)
+
+    cases = {
+        "kernel.moving_average": (lambda: moving_average(close, window), len(close)),
+        "kernel.best_buy_sell": (lambda: best_buy_sell(close), len(close)),
+        "kernel.best_trades_k10_fee": (lambda: best_trades(close, 10, fee=0.01), len(close)),
+        "kernel.best_trades_unlimited_fee_cooldown": (lambda: best_trades(close, fee=0.01, cooldown=3), len(close)),
+        "kernel.strategy_state_full_then_100": (incremental, len(close)),
+        "kernel.indicators_all": (lambda: compute_indicators(columns, specs), len(close)),
+        "kernel.resample_1h": (lambda: resample(columns, "1h"), len(close)),
+        "kernel.downsample_2000": (lambda: downsample(columns, 2000), len(close)),
+        "kernel.encode_packed": (lambda: encode_packed(columns), len(close)),
+        "kernel.records_10000": (lambda: columns_to_records({name: array[:10000] for name, array in columns.items()}), 10000),
+        "kernel.strategy_batch_universe": (lambda: strategy_batch(jobs, window), universe_bars),
+        "kernel.backtest_grid_100x100_daily": (lambda: sweep("ma_crossover", daily, windows, windows + 100), len(windows) ** 2),
+    }
+    return {name: measure(fn, repeat, items) for name, (fn, items) in cases.items()}
+
+
+def endpoint_benchmarks(client, instrument, bars, universe, repeat, before_each=None):
+    """Time endpoints through the ASGI app; ``before_each`` can drop caches for cold runs."""
+    packed = {"Accept": "application/x-ohlcv-packed"}
+    cases = {
+        "endpoint.get_stock_data_page": (lambda: client.get("/get-stock-data", params={"instrument": instrument}), 1000),
+        "endpoint.get_stock_data_packed_page": (lambda: client.get("/get-stock-data", params={"instrument": instrument, "limit": 10000}, headers=packed), 10000),
+        "endpoint.get_stock_data_resample_1d": (lambda: client.get("/get-stock-data", params={"instrument": instrument, "interval": "1d"}), bars),
+        "endpoint.get_stock_data_max_points": (lambda: client.get("/get-stock-data", params={"instrument": instrument, "max_points": 2000}), bars),
+        "endpoint.strategy": (lambda: client.get("/strategy", params={"instrument": instrument}), bars),
+        "endpoint.strategy_indicators": (lambda: client.get("/strategy", params={"instrument": instrument, "indicators": "rsi,macd"}), bars),
+        "endpoint.strategy_batch_universe": (lambda: client.post("/strategy/batch", json={"instruments": list(universe)}), sum(len(series["close"]) for series in universe.values())),
+        "endpoint.correlation_universe": (lambda: client.post("/correlation", json={"instruments": list(universe)}), sum(len(series["close"]) for series in universe.values())),
+        "endpoint.export_ndjson": (lambda: client.get("/export-stock-data", params={"instrument": instrument}), bars),
+    }
+    results = {}
+    for name, (request, items) in cases.items():
+        def call(request=request, name=name):
+            if before_each is not None:
+                before_each()
+            response = request()
+            if response.status_code != 200:
+                raise RuntimeError(f"{name} returned {response.status_code}: {response.text[:200]}")
+        results[name] = measure(call, repeat, items)
+    return results
+
+
+def load_dataset(client, store, columns, universe):
+    """Create the benchmark stocks (reusing existing ones) and write their bars."""
+    import main
+
+    async def write():
+        series = {f"{BENCH_PREFIX}-LONG": columns, **universe}
+        for instrument, data in series.items():
+            stock = await main.registry.get(instrument)
+            if stock is None:
+                stock = await store.create_stock(instrument)
+                main.registry.add(stock)
+            if store.columnar:
+                store.append(stock.id, data)
+            else:
+                names = list(data)
+                rows = [
+                    {"stockId": stock.id, **dict(zip(names, values))}
+                    for values in zip(*(data[name].tolist() for name in names))
+                ]
+                for chunk in chunked(rows):
+                    await store.upsert_many(chunk)
+            main.invalidate_stock(stock.id)
+
+    client.portal.call(write)
+
+
+def run_endpoints(args, columns, universe):
+    from fastapi.testclient import TestClient
+
+    import main
+    from registry import InstrumentRegistry
+    from storage import MemmapStorage, PrismaStorage
+
+    with tempfile.TemporaryDirectory() as root:
+        if args.postgres:
+            store = PrismaStorage(main.db)
+        else:
+            store = MemmapStorage(root)
+        main.store = store
+        main.registry = InstrumentRegistry(store)
+
+        with TestClient(main.app) as client:
+            started = time.perf_counter()
+            load_dataset(client, store, columns, universe)
+            print(f"loaded {len(columns['close']) + sum(len(s['close']) for s in universe.values())} bars in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+            instrument = f"{BENCH_PREFIX}-LONG"
+            results = endpoint_benchmarks(client, instrument, len(columns["close"]), universe, args.repeat)
+            if not store.columnar:
+                def drop_caches():
+                    main.series_cache.clear()
+                    main.correlation_cache.clear()
+
+                cold = endpoint_benchmarks(client, instrument, len(columns["close"]), universe, max(1, args.repeat // 4), before_each=drop_caches)
+                results.update({name.replace("endpoint.", "endpoint.cold."): result for name, result in cold.items()})
+            return results
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Rows of ``(name, baseline p50, current p50, ratio, regressed)`` for shared benchmarks."""
+    rows = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None or not before["p50_ms"]:
+            continue
+        ratio = result["p50_ms"] / before["p50_ms"]
+        rows.append((name, before["p50_ms"], result["p50_ms"], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def print_results(results):
+    print(f"{'benchmark':48} {'p50 ms':>10} {'p99 ms':>10} {'items/s':>14} {'peak MB':>9}")
+    for name, result in results.items():
+        throughput = f"{result['throughput']:,.0f}" if result["throughput"] else "-"
+        print(f"{name:48} {result['p50_ms']:10.3f} {result['p99_ms']:10.3f} {throughput:>14} {result['peak_mb']:9.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the strategy kernels and HTTP endpoints.")
+    parser.add_argument("--bars", type=int, default=1_000_000, help="bars in the long single-instrument series")
+    parser.add_argument("--instruments", type=int, default=500, help="instruments in the universe")
+    parser.add_argument("--instrument-bars", type=int, default=2_000, help="bars per universe instrument")
+    parser.add_argument("--interval", default="1m", help="spacing between synthetic bars, e.g. 1m or 1d")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--only", choices=("kernels", "endpoints"))
+    parser.add_argument("--postgres", action="store_true", help="run endpoints against DATABASE_URL instead of a temporary memmap store")
+    parser.add_argument("--output", help="results file (default benchmarks/<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args(argv)
+
+    columns = synthetic_series(args.bars, args.seed, args.interval)
+    universe = synthetic_universe(args.instruments, args.instrument_bars, args.seed + 1, args.interval)
+
+    results = {}
+    if args.only != "endpoints":
+        results.update(kernel_benchmarks(columns, universe, args.repeat))
+    if args.only != "kernels":
+        results.update(run_endpoints(args, columns, universe))
+    print_results(results)
+
+    commit = current_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "storage": "postgres" if args.postgres else "memmap",
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join("benchmarks", f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as handle:
+        json.dump(report, handle, indent=2)
+    print(f"saved {output}")
+
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+        rows = compare(results, baseline["results"], args.threshold)
+        print(f"\ncompared with {baseline['meta']['commit']}")
+        dataset = ("bars", "instruments", "instrument_bars", "interval", "seed")
+        if any(baseline["meta"]["args"].get(key) != getattr(args, key) for key in dataset):
+            print("warning: the baseline was generated with different dataset arguments")
+        for name, before, after, ratio, regressed in rows:
+            print(f"{name:48} {before:10.3f} -> {after:10.3f} ms  x{ratio:.2f}{'  REGRESSION' if regressed else ''}")
+        if args.fail_on_regression and any(row[-1] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+from collections import defaultdict
+
+# Messages buffered per WebSocket before the oldest are dropped.
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "256"))
+
+
+class Subscriber:
+    """One connection: its subscriptions and a bounded outbound queue."""
+
+    def __init__(self, queue_size):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.windows = {}  # instrument -> moving average window
+        self.dropped = 0
+
+    def offer(self, text):
+        if self.queue.full():
+            # A slow client loses its oldest messages instead of stalling publishers.
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(text)
+
+    def send(self, message):
+        self.offer(json.dumps(message, separators=(",", ":")))
+
+
+class BroadcastHub:
+    """In-process fan-out of freshly ingested bars to WebSocket subscribers.
+
+    Each message is encoded once and the same string is queued for every
+    subscriber, so a write costs one computation regardless of audience.
+    Messages are built in a worker thread but published from the event
+    loop, the same loop that (un)subscribes sockets and drains the queues.
+    """
+
+    def __init__(self, queue_size=STREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+
+    def connect(self):
+        return Subscriber(self.queue_size)
+
+    def disconnect(self, subscriber):
+        for instrument in list(subscriber.windows):
+            self.unsubscribe(subscriber, instrument)
+
+    def subscribe(self, subscriber, instrument, window):
+        subscriber.windows[instrument] = window
+        self._subscribers[instrument].add(subscriber)
+
+    def unsubscribe(self, subscriber, instrument):
+        subscriber.windows.pop(instrument, None)
+        subscribers = self._subscribers.get(instrument)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[instrument]
+
+    def windows(self, instrument):
+        """Distinct moving average windows requested for ``instrument``."""
+        return {subscriber.windows[instrument] for subscriber in self._subscribers.get(instrument, ())}
+
+    def publish(self, instrument, window, message):
+        text = json.dumps(message, separators=(",", ":"))
+        for subscriber in self._subscribers.get(instrument, ()):
+            if subscriber.windows.get(instrument) == window:
+                subscriber.offer(text)
+
+
+async def forward(websocket, subscriber):
+    """Drain a subscriber's queue into its socket; the only writer on the socket."""
+    while True:
+        await websocket.send_text(await subscriber.queue.get())
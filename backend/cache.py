@@ -0,0 +1,142 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def columns_nbytes(columns):
+    return sum(array.nbytes for array in columns.values())
+
+
+class CachedSeries:
+    """OHLCV buffers with spare capacity at the end and the bars filled so far.
+
+    Appends write past ``length`` in place and only reallocate, doubling the
+    capacity, once the buffers are full, so a live instrument costs
+    amortized O(new bars). ``columns`` are read-only views of the filled
+    prefix; bars already handed out are never written again, so readers on
+    other threads keep a consistent snapshot.
+    """
+
+    def __init__(self, columns):
+        self.buffers = columns
+        self.length = self.capacity
+        self.columns = self._views()
+
+    @property
+    def capacity(self):
+        return len(next(iter(self.buffers.values())))
+
+    @property
+    def nbytes(self):
+        return columns_nbytes(self.buffers)
+
+    def extend(self, columns):
+        needed = self.length + len(next(iter(columns.values())))
+        if needed > self.capacity:
+            grown = {}
+            for name, buffer in self.buffers.items():
+                grown[name] = np.empty(max(needed, 2 * self.capacity), dtype=buffer.dtype)
+                grown[name][:self.length] = buffer[:self.length]
+            self.buffers = grown
+        for name, buffer in self.buffers.items():
+            buffer[self.length:needed] = columns[name]
+        self.length = needed
+        self.columns = self._views()
+
+    def _views(self):
+        views = {name: buffer[:self.length] for name, buffer in self.buffers.items()}
+        for array in views.values():
+            array.flags.writeable = False
+        return views
+
+
+class SeriesCache:
+    """LRU cache of per-instrument OHLCV arrays bounded by a memory budget.
+
+    Cached arrays are marked read-only because every request shares them.
+    The budget counts buffer capacity, spare room for appends included.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, stock_id):
+        with self._lock:
+            entry = self._entries.get(stock_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(stock_id)
+            self.hits += 1
+            return entry.columns
+
+    def peek(self, stock_id):
+        """The cached columns without touching recency or the hit counters."""
+        entry = self._entries.get(stock_id)
+        return entry.columns if entry is not None else None
+
+    def put(self, stock_id, columns):
+        size = columns_nbytes(columns)
+        for array in columns.values():
+            array.flags.writeable = False
+        with self._lock:
+            self._discard(stock_id)
+            if size > self.max_bytes:
+                return
+            self._entries[stock_id] = CachedSeries(columns)
+            self.nbytes += size
+            self._evict()
+
+    def append(self, stock_id, columns):
+        """Extend a cached series with bars newer than its last bar.
+
+        Returns False when nothing was appended; a cached series that would
+        need rows inserted before its end is dropped instead.
+        """
+        with self._lock:
+            entry = self._entries.get(stock_id)
+            if entry is None or len(columns["datetime"]) == 0:
+                return False
+            timestamps = columns["datetime"]
+            cached = entry.columns["datetime"]
+            in_order = bool(np.all(timestamps[1:] > timestamps[:-1]))
+            if not in_order or (len(cached) and timestamps[0] <= cached[-1]):
+                self._discard(stock_id)
+                return False
+            before = entry.nbytes
+            entry.extend(columns)
+            self.nbytes += entry.nbytes - before
+            self._entries.move_to_end(stock_id)
+            self._evict()
+            return stock_id in self._entries
+
+    def invalidate(self, stock_id):
+        with self._lock:
+            self._discard(stock_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __contains__(self, stock_id):
+        return stock_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _discard(self, stock_id):
+        entry = self._entries.pop(stock_id, None)
+        if entry is not None:
+            self.nbytes -= entry.nbytes
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
@@ -0,0 +1,55 @@
+import asyncio
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one in-flight call.
+
+    The first caller for a key starts ``fn`` as a task; callers arriving
+    while it runs await the same task instead of starting their own, and all
+    of them get its result or its exception. The key is dropped as soon as
+    the task finishes, so nothing is cached beyond the flight itself.
+
+    Every caller receives the same result object, so results must be
+    values nobody mutates afterwards (encoded bytes, dicts that are only
+    serialized), never per-request objects such as a ``Response``.
+
+    Waiters are shielded from each other: a caller that is cancelled (a
+    client disconnecting) stops waiting without cancelling the shared call.
+    Flights are registered by callers and cleared by done callbacks, all on
+    one event loop, so the table is never read mid-update.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.started = 0
+        self.shared = 0
+
+    def __len__(self):
+        return len(self._flights)
+
+    async def do(self, key, fn, *args, **kwargs):
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._flights[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.started += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def forget(self, match):
+        """Let callers for keys where ``match(key)`` is true start a fresh flight.
+
+        Calls already running still complete for the callers awaiting them.
+        Used when a write makes an in-flight read stale.
+        """
+        for key in [key for key in self._flights if match(key)]:
+            del self._flights[key]
+
+    def _finish(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # Every waiter may have been cancelled; mark the outcome as retrieved.
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,86 @@
+import numpy as np
+
+# Largest aligned datetime x instrument grid built in one request (~160 MB of float64).
+CORRELATION_MAX_CELLS = 20_000_000
+
+
+def align_closes(series, window=None):
+    """Close prices of every series on their shared (union) datetime index.
+
+    Returns ``(timestamps, closes)`` with one column per series and NaN where
+    a series has no bar. With ``window`` only the last ``window + 1``
+    timestamps are kept, enough for ``window`` returns.
+    """
+    timestamps = np.unique(np.concatenate([columns["datetime"].view(np.int64) for columns in series]))
+    if window is not None:
+        timestamps = timestamps[-(window + 1):]
+    if len(timestamps) * len(series) > CORRELATION_MAX_CELLS:
+        raise ValueError(
+            f"{len(timestamps)} timestamps x {len(series)} instruments is too large; "
+            "pass a window or a coarser interval"
+        )
+    closes = np.full((len(timestamps), len(series)), np.nan)
+    for column, columns in enumerate(series):
+        bars = columns["datetime"].view(np.int64)
+        first = np.searchsorted(bars, timestamps[0]) if len(timestamps) else len(bars)
+        bars = bars[first:]
+        closes[np.searchsorted(timestamps, bars), column] = columns["close"][first:]
+    return timestamps, closes
+
+
+def log_returns(closes):
+    """Bar-to-bar log returns on the aligned grid; NaN unless both bars exist."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.diff(np.log(closes), axis=0)
+
+
+def pairwise_moments(returns):
+    """Covariance and correlation over pairwise-complete observations.
+
+    Every pair uses the rows where both instruments have a return, yet the
+    whole matrix comes from four matrix products instead of N^2 pair scans.
+    Pairs with fewer than two shared returns are NaN. Also returns the
+    shared-row counts.
+    """
+    present = ~np.isnan(returns)
+    mask = present.astype(np.float64)
+    values = np.where(present, returns, 0.0)
+    # Centering first keeps the sums small so the products cancel precisely.
+    values -= mask * (values.sum(axis=0) / np.maximum(mask.sum(axis=0), 1.0))
+
+    counts = mask.T @ mask
+    sums = values.T @ mask
+    squares = (values * values).T @ mask
+    products = values.T @ values
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = sums / counts
+        comoment = products - sums * means.T
+        spread = squares - sums * means
+        covariance = comoment / (counts - 1)
+        correlation = comoment / np.sqrt(spread * spread.T)
+    enough = counts >= 2
+    covariance[~enough] = np.nan
+    correlation[~enough | ~(spread > 0) | ~(spread.T > 0)] = np.nan
+    np.clip(correlation, -1.0, 1.0, out=correlation)
+    diagonal = np.diag_indices_from(correlation)
+    correlation[diagonal] = np.where(np.isnan(correlation[diagonal]), np.nan, 1.0)
+    return covariance, correlation, counts.astype(np.int64)
+
+
+def correlation_matrix(series, window=None):
+    """Align ``series`` (a list of OHLCV columns) and compute their return moments.
+
+    Returns the matrices plus the first and last timestamp used and the
+    number of aligned return rows.
+    """
+    timestamps, closes = align_closes(series, window)
+    returns = log_returns(closes)
+    covariance, correlation, counts = pairwise_moments(returns)
+    return {
+        "covariance": covariance,
+        "correlation": correlation,
+        "counts": counts,
+        "observations": len(returns),
+        "start": timestamps[0] if len(timestamps) else None,
+        "end": timestamps[-1] if len(timestamps) else None,
+    }
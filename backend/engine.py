@@ -0,0 +1,260 @@
+import threading
+
+import numpy as np
+
+from indicators import sma
+
+
+def moving_average(close_prices, window_size=3):
+    """Simple moving average over full windows only (``n - window + 1`` values)."""
+    close_prices = np.asarray(close_prices, dtype=np.float64)
+    return sma(close_prices, window_size)[window_size - 1:]
+
+
+def best_buy_sell(close_prices):
+    """Single best buy/sell pair in O(n) without a Python-level loop.
+
+    Matches the original scan: the earliest sell bar reaching the maximum
+    profit, bought at the earliest minimum before it. Returns zeros when no
+    trade is profitable.
+    """
+    close_prices = np.asarray(close_prices, dtype=np.float64)
+    if close_prices.size == 0:
+        return {"BuyIndex": 0, "SellIndex": 0, "Profit": 0}
+
+    profits = close_prices - np.minimum.accumulate(close_prices)
+    sell_index = int(np.argmax(profits))
+    max_profit = float(profits[sell_index])
+    if max_profit <= 0:
+        return {"BuyIndex": 0, "SellIndex": 0, "Profit": 0}
+
+    buy_index = int(np.argmin(close_prices[:sell_index + 1]))
+    return {"BuyIndex": buy_index, "SellIndex": sell_index, "Profit": max_profit}
+
+
+# Backtracking keeps two int32 pointers per bar and trade layer; cap that memory.
+BEST_TRADES_MAX_CELLS = 25_000_000
+
+
+def best_trades(close_prices, max_trades=None, fee=0.0, cooldown=0):
+    """Most profitable set of non-overlapping long trades over ``close_prices``.
+
+    ``max_trades`` bounds the number of round trips (``None`` for unlimited),
+    ``fee`` is charged once per round trip in price units and ``cooldown`` is
+    the number of bars that must pass after a sell before the next buy.
+    Ties resolve to the earliest bars and to fewer trades, so the single
+    trade without costs is the ``best_buy_sell`` pair.
+    """
+    close_prices = np.asarray(close_prices, dtype=np.float64)
+    n = close_prices.size
+    solver = trades_solver(n, max_trades, fee, cooldown)
+    if solver == "layers":
+        if n * max_trades > BEST_TRADES_MAX_CELLS:
+            raise ValueError(f"max_trades={max_trades} is too large for {n} bars; omit it for unlimited trades")
+        pairs = _best_k_trades(close_prices, max_trades, fee, cooldown)
+    elif solver == "runs":
+        pairs = _rising_runs(close_prices)
+    else:
+        pairs = _best_unlimited_trades(close_prices, fee, cooldown)
+
+    trades = [
+        {"BuyIndex": int(buy), "SellIndex": int(sell), "Profit": float(close_prices[sell] - close_prices[buy] - fee)}
+        for buy, sell in pairs
+    ]
+    # Rounding can let a break-even trade through; dropping it keeps the rest valid.
+    trades = [trade for trade in trades if trade["Profit"] > 0]
+    return {"Trades": trades, "TotalProfit": sum(trade["Profit"] for trade in trades)}
+
+
+def trades_solver(n, max_trades=None, fee=0.0, cooldown=0):
+    """Which ``best_trades`` solver handles ``n`` bars with these options.
+
+    ``"layers"`` and ``"runs"`` are vectorized; ``"loop"`` is a Python loop
+    over the bars, so callers keep long series of it off the event loop.
+    """
+    if max_trades is not None and max_trades < n // 2:
+        return "layers"
+    if fee == 0 and cooldown == 0:
+        return "runs"
+    return "loop"
+
+
+def _running_argmax(values, index):
+    """Earliest index of the running maximum, alongside the maximum itself."""
+    running = np.maximum.accumulate(values)
+    records = np.empty(values.size, dtype=bool)
+    records[0] = True
+    np.greater(values[1:], running[:-1], out=records[1:])
+    return running, np.maximum.accumulate(np.where(records, index, 0))
+
+
+def _best_k_trades(close_prices, max_trades, fee, cooldown):
+    """Layered DP: layer ``j`` holds the best profit by each bar with at most ``j`` trades.
+
+    Each layer is two running maxima over the bars, so the whole solve is
+    O(n*k) vectorized work; per-layer pointers are kept for backtracking.
+    """
+    n = close_prices.size
+    index = np.arange(n, dtype=np.int32)
+    flat = np.zeros(n)
+    layers = []
+    for _ in range(max_trades):
+        # Cash available to buy at bar u: the previous layer's profit cooldown + 1 bars earlier.
+        available = np.zeros(n)
+        available[cooldown + 1:] = flat[:max(n - cooldown - 1, 0)]
+        hold, buy_at = _running_argmax(available - close_prices, index)
+        # Sell on a later bar than the buy: bar t sells what was held by t - 1.
+        held = np.concatenate(([-np.inf], hold[:-1]))
+        sold, sell_at = _running_argmax(held + close_prices - fee, index)
+        improved = sold > flat
+        if not improved.any():
+            break
+        layers.append((np.where(improved, sell_at, -1), buy_at))
+        flat = np.where(improved, sold, flat)
+
+    pairs = []
+    last = n - 1
+    for sell_at, buy_at in reversed(layers):
+        if last < 0:
+            break
+        sell = sell_at[last]
+        if sell < 0:
+            continue
+        buy = buy_at[sell - 1]
+        pairs.append((buy, sell))
+        last = buy - cooldown - 1
+    return pairs[::-1]
+
+
+def _rising_runs(close_prices):
+    """Without costs every rising run is its own trade, from its low to its high."""
+    rising = np.diff(close_prices) > 0
+    edges = np.diff(np.concatenate(([False], rising, [False])).astype(np.int8))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+
+def _best_unlimited_trades(close_prices, fee, cooldown):
+    """Hold/flat state machine over the bars, O(n) with one pointer pair per bar."""
+    prices = close_prices.tolist()
+    n = len(prices)
+    flat_history = [0.0] * n
+    buy_at = [0] * n
+    sell_at = [-1] * n
+    flat, hold, buy, sell = 0.0, -np.inf, 0, -1
+    for t, price in enumerate(prices):
+        if hold + price - fee > flat:
+            flat, sell = hold + price - fee, t
+        # The buy behind a sell at t, recorded before bar t can replace it.
+        buy_at[t] = buy
+        available = flat_history[t - cooldown - 1] if t > cooldown else 0.0
+        if available - price > hold:
+            hold, buy = available - price, t
+        flat_history[t] = flat
+        sell_at[t] = sell
+
+    pairs = []
+    last = n - 1
+    while last >= 0 and sell_at[last] >= 0:
+        sell = sell_at[last]
+        pairs.append((buy_at[sell], sell))
+        last = buy_at[sell] - cooldown - 1
+    return pairs[::-1]
+
+
+class StrategyState:
+    """Moving average and best buy/sell folded incrementally over a series.
+
+    ``update`` only touches bars appended since the previous call, so a live
+    instrument costs O(new bars). A series whose already-folded prefix no
+    longer matches (rows inserted or removed before the end) is rejected by
+    ``matches`` and must be rebuilt from scratch. ``snapshot`` and ``report``
+    are the thread-safe entry points used from the analytics pool.
+    """
+
+    def __init__(self, window_size=3):
+        self.window_size = window_size
+        self.count = 0
+        self.last_timestamp = None
+        self._tail = np.empty(0)
+        self._moving_avg = np.empty(16)
+        self._ma_count = 0
+        self._min_price = np.inf
+        self._min_index = 0
+        self._best = {"BuyIndex": 0, "SellIndex": 0, "Profit": 0}
+        self._lock = threading.Lock()
+
+    def matches(self, columns):
+        if len(columns["close"]) < self.count:
+            return False
+        if self.count == 0:
+            return True
+        return columns["datetime"][self.count - 1] == self.last_timestamp
+
+    def update(self, columns):
+        close_prices = np.asarray(columns["close"][self.count:], dtype=np.float64)
+        if close_prices.size == 0:
+            return self
+        offset = self.count
+
+        extended = np.concatenate((self._tail, close_prices))
+        self._push_moving_average(moving_average(extended, self.window_size))
+        self._tail = extended[-(self.window_size - 1):] if self.window_size > 1 else np.empty(0)
+
+        running_min = np.minimum(self._min_price, np.minimum.accumulate(close_prices))
+        profits = close_prices - running_min
+        sell = int(np.argmax(profits))
+        if profits[sell] > self._best["Profit"]:
+            head = close_prices[:sell + 1]
+            buy = int(np.argmin(head))
+            buy_index = offset + buy if head[buy] < self._min_price else self._min_index
+            self._best = {"BuyIndex": buy_index, "SellIndex": offset + sell, "Profit": float(profits[sell])}
+
+        lowest = int(np.argmin(close_prices))
+        if close_prices[lowest] < self._min_price:
+            self._min_price = float(close_prices[lowest])
+            self._min_index = offset + lowest
+
+        self.count = len(columns["close"])
+        self.last_timestamp = columns["datetime"][self.count - 1]
+        return self
+
+    def snapshot(self, columns):
+        """Fold any new bars and return ``(moving_average, best_buy_sell)``."""
+        with self._lock:
+            self.update(columns)
+            return self.moving_average(), self.best_buy_sell()
+
+    def report(self, columns):
+        """Like ``snapshot`` but JSON-ready."""
+        moving_avg, best = self.snapshot(columns)
+        return {"MovingAverage": moving_avg.tolist(), "BestBuySell": best}
+
+    def moving_average(self):
+        return self._moving_avg[:self._ma_count]
+
+    def best_buy_sell(self):
+        return dict(self._best)
+
+    def _push_moving_average(self, values):
+        needed = self._ma_count + len(values)
+        if needed > len(self._moving_avg):
+            grown = np.empty(max(needed, 2 * len(self._moving_avg)))
+            grown[:self._ma_count] = self._moving_avg[:self._ma_count]
+            self._moving_avg = grown
+        self._moving_avg[self._ma_count:needed] = values
+        self._ma_count = needed
+
+
+def strategy_batch(jobs, window_size=3, include_moving_average=False):
+    """Run the strategy over ``[(key, close_prices)]`` jobs.
+
+    Module-level so it can be shipped to worker processes as one task per
+    chunk of instruments.
+    """
+    results = {}
+    for key, close_prices in jobs:
+        result = {"BestBuySell": best_buy_sell(close_prices)}
+        if include_moving_average:
+            result["MovingAverage"] = moving_average(close_prices, window_size)
+        results[key] = result
+    return results
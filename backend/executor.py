@@ -0,0 +1,86 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+ANALYTICS_THREADS = int(os.getenv("ANALYTICS_THREADS", str(min(4, os.cpu_count() or 1))))
+ANALYTICS_PROCESSES = int(os.getenv("ANALYTICS_PROCESSES", str(os.cpu_count() or 1)))
+# Jobs allowed to be running or queued per pool before requests are turned away.
+ANALYTICS_MAX_PENDING = int(os.getenv("ANALYTICS_MAX_PENDING", "64"))
+
+
+class ExecutorSaturated(Exception):
+    pass
+
+
+class AnalyticsPool:
+    """An executor with a bound on in-flight jobs.
+
+    The pending count is only touched from the event loop, so it needs no lock.
+    """
+
+    def __init__(self, name, factory, max_pending):
+        self.name = name
+        self.max_pending = max_pending
+        self.pending = 0
+        self._factory = factory
+        self._executor = None
+
+    def executor(self):
+        if self._executor is None:
+            self._executor = self._factory()
+        return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        if self.pending >= self.max_pending:
+            raise ExecutorSaturated(f"{self.name} pool has {self.pending} pending jobs")
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor(), partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+# NumPy kernels release the GIL, so threads give real parallelism for them.
+threads = AnalyticsPool(
+    "thread",
+    lambda: ThreadPoolExecutor(max_workers=ANALYTICS_THREADS, thread_name_prefix="analytics"),
+    ANALYTICS_MAX_PENDING,
+)
+# Pure-Python work needs separate interpreters; spawned workers never inherit the event loop.
+processes = AnalyticsPool(
+    "process",
+    lambda: ProcessPoolExecutor(max_workers=ANALYTICS_PROCESSES, mp_context=multiprocessing.get_context("spawn")),
+    ANALYTICS_MAX_PENDING,
+)
+
+
+async def run_in_thread(fn, *args, **kwargs):
+    return await threads.run(fn, *args, **kwargs)
+
+
+async def run_in_process(fn, *args, **kwargs):
+    return await processes.run(fn, *args, **kwargs)
+
+
+def balanced_chunks(items, sizes, count):
+    """Split ``items`` into at most ``count`` chunks of similar total ``sizes``."""
+    chunks = [[] for _ in range(min(count, len(items)))]
+    loads = [0] * len(chunks)
+    for size, item in sorted(zip(sizes, items), key=lambda pair: -pair[0]):
+        lightest = loads.index(min(loads))
+        chunks[lightest].append(item)
+        loads[lightest] += size
+    return [chunk for chunk in chunks if chunk]
+
+
+def shutdown():
+    threads.shutdown()
+    processes.shutdown()
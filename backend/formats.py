@@ -0,0 +1,121 @@
+import csv
+import io
+import json
+import struct
+
+import numpy as np
+from fastapi import Response
+
+from series import COLUMNS, columns_to_records
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow output is optional; packed and JSON always work.
+    pa = None
+
+ARROW_AVAILABLE = pa is not None
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+CSV_MEDIA_TYPE = "text/csv"
+CSV_HEADER = ",".join(COLUMNS) + "\n"
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PACKED_MEDIA_TYPE = "application/x-ohlcv-packed"
+PACKED_MAGIC = b"OHLC"
+
+
+def encode_ndjson(columns):
+    records = columns_to_records(columns)
+    return "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+
+
+def encode_csv(columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerows(tuple(record.values()) for record in columns_to_records(columns))
+    return buffer.getvalue()
+
+
+def negotiate(accept):
+    """Pick ``arrow``, ``packed`` or ``json`` from an Accept header."""
+    accept = (accept or "").lower()
+    if ARROW_MEDIA_TYPE in accept:
+        return "arrow"
+    if PACKED_MEDIA_TYPE in accept:
+        return "packed"
+    return "json"
+
+
+def _little_endian(array):
+    array = np.ascontiguousarray(array)
+    if array.dtype.kind == "M":
+        array = array.view(np.int64)
+    return array.astype(array.dtype.newbyteorder("<"), copy=False)
+
+
+def encode_packed(arrays, metadata=None):
+    """Pack named 1-D arrays into one buffer.
+
+    Layout: ``OHLC`` magic, little-endian uint32 header length, a JSON header
+    describing each column (name, NumPy dtype string, length, byte offset),
+    then the raw little-endian column bytes, each padded to 8 bytes. Datetime
+    columns travel as int64 epoch milliseconds.
+    """
+    header_columns, buffers, offset = [], [], 0
+    for name, array in arrays.items():
+        column = {"name": name}
+        if np.asarray(array).dtype.kind == "M":
+            column["type"] = "datetime64[ms]"
+            array = np.asarray(array).astype("datetime64[ms]")
+        array = _little_endian(array)
+        padding = -array.nbytes % 8
+        column.update({"dtype": array.dtype.str, "length": len(array), "offset": offset})
+        header_columns.append(column)
+        buffers.append(memoryview(array).cast("B"))
+        buffers.append(b"\0" * padding)
+        offset += array.nbytes + padding
+
+    header = json.dumps({"columns": header_columns, "metadata": metadata or {}}).encode()
+    header += b" " * (-(len(PACKED_MAGIC) + 4 + len(header)) % 8)
+    return b"".join([PACKED_MAGIC, struct.pack("<I", len(header)), header, *buffers])
+
+
+def decode_packed(payload):
+    """Inverse of ``encode_packed``; arrays are views over ``payload``."""
+    if payload[:4] != PACKED_MAGIC:
+        raise ValueError("Not a packed OHLCV payload")
+    (header_length,) = struct.unpack_from("<I", payload, 4)
+    body_start = 8 + header_length
+    header = json.loads(bytes(payload[8:body_start]))
+    arrays = {}
+    for column in header["columns"]:
+        array = np.frombuffer(payload, dtype=column["dtype"], count=column["length"], offset=body_start + column["offset"])
+        if "type" in column:
+            array = array.view(column["type"])
+        arrays[column["name"]] = array
+    return arrays, header["metadata"]
+
+
+def encode_arrow(arrays, metadata=None):
+    """Serialize equal-length arrays as a single Arrow IPC stream record batch."""
+    batch = pa.record_batch(
+        [pa.array(np.ascontiguousarray(array)) for array in arrays.values()],
+        names=list(arrays),
+    )
+    batch = batch.replace_schema_metadata({"metadata": json.dumps(metadata or {})})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue()
+
+
+def encode_binary(fmt, arrays, metadata=None):
+    """Encoded body and media type for a binary format."""
+    if fmt == "arrow":
+        return encode_arrow(arrays, metadata).to_pybytes(), ARROW_MEDIA_TYPE
+    return encode_packed(arrays, metadata), PACKED_MEDIA_TYPE
+
+
+def binary_response(fmt, arrays, metadata=None, headers=None):
+    content, media_type = encode_binary(fmt, arrays, metadata)
+    return Response(content=content, media_type=media_type, headers=headers)
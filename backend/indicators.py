@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+# Default parameters per indicator; their types define how query values are parsed.
+INDICATOR_PARAMS = {
+    "sma": (20,),
+    "ema": (20,),
+    "rsi": (14,),
+    "macd": (12, 26, 9),
+    "bbands": (20, 2.0),
+    "atr": (14,),
+}
+
+
+def parse_indicators(spec):
+    """Parse ``sma:20,ema:50,macd:12:26:9`` into ``[(key, name, params)]``."""
+    parsed = []
+    for item in filter(None, (part.strip().lower() for part in spec.split(","))):
+        name, *raw_params = item.split(":")
+        if name not in INDICATOR_PARAMS:
+            raise ValueError(f"Unknown indicator '{name}', expected one of {', '.join(INDICATOR_PARAMS)}")
+        defaults = INDICATOR_PARAMS[name]
+        if len(raw_params) > len(defaults):
+            raise ValueError(f"Too many parameters for '{name}'")
+        params = list(defaults)
+        try:
+            for i, raw in enumerate(raw_params):
+                params[i] = type(defaults[i])(raw)
+        except ValueError:
+            raise ValueError(f"Invalid parameters for '{item}'")
+        if any(param <= 0 for param in params):
+            raise ValueError(f"Parameters for '{item}' must be positive")
+        key = ":".join([name] + [f"{param:g}" for param in params])
+        parsed.append((key, name, tuple(params)))
+    return parsed
+
+
+def _rolling_sum(values, window):
+    sums = np.cumsum(np.concatenate(([0.0], values)))
+    return sums[window:] - sums[:-window]
+
+
+def sma(values, window):
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        # Shift by the first value so the running sum stays small and precise.
+        out[window - 1:] = _rolling_sum(values - values[0], window) / window + values[0]
+    return out
+
+
+def ema(values, span):
+    return pd.Series(values).ewm(span=span, adjust=False).mean().to_numpy()
+
+
+def wilder(values, window):
+    return pd.Series(values).ewm(alpha=1.0 / window, adjust=False).mean().to_numpy()
+
+
+def rsi(close, window):
+    out = np.full(len(close), np.nan)
+    if len(close) <= window:
+        return out
+    delta = np.diff(close)
+    avg_gain = wilder(np.clip(delta, 0, None), window)
+    avg_loss = wilder(np.clip(-delta, 0, None), window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    values[avg_loss == 0] = 100.0
+    out[window:] = values[window - 1:]
+    return out
+
+
+def macd(close, fast, slow, signal):
+    line = ema(close, fast) - ema(close, slow)
+    signal_line = ema(line, signal)
+    return {"macd": line, "signal": signal_line, "histogram": line - signal_line}
+
+
+def bbands(close, window, width):
+    middle = sma(close, window)
+    std = np.full(len(close), np.nan)
+    if len(close) >= window:
+        shifted = close - close[0]
+        mean = _rolling_sum(shifted, window) / window
+        variance = _rolling_sum(shifted * shifted, window) / window - mean * mean
+        std[window - 1:] = np.sqrt(np.clip(variance, 0, None))
+    return {"middle": middle, "upper": middle + width * std, "lower": middle - width * std}
+
+
+def atr(high, low, close, window):
+    out = np.full(len(close), np.nan)
+    if len(close) < window:
+        return out
+    prev_close = np.concatenate(([close[0]], close[:-1]))
+    true_range = np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+    out[window - 1:] = wilder(true_range, window)[window - 1:]
+    return out
+
+
+def compute_indicators(columns, specs):
+    """Compute every requested indicator from one set of OHLCV arrays.
+
+    Each result is aligned with the input bars; warm-up values are NaN.
+    """
+    close = columns["close"]
+    results = {}
+    for key, name, params in specs:
+        if name == "sma":
+            results[key] = sma(close, params[0])
+        elif name == "ema":
+            results[key] = ema(close, params[0])
+        elif name == "rsi":
+            results[key] = rsi(close, params[0])
+        elif name == "macd":
+            results[key] = macd(close, *params)
+        elif name == "bbands":
+            results[key] = bbands(close, params[0], params[1])
+        elif name == "atr":
+            results[key] = atr(columns["high"], columns["low"], close, params[0])
+    return results
+
+
+def to_json(values):
+    """Convert an indicator array (or dict of arrays) to lists with NaN as null."""
+    if isinstance(values, dict):
+        return {name: to_json(array) for name, array in values.items()}
+    return np.where(np.isnan(values), None, values).tolist()
@@ -0,0 +1,75 @@
+import csv
+import io
+import json
+
+from pydantic import ValidationError
+
+from schemas import StockDataCreate
+
+BULK_CHUNK_SIZE = 5000
+
+CSV_CONTENT_TYPES = ("text/csv", "application/csv")
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+def parse_body(body: bytes, content_type: str):
+    """Split a request body into raw row candidates.
+
+    Returns ``(rows, rejected)`` where ``rows`` is a list of ``(index, dict)``
+    pairs and ``rejected`` collects rows that could not even be decoded.
+    """
+    media_type = (content_type or "application/json").split(";")[0].strip().lower()
+    text = body.decode("utf-8-sig")
+
+    if media_type in CSV_CONTENT_TYPES:
+        reader = csv.DictReader(io.StringIO(text))
+        return [(i, {k: v for k, v in row.items() if v != ""}) for i, row in enumerate(reader)], []
+
+    if media_type in NDJSON_CONTENT_TYPES:
+        rows, rejected = [], []
+        for i, line in enumerate(text.splitlines()):
+            if not line.strip():
+                continue
+            try:
+                rows.append((i, json.loads(line)))
+            except json.JSONDecodeError as exc:
+                rejected.append({"row": i, "error": f"Invalid JSON: {exc.msg}"})
+        return rows, rejected
+
+    try:
+        payload = json.loads(text)
+    except json.JSONDecodeError as exc:
+        raise ValueError(f"Invalid JSON body: {exc.msg}")
+    if not isinstance(payload, list):
+        raise ValueError("Expected a JSON array of stock data rows")
+    return list(enumerate(payload)), []
+
+
+def validate_rows(rows):
+    """Validate raw rows against ``StockDataCreate``.
+
+    Rows repeating an earlier ``(stockId, datetime)`` in the same batch are
+    rejected so a single bad duplicate does not fail a whole chunk insert.
+    """
+    valid, rejected = [], []
+    seen = set()
+    for index, raw in rows:
+        try:
+            row = StockDataCreate.model_validate(raw)
+        except ValidationError as exc:
+            error = exc.errors()[0]
+            field = ".".join(str(part) for part in error["loc"])
+            rejected.append({"row": index, "error": f"{field}: {error['msg']}" if field else error["msg"]})
+            continue
+        key = (row.stockId, row.datetime)
+        if key in seen:
+            rejected.append({"row": index, "error": "Duplicate stockId and datetime in batch"})
+            continue
+        seen.add(key)
+        valid.append((index, row))
+    return valid, rejected
+
+
+def chunked(items, size=BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -0,0 +1,355 @@
+"""Bulk-load OHLCV history files straight into the store, bypassing HTTP.
+
+    python loader.py history/*.csv
+    python loader.py vendor.parquet --mode upsert --workers 8
+    python loader.py HINDALCO.csv --columns datetime=Date,close=Close
+    python loader.py history/*.csv --checkpoint load.json   # rerun to resume
+
+Files need datetime, open, high, low, close and volume columns (rename
+vendor headers with ``--columns``) plus an ``instrument`` column; without
+one, ``--instrument`` or the file name is used. Unknown instruments are
+created. Each file is streamed in chunks by its own worker process, and
+every chunk is validated, deduplicated on (instrument, datetime) and
+written in bulk. The checkpoint file records finished chunks, so an
+interrupted load resumes where it stopped. The default ``ignore`` mode
+makes replaying a chunk harmless.
+
+Every write bumps the stock's version (a trigger on Postgres, the version
+file with memmap), so running API servers notice the load on their next
+read of a stock and drop whatever they had cached for it.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from ingest import BULK_CHUNK_SIZE, chunked
+from series import PRICE_COLUMNS
+from storage import STORAGE_BACKEND, TICK_STORE_PATH, create_storage
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # CSV loading works without pyarrow.
+    pq = None
+
+LOAD_CHUNK_ROWS = 100_000
+REQUIRED_COLUMNS = ("datetime",) + PRICE_COLUMNS + ("volume",)
+
+
+def read_chunks(path, chunk_rows, skip_chunks=0, text_columns=("instrument",)):
+    """Yield DataFrames of up to ``chunk_rows`` rows, skipping finished chunks.
+
+    ``text_columns`` are read as strings so codes like ``0005`` survive.
+    """
+    if path.endswith((".parquet", ".pq")):
+        if pq is None:
+            raise ValueError("Parquet input requires pyarrow")
+        for index, batch in enumerate(pq.ParquetFile(path).iter_batches(batch_size=chunk_rows)):
+            if index >= skip_chunks:
+                yield batch.to_pandas()
+        return
+    # Skipped rows are only scanned for line ends, not parsed.
+    yield from pd.read_csv(
+        path, chunksize=chunk_rows, skiprows=range(1, skip_chunks * chunk_rows + 1), dtype={name: str for name in text_columns},
+    )
+
+
+def clean_chunk(frame, columns=None, instrument=None, fallback_instrument=None):
+    """Normalize, validate and deduplicate one chunk.
+
+    ``instrument`` overrides the instrument column; ``fallback_instrument``
+    only fills in when the file has none.
+
+    Returns ``(frame, rejected)``: the valid rows with UTC datetimes, sorted
+    by instrument and datetime, and a ``Counter`` of rejection reasons.
+    The last row wins among duplicates, as a later upsert would.
+    """
+    frame = frame.rename(columns={source: target for target, source in (columns or {}).items()})
+    if instrument is not None:
+        frame = frame.assign(instrument=instrument)
+    elif "instrument" not in frame.columns and fallback_instrument is not None:
+        frame = frame.assign(instrument=fallback_instrument)
+    missing = [name for name in ("instrument",) + REQUIRED_COLUMNS if name not in frame.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+    rejected = Counter()
+    frame = frame[["instrument", *REQUIRED_COLUMNS]].copy()
+    frame["instrument"] = frame["instrument"].astype("string").str.strip()
+    frame["datetime"] = pd.to_datetime(frame["datetime"], utc=True, errors="coerce", format="mixed")
+    for name in PRICE_COLUMNS + ("volume",):
+        frame[name] = pd.to_numeric(frame[name], errors="coerce")
+
+    checks = {
+        "missing instrument": frame["instrument"].isna() | (frame["instrument"] == ""),
+        "invalid datetime": frame["datetime"].isna(),
+        "invalid price": ~np.isfinite(frame[list(PRICE_COLUMNS)].to_numpy(dtype=np.float64, na_value=np.nan)).all(axis=1),
+        "invalid volume": ~np.isfinite(frame["volume"].to_numpy(dtype=np.float64, na_value=np.nan))
+        | (frame["volume"].fillna(0) % 1 != 0) | (frame["volume"].fillna(0) < 0),
+    }
+    bad = np.zeros(len(frame), dtype=bool)
+    for reason, mask in checks.items():
+        mask = np.asarray(mask, dtype=bool) & ~bad
+        rejected[reason] += int(mask.sum())
+        bad |= mask
+    frame = frame[~bad]
+
+    duplicated = frame.duplicated(["instrument", "datetime"], keep="last").to_numpy()
+    rejected["duplicate"] += int(duplicated.sum())
+    frame = frame[~duplicated].astype({"volume": np.int64})
+    return frame.sort_values(["instrument", "datetime"], kind="stable"), +rejected
+
+
+async def resolve_stocks(store, known, instruments):
+    """Map instruments to stock ids, creating the missing stocks.
+
+    Another worker may create the same stock concurrently; a failed create
+    is followed by a lookup, so either way the id is found.
+    """
+    unknown = [instrument for instrument in instruments if instrument not in known]
+    if not unknown:
+        return
+    for stock in await store.find_stocks(instruments=unknown):
+        known[stock.instrument] = stock.id
+    for instrument in unknown:
+        if instrument in known:
+            continue
+        try:
+            known[instrument] = (await store.create_stock(instrument)).id
+        except Exception:
+            stocks = await store.find_stocks(instruments=[instrument])
+            if not stocks:
+                raise
+            known[instrument] = stocks[0].id
+
+
+async def write_chunk(store, frame, known, mode):
+    """Write one cleaned chunk and bring its rollups up to date; returns write counts."""
+    await resolve_stocks(store, known, frame["instrument"].unique().tolist())
+    stock_ids = frame["instrument"].map(known).to_numpy(dtype=np.int64)
+    datetimes = frame["datetime"].dt.tz_convert("UTC").dt.to_pydatetime()
+    values = {name: frame[name].tolist() for name in PRICE_COLUMNS + ("volume",)}
+    rows = [
+        {"stockId": stock_id, "datetime": moment, **{name: values[name][i] for name in values}}
+        for i, (stock_id, moment) in enumerate(zip(stock_ids.tolist(), datetimes))
+    ]
+
+    counts = Counter()
+    for batch in chunked(rows, BULK_CHUNK_SIZE):
+        if mode == "insert":
+            counts["inserted"] += await store.insert_many(batch)
+        else:
+            result = await store.upsert_many(batch, ignore=mode == "ignore")
+            counts.update({key: result[key] for key in ("inserted", "updated", "skipped")})
+
+    if store.rollups and (counts["inserted"] or counts["updated"]):
+        timestamps = frame["datetime"].dt.tz_localize(None).to_numpy().astype("datetime64[ms]").view(np.int64)
+        for stock_id in np.unique(stock_ids):
+            selected = timestamps[stock_ids == stock_id]
+            await store.rebuild_rollups(int(stock_id), int(selected.min()), int(selected.max()))
+    return {key: counts[key] for key in ("inserted", "updated", "skipped")}
+
+
+async def load_file_async(path, options, progress, skip_chunks):
+    from prisma import Prisma
+
+    store = create_storage(Prisma(), options["backend"], options["store_path"])
+    await store.connect()
+    known = {}
+    # A file without an instrument column is taken to hold the instrument its name says.
+    fallback = os.path.splitext(os.path.basename(path))[0]
+    text_columns = (options["columns"].get("instrument", "instrument"),)
+    try:
+        chunks = read_chunks(path, options["chunk_rows"], skip_chunks, text_columns)
+        for index, frame in enumerate(chunks, start=skip_chunks):
+            started = time.perf_counter()
+            cleaned, rejected = clean_chunk(frame, options["columns"], options["instrument"], fallback)
+            counts = await write_chunk(store, cleaned, known, options["mode"]) if len(cleaned) else {"inserted": 0, "updated": 0, "skipped": 0}
+            progress.put({
+                "type": "chunk", "path": path, "chunk": index, "rows": len(frame),
+                "counts": counts, "rejected": dict(rejected), "seconds": time.perf_counter() - started,
+            })
+    finally:
+        await store.disconnect()
+
+
+def load_file(path, options, progress, skip_chunks=0):
+    """Worker entry point: load one file, reporting each finished chunk to ``progress``."""
+    try:
+        asyncio.run(load_file_async(path, options, progress, skip_chunks))
+    except Exception as exc:
+        progress.put({"type": "error", "path": path, "error": f"{type(exc).__name__}: {exc}"})
+    else:
+        progress.put({"type": "done", "path": path})
+
+
+class Checkpoint:
+    """Per-file progress kept in a JSON file, rewritten atomically after every chunk.
+
+    Only the parent process writes it. A file whose size or mtime changed
+    since it was recorded starts over.
+    """
+
+    def __init__(self, path, chunk_rows):
+        self.path = path
+        self.files = {}
+        if path and os.path.exists(path):
+            with open(path) as handle:
+                state = json.load(handle)
+            if state.get("chunk_rows") == chunk_rows:
+                self.files = state["files"]
+            else:
+                print(f"checkpoint {path} used {state.get('chunk_rows')} rows per chunk; starting over", file=sys.stderr)
+        self.chunk_rows = chunk_rows
+
+    def start(self, path):
+        """Chunks of ``path`` already loaded, or None when the file is finished."""
+        stat = os.stat(path)
+        entry = self.files.get(path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+            entry = self.files[path] = {
+                "size": stat.st_size, "mtime": stat.st_mtime, "chunks": 0, "done": False,
+                "inserted": 0, "updated": 0, "skipped": 0, "rejected": {},
+            }
+        return None if entry["done"] else entry["chunks"]
+
+    def record(self, message):
+        entry = self.files[message["path"]]
+        if message["type"] == "chunk":
+            entry["chunks"] = message["chunk"] + 1
+            for key, count in message["counts"].items():
+                entry[key] += count
+            entry["rejected"] = dict(Counter(entry["rejected"]) + Counter(message["rejected"]))
+        elif message["type"] == "done":
+            entry["done"] = True
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as handle:
+            json.dump({"chunk_rows": self.chunk_rows, "files": self.files}, handle, indent=2)
+        os.replace(temporary, self.path)
+
+
+class Progress:
+    """Consumes worker messages: updates the checkpoint and prints progress lines."""
+
+    def __init__(self, checkpoint, out=sys.stderr):
+        self.checkpoint = checkpoint
+        self.out = out
+        self.started = time.perf_counter()
+        self.rows = 0
+        self.errors = {}
+
+    def put(self, message):
+        name = os.path.basename(message["path"])
+        if message["type"] == "error":
+            self.errors[message["path"]] = message["error"]
+            print(f"{name}: failed: {message['error']}", file=self.out)
+            return
+        self.checkpoint.record(message)
+        if message["type"] == "done":
+            entry = self.checkpoint.files[message["path"]]
+            print(f"{name}: done, {entry['inserted']} inserted, {entry['updated']} updated, {entry['skipped']} skipped, {sum(entry['rejected'].values())} rejected", file=self.out)
+            return
+        self.rows += message["rows"]
+        counts = message["counts"]
+        rate = self.rows / max(time.perf_counter() - self.started, 1e-9)
+        rejected = ", ".join(f"{count} {reason}" for reason, count in sorted(message["rejected"].items())) or "none"
+        print(
+            f"{name}: chunk {message['chunk']} {message['rows']} rows in {message['seconds']:.2f}s "
+            f"({counts['inserted']} new, {counts['updated']} updated, {counts['skipped']} unchanged, rejected: {rejected}); "
+            f"total {self.rows:,} rows at {rate:,.0f} rows/s",
+            file=self.out,
+        )
+
+
+def run(paths, options, workers=1, checkpoint_path=None, out=sys.stderr):
+    """Load ``paths``, one worker process per file; returns the per-file errors."""
+    checkpoint = Checkpoint(checkpoint_path, options["chunk_rows"])
+    pending = []
+    for path in dict.fromkeys(os.path.abspath(path) for path in paths):
+        skip = checkpoint.start(path)
+        if skip is None:
+            print(f"{os.path.basename(path)}: already loaded", file=out)
+        else:
+            pending.append((path, skip))
+    checkpoint.save()
+    progress = Progress(checkpoint, out)
+
+    if options["backend"] == "memmap" and workers > 1:
+        # Memmap files and the stock catalog have a single writer.
+        print("the memmap store is loaded by a single worker", file=out)
+        workers = 1
+    if workers <= 1 or len(pending) <= 1:
+        for path, skip in pending:
+            load_file(path, options, progress, skip)
+        return progress.errors
+
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager, context.Pool(min(workers, len(pending))) as pool:
+        queue = manager.Queue()
+        results = [pool.apply_async(load_file, (path, options, queue, skip)) for path, skip in pending]
+        remaining = len(pending)
+        while remaining:
+            message = queue.get()
+            progress.put(message)
+            if message["type"] in ("done", "error"):
+                remaining -= 1
+        for result in results:
+            result.get()
+    return progress.errors
+
+
+def parse_columns(spec):
+    """``datetime=Date,close=Close`` into ``{"datetime": "Date", "close": "Close"}``."""
+    mapping = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        target, _, source = item.partition("=")
+        if target not in ("instrument",) + REQUIRED_COLUMNS or not source:
+            raise ValueError(f"Invalid column mapping '{item}'")
+        mapping[target] = source
+    return mapping
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-load OHLCV CSV/Parquet files into the store.")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--mode", choices=("ignore", "upsert", "insert"), default="ignore",
+                        help="ignore keeps stored bars, upsert overwrites them, insert fails on duplicates (not resumable mid-chunk)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="files loaded in parallel")
+    parser.add_argument("--chunk-rows", type=int, default=LOAD_CHUNK_ROWS)
+    parser.add_argument("--instrument", help="instrument for files without an instrument column")
+    parser.add_argument("--columns", help="header mapping, e.g. datetime=Date,close=Close")
+    parser.add_argument("--checkpoint", help="JSON progress file; rerunning with it resumes")
+    parser.add_argument("--backend", default=STORAGE_BACKEND, choices=("prisma", "memmap"))
+    parser.add_argument("--store-path", default=TICK_STORE_PATH, help="memmap store directory")
+    args = parser.parse_args(argv)
+
+    try:
+        columns = parse_columns(args.columns)
+    except ValueError as exc:
+        parser.error(str(exc))
+    options = {
+        "mode": args.mode,
+        "chunk_rows": args.chunk_rows,
+        "instrument": args.instrument,
+        "columns": columns,
+        "backend": args.backend,
+        "store_path": args.store_path,
+    }
+    errors = run(args.files, options, args.workers, args.checkpoint)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,75 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from datetime import datetime
+from fastapi.responses import JSONResponse, StreamingResponse
 from prisma import Prisma
-from typing import List
+from cachetools import LRUCache
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Optional
 import numpy as np
+import asyncio
+import json
+import logging
+import os
+
+from schemas import StockCreate, StockDataCreate, StrategyBatchRequest, BacktestRequest, BacktestGridRequest, CorrelationRequest
+from ingest import parse_body, validate_rows, chunked
+from series import rows_to_columns, columns_to_records, slice_columns, resample, downsample, epoch_ms
+from cache import SeriesCache
+from formats import encode_ndjson, encode_csv, NDJSON_MEDIA_TYPE, CSV_MEDIA_TYPE, CSV_HEADER
+from formats import negotiate, binary_response, encode_binary, ARROW_AVAILABLE
+from http_cache import CompressionMiddleware, make_etag, etag_matches, cache_headers
+from engine import StrategyState, strategy_batch, best_trades, trades_solver
+from backtest import resolve_params, resolve_grid, run_backtest, sweep, rank_grid
+from correlation import correlation_matrix
+from storage import BarExists, create_storage
+from broadcast import BroadcastHub, forward
+from registry import InstrumentRegistry
+from rollups import choose_tier, plan_range, from_ms
+from coalesce import SingleFlight
+from metrics import Metrics, MetricsMiddleware, Profiles, TimedRoute, PROFILING_ENABLED, phase, count_rows
+import executor
+from indicators import parse_indicators, compute_indicators, to_json
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
+# Must be set before the routes below are declared.
+app.router.route_class = TimedRoute
 db = Prisma()
+store = create_storage(db)
+registry = InstrumentRegistry(store)
+
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+EXPORT_PAGE_SIZE = 5000
+# Upserts can rewrite bars inside a range that ended long ago, so by default
+# closed ranges revalidate like any other (one version lookup). Deployments
+# that never rewrite history can let clients keep them for a while.
+CLOSED_RANGE_MAX_AGE = int(os.getenv("CLOSED_RANGE_MAX_AGE", "0"))
+# Below this many bars a batch is cheaper to compute inline than to ship to workers.
+BATCH_PROCESS_MIN_BARS = 200_000
+# The looping trade solver holds the GIL for ~1s per million bars; above this it runs in a worker process.
+TRADES_PROCESS_MIN_BARS = 50_000
+# Grid sweeps above this many combinations x bars are split across worker processes.
+BACKTEST_PROCESS_MIN_CELLS = 20_000_000
+BACKTEST_MAX_COMBINATIONS = int(os.getenv("BACKTEST_MAX_COMBINATIONS", "40000"))
+# insert fails on an existing (stockId, datetime); upsert overwrites it; ignore keeps the stored bar.
+WRITE_MODE_PATTERN = "^(insert|upsert|ignore)$"
+
+series_cache = SeriesCache(int(os.getenv("SERIES_CACHE_MB", "256")) * 1024 * 1024)
+# stock id -> store fingerprint the cached series and strategy states reflect
+series_versions = {}
+# (stock id, moving average window) -> StrategyState
+strategy_states = LRUCache(maxsize=int(os.getenv("STRATEGY_STATE_CACHE_SIZE", "1024")))
+# (stock ids, window, interval) -> (stock fingerprints, response). Writes here drop the
+# entries of the stocks they touch; the fingerprints catch writes from anywhere else.
+correlation_cache = LRUCache(maxsize=int(os.getenv("CORRELATION_CACHE_SIZE", "64")))
+# Concurrent identical reads share one in-flight query and computation.
+flights = SingleFlight()
+hub = BroadcastHub()
+metrics = Metrics()
+profiles = Profiles() if PROFILING_ENABLED else None
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,122 +77,907 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["Content-Type", "Accept", "Authorization", "X-Requested-With"],
-    expose_headers=["Content-Type", "Content-Length"],
+    expose_headers=["Content-Type", "Content-Length", "ETag"],
     max_age=600,
 )
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+# Added last so it wraps compression and sees the bytes actually sent.
+app.add_middleware(MetricsMiddleware, metrics=metrics, profiles=profiles)
+
+metrics.gauge("series_cache_bytes", "Bytes held by the series cache.", lambda: series_cache.nbytes)
+metrics.gauge("series_cache_entries", "Series held by the series cache.", lambda: len(series_cache))
+metrics.gauge("series_cache_hits", "Series cache hits since start.", lambda: series_cache.hits)
+metrics.gauge("series_cache_misses", "Series cache misses since start.", lambda: series_cache.misses)
+metrics.gauge("coalesced_flights_started", "Reads that ran their own query since start.", lambda: flights.started)
+metrics.gauge("coalesced_requests", "Reads that joined an identical in-flight read since start.", lambda: flights.shared)
+metrics.gauge("analytics_thread_jobs_pending", "Jobs running or queued on the analytics threads.", lambda: executor.threads.pending)
+metrics.gauge("analytics_process_jobs_pending", "Jobs running or queued on the analytics processes.", lambda: executor.processes.pending)
 
 @app.on_event("startup")
 async def startup():
-    await db.connect()
+    await store.connect()
+    await registry.load()
 
 @app.on_event("shutdown")
 async def shutdown():
-    await db.disconnect()
+    await store.disconnect()
+    executor.shutdown()
+
+@app.exception_handler(executor.ExecutorSaturated)
+async def executor_saturated(request: Request, exc: executor.ExecutorSaturated):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Analytics workers are busy, retry shortly"},
+        headers={"Retry-After": "1"},
+    )
 
 @app.get("/")
 def read_root():
     return {"message": "Server is running healthy"}
 
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/profiles/{profile_id}")
+def get_profile(profile_id: int):
+    report = profiles.reports.get(profile_id) if profiles is not None else None
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(content=report, media_type="text/plain")
+
 @app.get("/get-all-stocks")
-async def get_all_stocks():
-    stocks = await db.stock.find_many()
+async def get_all_stocks(request: Request, response: Response):
+    stocks = await registry.all()
     if not stocks:
         raise HTTPException(status_code=404, detail="No stocks found")
+
+    # Stocks are only ever added, so the count and highest id identify the list.
+    headers = cache_headers(make_etag("stocks", len(stocks), max(stock.id for stock in stocks)))
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     return stocks
 
 
+async def series_fingerprint(stock_id):
+    """A version of a stock's bars, leading with its row count and latest bar in epoch ms.
+
+    Always read from the store: a write by another worker or the bulk loader
+    never reaches this process's cache, so cached state derived from an
+    older version is dropped here.
+    """
+    with phase("db"):
+        version = await store.fingerprint(stock_id)
+    reconcile(stock_id, version)
+    return version
+
+
+async def series_fingerprints(stock_ids):
+    """``series_fingerprint`` for many stocks in one query."""
+    with phase("db"):
+        versions = await store.fingerprints(stock_ids)
+    for stock_id, version in versions.items():
+        reconcile(stock_id, version)
+    return versions
+
+
+def reconcile(stock_id, version):
+    """Drop the cached series and strategy states of a stock written elsewhere.
+
+    Writes through this process record the version they produced in
+    ``series_appended``; any other version means the bars changed through
+    another worker, the bulk loader or plain SQL.
+    """
+    known = series_versions.get(stock_id)
+    if known is not None and known != version:
+        invalidate_stock(stock_id)
+    series_versions[stock_id] = version
+
+
+def columns_fingerprint(columns):
+    timestamps = columns["datetime"].view(np.int64)
+    return len(timestamps), int(timestamps[-1]) if len(timestamps) else None
+
+
+async def hot_series(stock_id):
+    """The full series when it can be sliced in memory, otherwise None.
+
+    Columnar storage maps its files straight from the page cache, so it
+    never goes through the series cache.
+    """
+    if store.columnar:
+        with phase("db"):
+            return await store.load_series(stock_id)
+    return series_cache.get(stock_id)
+
+
+def response_format(request):
+    fmt = negotiate(request.headers.get("accept"))
+    if fmt == "arrow" and not ARROW_AVAILABLE:
+        raise HTTPException(status_code=406, detail="Arrow responses require pyarrow on the server")
+    return fmt
+
+
+def stock_metadata(stock, next_cursor=None):
+    return {"stock": {"id": stock.id, "instrument": stock.instrument}, "nextCursor": next_cursor}
+
+
 @app.get("/get-stock-data")
-async def get_stock_data(instrument: str):
-    stock = await db.stock.find_unique(where={"instrument": instrument})
+async def get_stock_data(
+    request: Request,
+    response: Response,
+    instrument: str,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    cursor: Optional[datetime] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    interval: Optional[str] = None,
+    max_points: Optional[int] = Query(None, ge=2, le=MAX_PAGE_SIZE),
+):
+    fmt = response_format(request)
+    stock = await registry.get(instrument)
     
     if not stock:
         raise HTTPException(status_code=404, detail="Stock not found")
 
-    stock_data = await db.stockdata.find_many(where={"stockId": stock.id})
+    fingerprint = await series_fingerprint(stock.id)
+    latest = fingerprint[1]
+    etag = make_etag("stock-data", stock.id, *fingerprint, fmt, sorted(request.query_params.multi_items()))
+    closed = end is not None and latest is not None and epoch_ms(end) < latest
+    headers = cache_headers(etag, CLOSED_RANGE_MAX_AGE if closed else 0)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+    # The ETag already names the stored version and every parameter.
+    with phase("coalesced"):
+        result = await flights.do(
+            ("get-stock-data", stock.id, etag),
+            read_stock_data, stock, start, end, cursor, limit, interval, max_points, fmt,
+        )
+    return payload_response(result, headers) if fmt != "json" else result
+
+
+def payload_response(payload, headers=None):
+    """A new response around an encoded ``(content, media_type)`` payload.
+
+    Coalesced requests share the payload but never a ``Response``: the
+    compression middleware rewrites a response's headers while sending it.
+    """
+    content, media_type = payload
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+async def read_stock_data(stock, start, end, cursor, limit, interval, max_points, fmt):
+    """One page or resampled range; binary formats come back as an encoded payload."""
+    if interval or max_points:
+        return await get_resampled_stock_data(stock, start, end, interval, max_points, fmt)
+
+    # Fetch one extra row to know whether another page follows.
+    cached = await hot_series(stock.id)
+    if cached is not None:
+        page = slice_columns(cached, start, end, cursor, limit + 1)
+    else:
+        # Keyset pagination: the cursor is the datetime of the last row already
+        # returned, so each page is an index range scan on (stockId, datetime).
+        with phase("db"):
+            stock_data = await store.read_rows(stock.id, start, end, cursor, limit + 1)
+        with phase("arrays"):
+            page = rows_to_columns(stock_data)
+    return page_payload(stock, page, limit, fmt)
+
 
-    return {"stock": stock, "data": stock_data}
+def page_payload(stock, page, limit, fmt):
+    """One page in the same shape whether its bars came from the cache or the database."""
+    next_cursor = None
+    if len(page["close"]) > limit:
+        page = {name: array[:limit] for name, array in page.items()}
+        next_cursor = str(page["datetime"][-1]) + "Z"
+    count_rows(len(page["close"]))
+    with phase("serialize"):
+        if fmt != "json":
+            return encode_binary(fmt, page, stock_metadata(stock, next_cursor))
+        return {"stock": stock, "data": columns_to_records(page), "nextCursor": next_cursor}
 
 
+async def get_resampled_stock_data(stock, start, end, interval, max_points, fmt="json"):
+    cached = await hot_series(stock.id)
+    if cached is not None:
+        columns = slice_columns(cached, start, end)
+    elif interval and store.rollups:
+        try:
+            tier = choose_tier(interval)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        columns = await read_planned(stock.id, tier, start, end) if tier else None
+    else:
+        columns = None
+    if columns is None:
+        with phase("db"):
+            stock_data = await store.read_rows(stock.id, start, end)
+        with phase("arrays"):
+            columns = rows_to_columns(stock_data)
+
+    count_rows(len(columns["close"]))
+    try:
+        with phase("compute"):
+            columns = await executor.run_in_thread(resampled_columns, columns, interval, max_points)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    with phase("serialize"):
+        if fmt != "json":
+            return encode_binary(fmt, columns, stock_metadata(stock))
+        data = await executor.run_in_thread(columns_to_records, columns)
+    return {"stock": stock, "data": data, "nextCursor": None}
+
+
+async def read_planned(stock_id, tier, start, end):
+    """Read whole ``tier`` buckets from the rollup table and only the ragged edges as raw bars."""
+    parts = []
+    for source, first, last in plan_range(tier, start, end):
+        with phase("db"):
+            if source == "raw":
+                rows = await store.read_rows(stock_id, from_ms(first), from_ms(last))
+            else:
+                rows = await store.read_rollups(stock_id, tier, from_ms(first), from_ms(last))
+        with phase("arrays"):
+            parts.append(rows_to_columns(rows, "datetime" if source == "raw" else "bucket"))
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def resampled_columns(columns, interval, max_points):
+    if interval:
+        columns = resample(columns, interval)
+    if max_points:
+        columns = downsample(columns, max_points)
+    return columns
+
+
+
+@app.get("/export-stock-data")
+async def export_stock_data(
+    instrument: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+):
+    stock = await registry.get(instrument)
+
+    if not stock:
+        raise HTTPException(status_code=404, detail="Stock not found")
+
+    if format == "csv":
+        media_type, extension = CSV_MEDIA_TYPE, "csv"
+    else:
+        media_type, extension = NDJSON_MEDIA_TYPE, "ndjson"
+
+    # Drops a cached series another process has since written to before the
+    # export streams from it.
+    await series_fingerprint(stock.id)
+    return StreamingResponse(
+        export_pages(stock.id, format, start, end),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{instrument}.{extension}"'},
+    )
+
+
+async def export_pages(stock_id, format, start, end):
+    """Yield the export one keyset page at a time so memory stays bounded."""
+    if format == "csv":
+        yield CSV_HEADER
+    encode = encode_csv if format == "csv" else encode_ndjson
+
+    cached = await hot_series(stock_id)
+    if cached is not None:
+        selected = slice_columns(cached, start, end)
+        count_rows(len(selected["close"]))
+        for offset in range(0, len(selected["close"]), EXPORT_PAGE_SIZE):
+            with phase("serialize"):
+                chunk = encode({name: array[offset:offset + EXPORT_PAGE_SIZE] for name, array in selected.items()})
+            yield chunk
+        return
+
+    cursor = None
+    while True:
+        with phase("db"):
+            page = await store.read_rows(stock_id, start, end, cursor, EXPORT_PAGE_SIZE)
+        if not page:
+            return
+        count_rows(len(page))
+        with phase("arrays"):
+            columns = rows_to_columns(page)
+        with phase("serialize"):
+            chunk = encode(columns)
+        yield chunk
+        if len(page) < EXPORT_PAGE_SIZE:
+            return
+        cursor = page[-1].datetime
 
-class StockCreate(BaseModel):
-    instrument: str
 
 @app.post("/create-stock")
 async def create_stock(stock: StockCreate):
-    existing_stock = await db.stock.find_unique(where={"instrument": stock.instrument})
+    existing_stock = await registry.get(stock.instrument)
     if existing_stock:
         raise HTTPException(status_code=400, detail="Stock already exists")
 
-    new_stock = await db.stock.create(
-        data={"instrument": stock.instrument}
-    )
-    print("Stock created:", new_stock)
+    new_stock = await store.create_stock(stock.instrument)
+    registry.add(new_stock)
     return new_stock
 
 
 
-class StockDataCreate(BaseModel):
-    stockId: int
-    datetime: datetime
-    close: float
-    high: float
-    low: float
-    open: float
-    volume: int
-
 @app.post("/add-stock-data")
-async def add_stock_data(data: StockDataCreate):
-    stock = await db.stock.find_unique(where={"id": data.stockId})
+async def add_stock_data(data: StockDataCreate, mode: str = Query("insert", pattern=WRITE_MODE_PATTERN)):
+    stock = await registry.get_by_id(data.stockId)
     if not stock:
         raise HTTPException(status_code=404, detail="Stock not found")
 
-    new_stock_data = await db.stockdata.create(
-        data={
-            "stockId": data.stockId,
-            "datetime": data.datetime,
-            "close": data.close,
-            "high": data.high,
-            "low": data.low,
-            "open": data.open,
-            "volume": data.volume
-        }
-    )
-    
-    return {"message": "Stock data created successfully", "data": new_stock_data}
+    row = {
+        "stockId": data.stockId,
+        "datetime": data.datetime,
+        "close": data.close,
+        "high": data.high,
+        "low": data.low,
+        "open": data.open,
+        "volume": data.volume
+    }
+    with invalidate_on_error([data.stockId]):
+        if mode != "insert":
+            counts = await store.upsert_many([row], ignore=mode == "ignore")
+            del counts["written"]
+            if not counts["skipped"]:
+                await update_rollups({data.stockId: rows_to_columns([data])}, rebuild=True)
+                versions = await written_versions([data.stockId])
+                series_appended(data.stockId, rows_to_columns([data]), versions[data.stockId])
+                await publish_bars(stock, rows_to_columns([data]))
+            return {"message": "Stock data upserted successfully", "data": row, **counts}
+
+        try:
+            new_stock_data = await store.insert(row)
+        except BarExists:
+            raise HTTPException(status_code=400, detail="Stock data already exists")
+        await update_rollups({data.stockId: rows_to_columns([data])}, rebuild=False)
+        versions = await written_versions([data.stockId])
+        series_appended(data.stockId, rows_to_columns([data]), versions[data.stockId])
+        await publish_bars(stock, rows_to_columns([data]))
+
+        return {"message": "Stock data created successfully", "data": new_stock_data}
+
+
+@app.post("/add-stock-data/bulk")
+async def add_stock_data_bulk(request: Request, mode: str = Query("insert", pattern=WRITE_MODE_PATTERN)):
+    try:
+        with phase("parse"):
+            rows, rejected = parse_body(await request.body(), request.headers.get("content-type"))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    with phase("parse"):
+        valid, invalid = validate_rows(rows)
+    rejected.extend(invalid)
+
+    stock_ids = sorted({row.stockId for _, row in valid})
+    known = {}
+    if stock_ids:
+        known = {stock.id: stock for stock in await registry.find(ids=stock_ids)}
+
+    to_insert = []
+    for index, row in valid:
+        if row.stockId not in known:
+            rejected.append({"row": index, "error": "Stock not found"})
+            continue
+        to_insert.append((index, row))
+
+    batches = []
+    totals = {"inserted": 0, "updated": 0, "skipped": 0}
+    inserted_rows = {}
+    with invalidate_on_error(known):
+        for batch, chunk in enumerate(chunked(to_insert)):
+            rows = [row.model_dump() for _, row in chunk]
+            try:
+                with phase("db"):
+                    if mode == "insert":
+                        counts = {"inserted": await store.insert_many(rows), "updated": 0, "skipped": 0, "written": range(len(rows))}
+                    else:
+                        counts = await store.upsert_many(rows, ignore=mode == "ignore")
+            except Exception as exc:
+                # On Postgres a batch is one statement, so a failed batch wrote nothing; later ones still run.
+                batches.append({"batch": batch, "count": 0, "error": str(exc)})
+                rejected.extend({"row": index, "error": f"Batch {batch} failed"} for index, _ in chunk)
+                continue
+            batches.append({"batch": batch, "count": counts["inserted"] + counts["updated"]})
+            for key in totals:
+                totals[key] += counts[key]
+            # Skipped rows kept the stored bar, so only written ones reach caches and subscribers.
+            for position in counts["written"]:
+                row = chunk[position][1]
+                inserted_rows.setdefault(row.stockId, []).append(row)
+        count_rows(totals["inserted"] + totals["updated"])
+        # A replay that changed nothing leaves cached series and strategy states valid.
+        if totals["inserted"] or totals["updated"]:
+            written = {}
+            for stock_id, rows in inserted_rows.items():
+                # Bodies may mix naive (UTC) and offset datetimes, which do not compare.
+                rows.sort(key=lambda row: epoch_ms(row.datetime))
+                written[stock_id] = rows_to_columns(rows)
+            await update_rollups(written, rebuild=mode != "insert")
+            versions = await written_versions(list(written))
+            for stock_id, columns in written.items():
+                series_appended(stock_id, columns, versions[stock_id])
+                await publish_bars(known[stock_id], columns)
+
+    rejected.sort(key=lambda item: item["row"])
+    return {
+        "message": "Stock data ingested",
+        **totals,
+        "batches": batches,
+        "rejected": rejected,
+    }
+
+
+async def update_rollups(series, rebuild):
+    """Bring the rollup tiers up to date with bars just written, ``{stock_id: columns}``.
+
+    Plain inserts only add bars, so they are folded into existing buckets;
+    upserts may have replaced bars, so the buckets they touch are rebuilt.
+    """
+    if not store.rollups:
+        return
+    with phase("rollups"):
+        if not rebuild:
+            await store.merge_rollups(series)
+            return
+        for stock_id, columns in series.items():
+            timestamps = columns["datetime"].view(np.int64)
+            await store.rebuild_rollups(stock_id, int(timestamps[0]), int(timestamps[-1]))
+
+
+@contextmanager
+def invalidate_on_error(stock_ids):
+    """Drop cached state for ``stock_ids`` if a write fails after rows may be committed.
+
+    Rows already written stay in the database, so a series cache or strategy
+    state that missed them would keep serving the old data.
+    """
+    try:
+        yield
+    except BaseException:
+        for stock_id in stock_ids:
+            invalidate_stock(stock_id)
+        raise
+
+
+async def written_versions(stock_ids):
+    """Fingerprints read right after a write, for ``series_appended`` to record."""
+    with phase("db"):
+        return await store.fingerprints(stock_ids)
+
+
+def series_appended(stock_id, columns, version):
+    """Fold newly written bars into the cached series.
+
+    Strategy states that already reach the new bars were folded over bars
+    that may just have been rewritten, so they are dropped whether or not the
+    series is cached. Bars landing before the end of a cached series cannot
+    be appended, so the series and every strategy state for the stock are
+    dropped instead. Columnar storage is always current.
+
+    ``version`` is the store fingerprint after the write. What stays cached is
+    recorded as current at it, unless the cached series ends up with another
+    row count or latest bar: then bars written elsewhere are missing from it.
+    """
+    forget_results(stock_id)
+    first = columns["datetime"][0]
+    for key in [key for key, state in strategy_states.items() if key[0] == stock_id and state.count and state.last_timestamp >= first]:
+        strategy_states.pop(key, None)
+    if not store.columnar:
+        appended = stock_id not in series_cache or series_cache.append(stock_id, columns)
+        cached = series_cache.peek(stock_id)
+        if not appended or (cached is not None and columns_fingerprint(cached) != tuple(version[:2])):
+            invalidate_stock(stock_id)
+    series_versions[stock_id] = version
+
+
+def invalidate_stock(stock_id):
+    forget_results(stock_id)
+    series_cache.invalidate(stock_id)
+    for key in [key for key in strategy_states if key[0] == stock_id]:
+        strategy_states.pop(key, None)
+
+
+def forget_results(stock_id):
+    """Drop reads in flight and cached results that include ``stock_id``'s bars."""
+    # Reads already in flight may predate the write; later ones start afresh.
+    flights.forget(lambda key: key[1] == stock_id)
+    for key in [key for key in correlation_cache if stock_id in key[0]]:
+        correlation_cache.pop(key, None)
+
+
+async def load_series(stock_id):
+    """Full datetime-ordered OHLCV arrays for a stock, served from the cache while it is current."""
+    await series_fingerprint(stock_id)
+    columns = await hot_series(stock_id)
+    if columns is None:
+        with phase("db"):
+            columns = await store.load_series(stock_id)
+        if len(columns["close"]):
+            series_cache.put(stock_id, columns)
+    return columns
+
+
+async def load_series_many(stock_ids):
+    """Series for many stocks, fetching every uncached one in a single query."""
+    await series_fingerprints(stock_ids)
+    if store.columnar:
+        with phase("db"):
+            return await store.load_series_many(stock_ids)
+    series = {}
+    for stock_id in stock_ids:
+        columns = series_cache.get(stock_id)
+        if columns is not None:
+            series[stock_id] = columns
+
+    missing = [stock_id for stock_id in stock_ids if stock_id not in series]
+    if missing:
+        with phase("db"):
+            loaded = await store.load_series_many(missing)
+        for stock_id, columns in loaded.items():
+            series_cache.put(stock_id, columns)
+        series.update(loaded)
+    return series
 
 
 @app.get("/strategy")
-async def get_strategy_performance(instrument: str):
-    stock = await db.stock.find_unique(where={"instrument": instrument})
+async def get_strategy_performance(
+    request: Request,
+    instrument: str,
+    window: int = Query(3, ge=1),
+    indicators: Optional[str] = None,
+    trades: bool = False,
+    max_trades: Optional[int] = Query(None, ge=1),
+    fee: float = Query(0.0, ge=0),
+    cooldown: int = Query(0, ge=0),
+):
+    fmt = response_format(request)
+    try:
+        specs = parse_indicators(indicators) if indicators else []
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    stock = await registry.get(instrument)
     
     if not stock:
         raise HTTPException(status_code=404, detail="Stock not found")
 
-    stock_data = await db.stockdata.find_many(where={"stockId": stock.id})
-    if not stock_data:
+    # ``trades`` or any trade option asks for the multi-trade analysis; without max_trades it is unlimited.
+    options = None
+    if trades or max_trades is not None or fee or cooldown:
+        options = {"max_trades": max_trades, "fee": fee, "cooldown": cooldown}
+    with phase("coalesced"):
+        result = await flights.do(
+            ("strategy", stock.id, window, indicators, tuple(options.values()) if options else None, fmt),
+            compute_strategy, stock, window, specs, options, fmt,
+        )
+    return payload_response(result) if fmt != "json" else result
+
+
+async def compute_strategy(stock, window, specs, trades, fmt):
+    columns = await load_series(stock.id)
+    if len(columns["close"]) == 0:
         raise HTTPException(status_code=404, detail="Stock data not found")
-   
-    print("Stock Data:", stock_data[0].close)
-    close_prices = np.array([entry.close for entry in stock_data])
-    window_size = 3
-    weights = np.ones(window_size) / window_size
-    moving_avg = np.convolve(close_prices, weights, mode="valid")
-
-
-    min_price = np.inf
-    min_index = 0 
-    max_profit = 0 
-    buy_index = 0 
-    sell_index = 0
-
-    for i in range(len(close_prices)):
-        if close_prices[i] < min_price:
-            min_price = close_prices[i]
-            min_index = i
-        elif close_prices[i] - min_price > max_profit:
-            max_profit = close_prices[i] - min_price
-            buy_index = min_index
-            sell_index = i
-    BestBuySell = {"BuyIndex": buy_index, "SellIndex": sell_index, "Profit": max_profit}
-    return {"MovingAverage": moving_avg.tolist(), "BestBuySell": BestBuySell}
 
+    count_rows(len(columns["close"]))
+    state = strategy_state(stock.id, window, columns)
+    solved = None
+    try:
+        with phase("compute"):
+            bars = len(columns["close"])
+            if trades is not None and bars >= TRADES_PROCESS_MIN_BARS and trades_solver(bars, **trades) == "loop":
+                solved = await executor.run_in_process(best_trades, columns["close"], **trades)
+            if fmt != "json":
+                return await executor.run_in_thread(strategy_binary_payload, fmt, state, columns, specs, trades, solved)
+            return await executor.run_in_thread(strategy_response, state, columns, specs, trades, solved)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+def strategy_state(stock_id, window, columns):
+    """The cached incremental state for a stock and window, rebuilt if stale."""
+    state = strategy_states.get((stock_id, window))
+    if state is None or not state.matches(columns):
+        state = StrategyState(window)
+        strategy_states[(stock_id, window)] = state
+    return state
+
+
+def trade_report(columns, best, trades, solved=None):
+    """``Trades``/``TotalProfit`` for the requested options; one costless trade is ``BestBuySell``.
+
+    ``solved`` is a ``best_trades`` result already computed in a worker process.
+    """
+    if solved is not None:
+        return solved
+    if trades["max_trades"] == 1 and not trades["fee"] and not trades["cooldown"]:
+        chosen = [best] if best["Profit"] > 0 else []
+        return {"Trades": chosen, "TotalProfit": best["Profit"]}
+    return best_trades(columns["close"], **trades)
+
+
+def strategy_response(state, columns, specs, trades=None, solved=None):
+    response = state.report(columns)
+    if trades is not None:
+        response.update(trade_report(columns, response["BestBuySell"], trades, solved))
+    if specs:
+        response["Indicators"] = {
+            key: to_json(values) for key, values in compute_indicators(columns, specs).items()
+        }
+    return response
+
+
+def strategy_binary_payload(fmt, state, columns, specs, trades=None, solved=None):
+    """Columnar strategy output with every series aligned to the bars.
+
+    The moving average is NaN-padded over its warm-up bars so all columns
+    share the datetime index, which Arrow record batches require.
+    """
+    moving_avg, best = state.snapshot(columns)
+    moving_avg = moving_avg[:max(len(columns["close"]) - state.window_size + 1, 0)]
+    arrays = {"datetime": columns["datetime"]}
+    arrays["MovingAverage"] = np.concatenate((np.full(len(columns["close"]) - len(moving_avg), np.nan), moving_avg))
+    for key, values in compute_indicators(columns, specs).items():
+        if isinstance(values, dict):
+            arrays.update({f"{key}.{name}": array for name, array in values.items()})
+        else:
+            arrays[key] = values
+    metadata = {"BestBuySell": best, "window": state.window_size}
+    if trades is not None:
+        metadata.update(trade_report(columns, best, trades, solved))
+    return encode_binary(fmt, arrays, metadata)
+
+
+@app.post("/strategy/batch")
+async def get_strategy_batch(request: StrategyBatchRequest):
+    if request.instruments == "all":
+        stocks = await registry.all()
+    else:
+        stocks = await registry.find(instruments=request.instruments)
+
+    series = await load_series_many([stock.id for stock in stocks])
+    jobs = [(stock.instrument, series[stock.id]["close"]) for stock in stocks if stock.id in series]
+    found = {instrument for instrument, _ in jobs}
+    requested = [stock.instrument for stock in stocks] if request.instruments == "all" else request.instruments
+    missing = [instrument for instrument in requested if instrument not in found]
+
+    options = {"window_size": request.window, "include_moving_average": request.include_moving_average}
+    sizes = [len(close_prices) for _, close_prices in jobs]
+    count_rows(sum(sizes))
+    with phase("compute"):
+        if sum(sizes) < BATCH_PROCESS_MIN_BARS or executor.ANALYTICS_PROCESSES <= 1:
+            results = await executor.run_in_thread(strategy_batch, jobs, **options)
+        else:
+            chunks = executor.balanced_chunks(jobs, sizes, executor.ANALYTICS_PROCESSES)
+            results = {}
+            for part in await asyncio.gather(*(executor.run_in_process(strategy_batch, chunk, **options) for chunk in chunks)):
+                results.update(part)
+
+    for result in results.values():
+        if "MovingAverage" in result:
+            result["MovingAverage"] = result["MovingAverage"].tolist()
+    return {"results": results, "missing": missing}
+
+
+async def backtest_series(request):
+    """The stock and its bars for a backtest request, sliced and resampled as asked."""
+    stock = await registry.get(request.instrument)
+    if not stock:
+        raise HTTPException(status_code=404, detail="Stock not found")
+
+    columns = slice_columns(await load_series(stock.id), request.start, request.end)
+    if request.interval:
+        try:
+            columns = await executor.run_in_thread(resample, columns, request.interval)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+    if len(columns["close"]) == 0:
+        raise HTTPException(status_code=404, detail="Stock data not found")
+    count_rows(len(columns["close"]))
+    return stock, columns
+
+
+@app.post("/backtest")
+async def backtest_strategy(request: Request, backtest: BacktestRequest):
+    fmt = response_format(request)
+    try:
+        params = resolve_params(backtest.strategy, backtest.params)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    stock, columns = await backtest_series(backtest)
+    with phase("compute"):
+        stats, trades, curve = await executor.run_in_thread(run_backtest, backtest.strategy, columns, params, backtest.fee)
+    summary = {"strategy": backtest.strategy, "params": params, "stats": stats, "trades": trades}
+    if fmt != "json":
+        return binary_response(fmt, curve, {**stock_metadata(stock), **summary})
+    with phase("serialize"):
+        curve = await executor.run_in_thread(curve_to_json, curve)
+    return {"stock": stock, **summary, "curve": curve}
+
+
+def curve_to_json(curve):
+    return {
+        name: np.datetime_as_string(values, unit="s", timezone="UTC").tolist() if name == "datetime" else values.tolist()
+        for name, values in curve.items()
+    }
+
+
+@app.post("/backtest/grid")
+async def backtest_grid(backtest: BacktestGridRequest):
+    try:
+        first, second = resolve_grid(backtest.strategy, backtest.grid)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if len(first) * len(second) > BACKTEST_MAX_COMBINATIONS:
+        raise HTTPException(status_code=400, detail=f"Grid has {len(first) * len(second)} combinations, at most {BACKTEST_MAX_COMBINATIONS} are allowed")
+
+    stock, columns = await backtest_series(backtest)
+    columns = {name: columns[name] for name in ("datetime", "high", "low", "close")}
+    cells = len(first) * len(second) * len(columns["close"])
+    with phase("compute"):
+        if cells < BACKTEST_PROCESS_MIN_CELLS or executor.ANALYTICS_PROCESSES <= 1:
+            metrics_grid = await executor.run_in_thread(sweep, backtest.strategy, columns, first, second, backtest.fee)
+        else:
+            chunks = np.array_split(first, min(executor.ANALYTICS_PROCESSES, len(first)))
+            parts = await asyncio.gather(*(executor.run_in_process(sweep, backtest.strategy, columns, chunk, second, backtest.fee) for chunk in chunks))
+            metrics_grid = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+        ranked, combinations = rank_grid(backtest.strategy, first, second, metrics_grid, backtest.metric, backtest.top)
+    return {"stock": stock, "strategy": backtest.strategy, "metric": backtest.metric, "combinations": combinations, "results": ranked}
+
+
+@app.post("/correlation")
+async def get_correlation(request: CorrelationRequest):
+    if request.instruments == "all":
+        stocks = await registry.all()
+    else:
+        stocks = await registry.find(instruments=request.instruments)
+
+    requested = [stock.instrument for stock in stocks] if request.instruments == "all" else request.instruments
+    versions = await series_fingerprints([stock.id for stock in stocks])
+    stocks = [stock for stock in stocks if versions[stock.id][0]]
+    found = {stock.instrument for stock in stocks}
+    missing = [instrument for instrument in requested if instrument not in found]
+
+    key = (tuple(stock.id for stock in stocks), request.window, request.interval)
+    version = tuple(versions[stock.id] for stock in stocks)
+    cached = correlation_cache.get(key)
+    if cached is not None and cached[0] == version:
+        result = cached[1]
+    else:
+        series = await load_series_many([stock.id for stock in stocks])
+        count_rows(sum(len(series[stock.id]["close"]) for stock in stocks))
+        try:
+            with phase("compute"):
+                result = await executor.run_in_thread(correlation_response, [series[stock.id] for stock in stocks], request.window, request.interval)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        correlation_cache[key] = (version, result)
+    return {"instruments": [stock.instrument for stock in stocks], "missing": missing, **result}
+
+
+def correlation_response(series, window, interval):
+    if not series:
+        return {"observations": 0, "start": None, "end": None, "correlation": [], "covariance": []}
+    if interval:
+        series = [resample(columns, interval) for columns in series]
+    result = correlation_matrix(series, window)
+    start, end = (
+        np.datetime_as_string(np.datetime64(int(value), "ms"), unit="s", timezone="UTC") if value is not None else None
+        for value in (result["start"], result["end"])
+    )
+    return {
+        "observations": result["observations"],
+        "start": start,
+        "end": end,
+        "correlation": to_json(result["correlation"]),
+        "covariance": to_json(result["covariance"]),
+    }
+
+
+async def publish_bars(stock, columns):
+    """Push new bars with their updated strategy to the stock's subscribers.
+
+    One message per subscribed window: the bars, the moving average values
+    ending at the latest bar, and the best buy/sell over the whole series.
+    Folding the bars can mean a full recompute (a state that was never built
+    or was invalidated) and waits on the state's lock, so it runs on the
+    analytics threads.
+
+    The bars are already committed when this runs, so a failure (saturated
+    analytics threads included) is logged instead of failing the write: a
+    client retrying an insert would only hit the unique constraint.
+    """
+    windows = hub.windows(stock.instrument)
+    if not windows:
+        return
+    try:
+        series = await load_series(stock.id)
+        states = {window: strategy_state(stock.id, window, series) for window in sorted(windows)}
+        messages = await executor.run_in_thread(stream_messages, stock.instrument, states, series, columns)
+    except Exception:
+        logger.exception("Publishing new bars of %s failed", stock.instrument)
+        return
+    for window, message in messages.items():
+        hub.publish(stock.instrument, window, message)
+
+
+def stream_messages(instrument, states, series, columns):
+    """The ``bars`` message for each window's ``StrategyState`` over ``series``."""
+    bars = columns_to_records(columns)
+    messages = {}
+    for window, state in states.items():
+        moving_avg, best = state.snapshot(series)
+        messages[window] = {
+            "type": "bars",
+            "instrument": instrument,
+            "window": window,
+            "data": bars,
+            "MovingAverage": moving_avg[-len(bars):].tolist(),
+            "BestBuySell": best,
+        }
+    return messages
+
+
+@app.websocket("/ws/stocks")
+async def stream_stocks(websocket: WebSocket):
+    """Live bars for subscribed instruments.
+
+    Clients send ``{"action": "subscribe" | "unsubscribe", "instruments": [...],
+    "window": 3}`` and receive ``bars`` messages as data is ingested.
+    """
+    await websocket.accept()
+    subscriber = hub.connect()
+    sender = asyncio.create_task(forward(websocket, subscriber))
+    try:
+        while True:
+            await handle_stream_message(subscriber, await websocket.receive_text())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.disconnect(subscriber)
+        sender.cancel()
+
+
+async def handle_stream_message(subscriber, text):
+    try:
+        message = json.loads(text)
+    except json.JSONDecodeError:
+        message = None
+    if not isinstance(message, dict):
+        subscriber.send({"type": "error", "detail": "Expected a JSON object"})
+        return
+
+    action = message.get("action")
+    instruments = message.get("instruments")
+    window = message.get("window", 3)
+    if action not in ("subscribe", "unsubscribe") or not isinstance(instruments, list) or not all(isinstance(item, str) for item in instruments):
+        subscriber.send({"type": "error", "detail": "Expected an action of subscribe or unsubscribe and a list of instruments"})
+        return
+    if not isinstance(window, int) or isinstance(window, bool) or window < 1:
+        subscriber.send({"type": "error", "detail": "window must be a positive integer"})
+        return
+
+    if action == "unsubscribe":
+        for instrument in instruments:
+            hub.unsubscribe(subscriber, instrument)
+        subscriber.send({"type": "unsubscribed", "instruments": instruments})
+        return
+
+    found, missing = [], []
+    for instrument in instruments:
+        if await registry.get(instrument):
+            hub.subscribe(subscriber, instrument, window)
+            found.append(instrument)
+        else:
+            missing.append(instrument)
+    subscriber.send({"type": "subscribed", "instruments": found, "missing": missing, "window": window})
@@ -0,0 +1,291 @@
+import asyncio
+import cProfile
+import contextvars
+import io
+import itertools
+import os
+import pstats
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from fastapi.routing import APIRoute
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+ROWS_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+# Profiling is off unless the server opts in; then requests ask with ``X-Profile: 1``.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_HISTORY = 20
+
+current = contextvars.ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram for one label set."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class HistogramFamily:
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, values, value):
+        histogram = self.series.get(values)
+        if histogram is None:
+            histogram = self.series[values] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, histogram in sorted(self.series.items()):
+            labels = ",".join(f'{label}="{escape(value)}"' for label, value in zip(self.labels, values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{self.name}_count{{{labels}}} {histogram.count}")
+        return lines
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Process-wide request metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = HistogramFamily("http_request_duration_seconds", "Request latency including streaming.", ("method", "route", "status"), LATENCY_BUCKETS)
+        self.phases = HistogramFamily("http_request_phase_seconds", "Time per request spent in each phase.", ("route", "phase"), LATENCY_BUCKETS)
+        self.payload = HistogramFamily("http_response_bytes", "Response body size as sent.", ("route",), BYTES_BUCKETS)
+        self.rows = HistogramFamily("http_response_rows", "Bars read or written per request.", ("route",), ROWS_BUCKETS)
+        self.gauges = {}
+
+    def gauge(self, name, help, read):
+        """Register a gauge whose value is read when ``/metrics`` is scraped."""
+        self.gauges[name] = (help, read)
+
+    def record(self, method, route, status, stats):
+        with self._lock:
+            self.latency.observe((method, route, str(status)), stats.elapsed())
+            for phase, seconds in stats.phases.items():
+                self.phases.observe((route, phase), seconds)
+            self.payload.observe((route,), stats.bytes_sent)
+            if stats.rows is not None:
+                self.rows.observe((route,), stats.rows)
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for family in (self.latency, self.phases, self.payload, self.rows):
+                lines.extend(family.render())
+        for name, (help, read) in sorted(self.gauges.items()):
+            lines.extend([f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {read()}"])
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            for family in (self.latency, self.phases, self.payload, self.rows):
+                family.series.clear()
+
+
+class RequestStats:
+    """Per-request timings; phases record self time, so nested phases never double count."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.rows = None
+        self.bytes_sent = 0
+        self.endpoint = 0.0
+        self._stack = []
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def enter(self, name):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self):
+        name, started, children = self._stack.pop()
+        elapsed = time.perf_counter() - started
+        self.add(name, elapsed - children)
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name):
+    """Attribute the enclosed block, awaits included, to ``name`` for this request."""
+    stats = current.get()
+    if stats is None:
+        yield
+        return
+    stats.enter(name)
+    try:
+        yield
+    finally:
+        stats.exit()
+
+
+def count_rows(count):
+    stats = current.get()
+    if stats is not None:
+        stats.rows = (stats.rows or 0) + count
+
+
+class TimedRoute(APIRoute):
+    """Route that splits handler time into the endpoint body and FastAPI's work around it.
+
+    Whatever the handler spends outside the endpoint function (parameter
+    validation and, above all, ``jsonable_encoder`` plus JSON rendering of the
+    returned value) is recorded as the ``serialize`` phase.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        call = self.dependant.call
+        if asyncio.iscoroutinefunction(call):
+            async def timed(**values):
+                started = time.perf_counter()
+                try:
+                    return await call(**values)
+                finally:
+                    _add_endpoint_time(time.perf_counter() - started)
+        else:
+            def timed(**values):
+                started = time.perf_counter()
+                try:
+                    return call(**values)
+                finally:
+                    _add_endpoint_time(time.perf_counter() - started)
+        self.dependant.call = timed
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            stats = current.get()
+            started = time.perf_counter()
+            response = await handler(request)
+            if stats is not None:
+                stats.add("serialize", max(time.perf_counter() - started - stats.endpoint, 0.0))
+            return response
+
+        return timed_handler
+
+
+def _add_endpoint_time(seconds):
+    stats = current.get()
+    if stats is not None:
+        stats.endpoint += seconds
+
+
+class Profiles:
+    """Most recent cProfile reports, one request profiled at a time."""
+
+    def __init__(self, history=PROFILE_HISTORY):
+        self.history = history
+        self.reports = OrderedDict()
+        self._ids = itertools.count(1)
+        self.active = False
+
+    def start(self):
+        if self.active:
+            return None, None
+        self.active = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return next(self._ids), profiler
+
+    def finish(self, profile_id, profiler, label):
+        profiler.disable()
+        self.active = False
+        buffer = io.StringIO()
+        buffer.write(f"{label}\n")
+        pstats.Stats(profiler, stream=buffer).sort_stats("cumulative").print_stats(50)
+        self.reports[profile_id] = buffer.getvalue()
+        while len(self.reports) > self.history:
+            self.reports.popitem(last=False)
+
+
+class MetricsMiddleware:
+    """Times every HTTP request end to end and feeds ``Metrics``.
+
+    Install it outermost so latency and payload size cover compression and
+    streamed bodies. With profiling enabled, a request carrying
+    ``X-Profile: 1`` runs under cProfile and gets an ``X-Profile-Id`` header
+    naming its report. The profiler sees the whole event loop thread, so
+    profile under low concurrency.
+    """
+
+    def __init__(self, app, metrics, profiles=None):
+        self.app = app
+        self.metrics = metrics
+        self.profiles = profiles
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current.set(stats)
+        status = 500
+        profile_id = profiler = None
+        if self.profiles is not None and _header(scope, b"x-profile") == b"1":
+            profile_id, profiler = self.profiles.start()
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile_id is not None:
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", str(profile_id).encode())]
+            elif message["type"] == "http.response.body":
+                stats.bytes_sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            current.reset(token)
+            route = scope.get("route")
+            route_path = route.path if route is not None else "unmatched"
+            if profiler is not None:
+                self.profiles.finish(profile_id, profiler, f"{scope['method']} {route_path} {status}")
+            self.metrics.record(scope["method"], route_path, status, stats)
+
+
+def _header(scope, name):
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value
+    return None
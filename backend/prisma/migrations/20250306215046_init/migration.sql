@@ -0,0 +1,30 @@
+-- CreateTable
+CREATE TABLE "Stock" (
+    "id" SERIAL NOT NULL,
+    "instrument" TEXT NOT NULL,
+
+    CONSTRAINT "Stock_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateTable
+CREATE TABLE "stock_data" (
+    "id" SERIAL NOT NULL,
+    "datetime" TIMESTAMP(3) NOT NULL,
+    "close" DOUBLE PRECISION NOT NULL,
+    "high" DOUBLE PRECISION NOT NULL,
+    "low" DOUBLE PRECISION NOT NULL,
+    "open" DOUBLE PRECISION NOT NULL,
+    "volume" INTEGER NOT NULL,
+    "stockId" INTEGER NOT NULL,
+
+    CONSTRAINT "stock_data_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE UNIQUE INDEX "Stock_instrument_key" ON "Stock"("instrument");
+
+-- CreateIndex
+CREATE UNIQUE INDEX "stock_data_datetime_key" ON "stock_data"("datetime");
+
+-- AddForeignKey
+ALTER TABLE "stock_data" ADD CONSTRAINT "stock_data_stockId_fkey" FOREIGN KEY ("stockId") REFERENCES "Stock"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
@@ -0,0 +1,11 @@
+-- DropIndex
+DROP INDEX "stock_data_datetime_key";
+
+-- DropIndex (created by `prisma db push` on databases that picked up the interim schema)
+DROP INDEX IF EXISTS "stock_data_stockId_datetime_idx";
+
+-- CreateIndex
+CREATE UNIQUE INDEX "stock_data_stockId_datetime_key" ON "stock_data"("stockId", "datetime");
+
+-- CreateIndex
+CREATE INDEX "stock_data_datetime_idx" ON "stock_data" USING BRIN ("datetime");
@@ -0,0 +1,42 @@
+-- CreateTable
+CREATE TABLE "stock_rollup" (
+    "stockId" INTEGER NOT NULL,
+    "interval" TEXT NOT NULL,
+    "bucket" TIMESTAMP(3) NOT NULL,
+    "open" DOUBLE PRECISION NOT NULL,
+    "high" DOUBLE PRECISION NOT NULL,
+    "low" DOUBLE PRECISION NOT NULL,
+    "close" DOUBLE PRECISION NOT NULL,
+    "volume" BIGINT NOT NULL,
+    "count" INTEGER NOT NULL,
+    "firstAt" TIMESTAMP(3) NOT NULL,
+    "lastAt" TIMESTAMP(3) NOT NULL,
+
+    CONSTRAINT "stock_rollup_pkey" PRIMARY KEY ("stockId","interval","bucket")
+);
+
+-- AddForeignKey
+ALTER TABLE "stock_rollup" ADD CONSTRAINT "stock_rollup_stockId_fkey" FOREIGN KEY ("stockId") REFERENCES "Stock"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
+
+-- Backfill: hourly buckets from the bars, then each tier from the one below.
+-- Every tier shares the Monday 1970-01-05 origin, so weeks start on Monday.
+INSERT INTO "stock_rollup" ("stockId", "interval", "bucket", "open", "high", "low", "close", "volume", "count", "firstAt", "lastAt")
+SELECT "stockId", '1h', date_bin(interval '1 hour', "datetime", timestamp '1970-01-05') AS "slot",
+       (array_agg("open" ORDER BY "datetime"))[1], MAX("high"), MIN("low"), (array_agg("close" ORDER BY "datetime" DESC))[1],
+       SUM("volume"), COUNT(*)::int, MIN("datetime"), MAX("datetime")
+FROM "stock_data"
+GROUP BY "stockId", "slot";
+
+INSERT INTO "stock_rollup" ("stockId", "interval", "bucket", "open", "high", "low", "close", "volume", "count", "firstAt", "lastAt")
+SELECT "stockId", '1d', date_bin(interval '1 day', "bucket", timestamp '1970-01-05') AS "slot",
+       (array_agg("open" ORDER BY "bucket"))[1], MAX("high"), MIN("low"), (array_agg("close" ORDER BY "bucket" DESC))[1],
+       SUM("volume"), SUM("count")::int, MIN("firstAt"), MAX("lastAt")
+FROM "stock_rollup" WHERE "interval" = '1h'
+GROUP BY "stockId", "slot";
+
+INSERT INTO "stock_rollup" ("stockId", "interval", "bucket", "open", "high", "low", "close", "volume", "count", "firstAt", "lastAt")
+SELECT "stockId", '1w', date_bin(interval '7 days', "bucket", timestamp '1970-01-05') AS "slot",
+       (array_agg("open" ORDER BY "bucket"))[1], MAX("high"), MIN("low"), (array_agg("close" ORDER BY "bucket" DESC))[1],
+       SUM("volume"), SUM("count")::int, MIN("firstAt"), MAX("lastAt")
+FROM "stock_rollup" WHERE "interval" = '1d'
+GROUP BY "stockId", "slot";
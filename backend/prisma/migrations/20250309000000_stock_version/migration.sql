@@ -0,0 +1,74 @@
+-- CreateTable
+CREATE TABLE "stock_version" (
+    "stockId" INTEGER NOT NULL,
+    "rows" BIGINT NOT NULL DEFAULT 0,
+    "latest" TIMESTAMP(3),
+    "version" BIGINT NOT NULL DEFAULT 0,
+
+    CONSTRAINT "stock_version_pkey" PRIMARY KEY ("stockId")
+);
+
+-- AddForeignKey
+ALTER TABLE "stock_version" ADD CONSTRAINT "stock_version_stockId_fkey" FOREIGN KEY ("stockId") REFERENCES "Stock"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
+
+-- Backfill
+INSERT INTO "stock_version" ("stockId", "rows", "latest", "version")
+SELECT "stockId", COUNT(*), MAX("datetime"), 1
+FROM "stock_data"
+GROUP BY "stockId";
+
+-- Every statement that changes stock_data bumps the version of the stocks it
+-- touched, whoever issued it (the API, the bulk loader or plain SQL). Inserts
+-- only move the row count and latest bar forward; updates and deletes may move
+-- or remove the latest bar, so it is re-read through the ("stockId", "datetime")
+-- index. Stocks are locked in id order so concurrent bulk writes cannot
+-- deadlock. Transition tables need one trigger per event.
+CREATE FUNCTION "stock_version_bump"() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO "stock_version" ("stockId", "rows", "latest", "version")
+        SELECT "stockId", COUNT(*), MAX("datetime"), 1 FROM new_rows GROUP BY "stockId" ORDER BY "stockId"
+        ON CONFLICT ("stockId") DO UPDATE SET
+            "rows" = "stock_version"."rows" + EXCLUDED."rows",
+            "latest" = GREATEST("stock_version"."latest", EXCLUDED."latest"),
+            "version" = "stock_version"."version" + 1;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO "stock_version" ("stockId", "rows", "version")
+        SELECT "stockId", SUM("delta"), 1
+        FROM (SELECT "stockId", 1 AS "delta" FROM new_rows UNION ALL SELECT "stockId", -1 FROM old_rows) AS "changed"
+        GROUP BY "stockId" ORDER BY "stockId"
+        ON CONFLICT ("stockId") DO UPDATE SET
+            "rows" = "stock_version"."rows" + EXCLUDED."rows",
+            "version" = "stock_version"."version" + 1;
+        UPDATE "stock_version" SET "latest" = (
+            SELECT MAX("datetime") FROM "stock_data" WHERE "stock_data"."stockId" = "stock_version"."stockId"
+        )
+        WHERE "stockId" IN (SELECT "stockId" FROM new_rows UNION SELECT "stockId" FROM old_rows);
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE "stock_version" SET
+            "rows" = "stock_version"."rows" - "removed"."rows",
+            "latest" = (SELECT MAX("datetime") FROM "stock_data" WHERE "stock_data"."stockId" = "stock_version"."stockId"),
+            "version" = "stock_version"."version" + 1
+        FROM (SELECT "stockId", COUNT(*) AS "rows" FROM old_rows GROUP BY "stockId") AS "removed"
+        WHERE "stock_version"."stockId" = "removed"."stockId";
+    ELSE
+        UPDATE "stock_version" SET "rows" = 0, "latest" = NULL, "version" = "version" + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER "stock_data_version_insert" AFTER INSERT ON "stock_data"
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION "stock_version_bump"();
+
+CREATE TRIGGER "stock_data_version_update" AFTER UPDATE ON "stock_data"
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION "stock_version_bump"();
+
+CREATE TRIGGER "stock_data_version_delete" AFTER DELETE ON "stock_data"
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION "stock_version_bump"();
+
+CREATE TRIGGER "stock_data_version_truncate" AFTER TRUNCATE ON "stock_data"
+FOR EACH STATEMENT EXECUTE FUNCTION "stock_version_bump"();
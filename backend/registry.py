@@ -0,0 +1,95 @@
+import os
+import time
+
+from cachetools import TTLCache
+
+from coalesce import SingleFlight
+
+# Unknown instruments/ids are remembered briefly so repeated misses skip the DB.
+REGISTRY_NEGATIVE_TTL = float(os.getenv("REGISTRY_NEGATIVE_TTL", "5"))
+# Stocks created through another worker show up in listings after this long.
+REGISTRY_REFRESH_SECONDS = float(os.getenv("REGISTRY_REFRESH_SECONDS", "60"))
+
+
+class InstrumentRegistry:
+    """In-memory stock lookups by instrument and id in front of the store.
+
+    Loaded at startup and updated by ``add`` when a stock is created here.
+    A lookup that misses falls through to the store, so stocks created by
+    another process are still found; the full listing is reloaded once it is
+    older than ``refresh_seconds``. Concurrent misses for the same key
+    share one store lookup.
+    """
+
+    def __init__(self, store, negative_ttl=REGISTRY_NEGATIVE_TTL, refresh_seconds=REGISTRY_REFRESH_SECONDS):
+        self.store = store
+        self.refresh_seconds = refresh_seconds
+        self._by_instrument = {}
+        self._by_id = {}
+        self._missing = TTLCache(maxsize=4096, ttl=negative_ttl)
+        self._loaded_at = None
+        self._lookups = SingleFlight()
+
+    async def load(self):
+        stocks = await self.store.find_stocks()
+        self._by_instrument = {stock.instrument: stock for stock in stocks}
+        self._by_id = {stock.id: stock for stock in stocks}
+        self._missing.clear()
+        self._loaded_at = time.monotonic()
+
+    def add(self, stock):
+        self._by_instrument[stock.instrument] = stock
+        self._by_id[stock.id] = stock
+        self._missing.pop(("instrument", stock.instrument), None)
+        self._missing.pop(("id", stock.id), None)
+
+    def clear(self):
+        self._by_instrument.clear()
+        self._by_id.clear()
+        self._missing.clear()
+        self._loaded_at = None
+
+    async def all(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+            await self.load()
+        return sorted(self._by_id.values(), key=lambda stock: stock.id)
+
+    async def get(self, instrument):
+        stock = self._by_instrument.get(instrument)
+        if stock is None and ("instrument", instrument) not in self._missing:
+            key = ("instrument", instrument)
+            stock = await self._lookups.do(key, self._lookup, self.store.get_stock, instrument, key)
+        return stock
+
+    async def get_by_id(self, stock_id):
+        stock = self._by_id.get(stock_id)
+        if stock is None and ("id", stock_id) not in self._missing:
+            key = ("id", stock_id)
+            stock = await self._lookups.do(key, self._lookup, self.store.get_stock_by_id, stock_id, key)
+        return stock
+
+    async def find(self, ids=None, instruments=None):
+        """Stocks for the given ids or instruments, fetching unknown ones in one query."""
+        if ids is not None:
+            known, keys, kind = self._by_id, ids, "id"
+        else:
+            known, keys, kind = self._by_instrument, instruments, "instrument"
+        unknown = [key for key in keys if key not in known and (kind, key) not in self._missing]
+        if unknown:
+            fetched = await self.store.find_stocks(**{"ids" if kind == "id" else "instruments": unknown})
+            for stock in fetched:
+                self.add(stock)
+            for key in unknown:
+                if key not in known:
+                    self._missing[(kind, key)] = True
+        return [known[key] for key in dict.fromkeys(keys) if key in known]
+
+    async def _lookup(self, fetch, value, miss_key):
+        return self._remember(await fetch(value), miss_key)
+
+    def _remember(self, stock, miss_key):
+        if stock is None:
+            self._missing[miss_key] = True
+        else:
+            self.add(stock)
+        return stock
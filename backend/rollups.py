@@ -0,0 +1,89 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+from series import WEEK_OFFSET_MS, aggregate, epoch_ms, parse_interval
+
+# Finest first; each tier is rebuilt from the one before it.
+ROLLUP_TIERS = ("1h", "1d", "1w")
+# Monday 1970-01-05: a boundary of every tier, so all of them share one origin.
+ROLLUP_ORIGIN_MS = WEEK_OFFSET_MS
+
+
+def tier_step(tier):
+    return parse_interval(tier)[0]
+
+
+def choose_tier(interval):
+    """Coarsest tier whose buckets tile every bucket of ``interval``, or None.
+
+    Weekly buckets start on Monday, so the weekly tier only serves weekly
+    intervals; hourly and daily buckets nest inside any multiple of them.
+    """
+    step, weekly = parse_interval(interval)
+    for tier in reversed(ROLLUP_TIERS):
+        tier_ms, tier_weekly = parse_interval(tier)
+        if tier_weekly and not weekly:
+            continue
+        if step % tier_ms == 0:
+            return tier
+    return None
+
+
+def floor_boundary(ms, step):
+    return (ms - ROLLUP_ORIGIN_MS) // step * step + ROLLUP_ORIGIN_MS
+
+
+def ceil_boundary(ms, step):
+    return -((ROLLUP_ORIGIN_MS - ms) // step) * step + ROLLUP_ORIGIN_MS
+
+
+def plan_range(tier, start=None, end=None):
+    """Split an inclusive ``[start, end]`` range into raw and rollup segments.
+
+    Whole tier buckets come from the rollup table; the partial buckets at
+    either edge are read as raw bars so results match resampling raw data.
+    Returns ``[(source, first_ms, last_ms)]`` with inclusive millisecond
+    bounds, ``None`` meaning unbounded.
+    """
+    step = tier_step(tier)
+    start_ms = epoch_ms(start) if start is not None else None
+    # Exclusive end, so an end on a boundary minus one millisecond closes a bucket.
+    stop_ms = epoch_ms(end) + 1 if end is not None else None
+    full_from = ceil_boundary(start_ms, step) if start_ms is not None else None
+    full_to = floor_boundary(stop_ms, step) if stop_ms is not None else None
+
+    if full_from is not None and full_to is not None and full_from >= full_to:
+        return [("raw", start_ms, stop_ms - 1)]
+    segments = []
+    if start_ms is not None and full_from > start_ms:
+        segments.append(("raw", start_ms, full_from - 1))
+    segments.append(("rollup", full_from, full_to - 1 if full_to is not None else None))
+    if stop_ms is not None and stop_ms > full_to:
+        segments.append(("raw", full_to, stop_ms - 1))
+    return segments
+
+
+def from_ms(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc) if ms is not None else None
+
+
+def rollup(columns, tier):
+    """Aggregate datetime-sorted bars into ``tier`` buckets.
+
+    Besides OHLCV each bucket carries its bar count and the times of its
+    first and last bar, which is what lets a later batch be merged into it.
+    """
+    timestamps = columns["datetime"].view(np.int64)
+    if len(timestamps) == 0:
+        return None
+    step = tier_step(tier)
+    keys = (timestamps - ROLLUP_ORIGIN_MS) // step
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    ends = np.append(starts[1:], len(timestamps)) - 1
+    buckets = aggregate(columns, starts)
+    buckets["datetime"] = (keys[starts] * step + ROLLUP_ORIGIN_MS).view("datetime64[ms]")
+    buckets["count"] = np.diff(np.append(starts, len(timestamps)))
+    buckets["first"] = timestamps[starts]
+    buckets["last"] = timestamps[ends]
+    return buckets
@@ -0,0 +1,48 @@
+from pydantic import BaseModel, ConfigDict, Field
+from datetime import datetime
+from typing import Dict, List, Literal, Optional, Union
+
+
+class StockCreate(BaseModel):
+    instrument: str
+
+
+class StockDataCreate(BaseModel):
+    stockId: int
+    datetime: datetime
+    close: float
+    high: float
+    low: float
+    open: float
+    volume: int
+
+
+class StrategyBatchRequest(BaseModel):
+    instruments: Union[Literal["all"], List[str]]
+    window: int = Field(3, ge=1)
+    include_moving_average: bool = False
+
+
+class BacktestRequest(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    instrument: str
+    strategy: Literal["ma_crossover", "breakout"]
+    params: Dict[str, int] = {}
+    fee: float = Field(0.0, ge=0, lt=1)
+    interval: Optional[str] = None
+    start: Optional[datetime] = Field(None, alias="from")
+    end: Optional[datetime] = Field(None, alias="to")
+
+
+class BacktestGridRequest(BacktestRequest):
+    grid: Dict[str, List[int]]
+    metric: Literal["sharpe", "totalReturn", "maxDrawdown"] = "sharpe"
+    top: int = Field(20, ge=1)
+
+
+class CorrelationRequest(BaseModel):
+    instruments: Union[Literal["all"], List[str]]
+    # Trailing number of aligned returns; all of them when omitted.
+    window: Optional[int] = Field(None, ge=2)
+    interval: Optional[str] = None
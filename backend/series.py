@@ -0,0 +1,119 @@
+import re
+from datetime import timezone
+
+import numpy as np
+
+PRICE_COLUMNS = ("open", "high", "low", "close")
+COLUMNS = ("datetime",) + PRICE_COLUMNS + ("volume",)
+
+INTERVAL_PATTERN = re.compile(r"^(\d+)([mhdw])$")
+INTERVAL_UNITS_MS = {"m": 60_000, "h": 3_600_000, "d": 86_400_000, "w": 7 * 86_400_000}
+# 1970-01-01 was a Thursday; weekly buckets start on Monday 1970-01-05.
+WEEK_OFFSET_MS = 4 * 86_400_000
+
+
+def epoch_ms(value):
+    """Milliseconds since the epoch, treating naive datetimes as UTC."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def rows_to_columns(rows, time_field="datetime"):
+    """Build contiguous OHLCV arrays from Prisma ``StockData`` rows.
+
+    ``time_field`` names the row attribute holding the bar time, e.g.
+    ``bucket`` for rollup rows.
+    """
+    n = len(rows)
+    columns = {
+        "datetime": np.fromiter((epoch_ms(getattr(row, time_field)) for row in rows), dtype=np.int64, count=n).view("datetime64[ms]"),
+        "volume": np.fromiter((row.volume for row in rows), dtype=np.int64, count=n),
+    }
+    for name in PRICE_COLUMNS:
+        columns[name] = np.fromiter((getattr(row, name) for row in rows), dtype=np.float64, count=n)
+    return columns
+
+
+def columns_to_records(columns):
+    """Turn OHLCV arrays back into JSON-ready row dicts.
+
+    Datetimes keep their milliseconds whenever any bar has a sub-second part.
+    """
+    timestamps = columns["datetime"].astype("datetime64[ms]", copy=False)
+    unit = "ms" if (timestamps.view(np.int64) % 1000).any() else "s"
+    fields = {
+        "datetime": np.datetime_as_string(timestamps, unit=unit, timezone="UTC").tolist(),
+    }
+    for name in PRICE_COLUMNS + ("volume",):
+        fields[name] = columns[name].tolist()
+    names = list(fields)
+    return [dict(zip(names, values)) for values in zip(*fields.values())]
+
+
+def slice_columns(columns, start=None, end=None, cursor=None, limit=None):
+    """Select rows by datetime bounds on sorted arrays without copying.
+
+    Mirrors the database filter: ``start``/``end`` are inclusive and
+    ``cursor`` is exclusive.
+    """
+    timestamps = columns["datetime"].view(np.int64)
+    lo, hi = 0, len(timestamps)
+    if start is not None:
+        lo = max(lo, int(np.searchsorted(timestamps, epoch_ms(start), side="left")))
+    if cursor is not None:
+        lo = max(lo, int(np.searchsorted(timestamps, epoch_ms(cursor), side="right")))
+    if end is not None:
+        hi = int(np.searchsorted(timestamps, epoch_ms(end), side="right"))
+    if limit is not None:
+        hi = min(hi, lo + limit)
+    return {name: array[lo:hi] for name, array in columns.items()}
+
+
+def parse_interval(interval):
+    """Parse ``15m``/``1h``/``1d``/``1w`` style intervals into milliseconds."""
+    match = INTERVAL_PATTERN.match(interval.strip().lower())
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid interval '{interval}', expected e.g. 15m, 1h, 1d or 1w")
+    count, unit = match.groups()
+    return int(count) * INTERVAL_UNITS_MS[unit], unit == "w"
+
+
+def aggregate(columns, starts):
+    """Aggregate OHLCV rows into buckets beginning at the sorted ``starts`` offsets."""
+    n = len(columns["close"])
+    ends = np.append(starts[1:], n) - 1
+    return {
+        "datetime": columns["datetime"][starts],
+        "open": columns["open"][starts],
+        "high": np.maximum.reduceat(columns["high"], starts),
+        "low": np.minimum.reduceat(columns["low"], starts),
+        "close": columns["close"][ends],
+        "volume": np.add.reduceat(columns["volume"], starts),
+    }
+
+
+def resample(columns, interval):
+    """Resample datetime-ordered OHLCV arrays into fixed calendar buckets."""
+    if len(columns["close"]) == 0:
+        return columns
+    step, weekly = parse_interval(interval)
+    offset = WEEK_OFFSET_MS if weekly else 0
+    keys = (columns["datetime"].view(np.int64) - offset) // step
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    resampled = aggregate(columns, starts)
+    resampled["datetime"] = (keys[starts] * step + offset).view("datetime64[ms]")
+    return resampled
+
+
+def downsample(columns, max_points):
+    """Reduce a series to at most ``max_points`` equal-count OHLCV buckets.
+
+    Unlike point-picking (LTTB), each bucket keeps its true high and low so
+    candles and extremes survive the reduction.
+    """
+    n = len(columns["close"])
+    if n <= max_points:
+        return columns
+    starts = np.unique(np.linspace(0, n, max_points, endpoint=False).astype(np.int64))
+    return aggregate(columns, starts)
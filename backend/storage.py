@@ -0,0 +1,487 @@
+import json
+import os
+import threading
+from dataclasses import dataclass
+from itertools import groupby
+
+import numpy as np
+
+from series import COLUMNS, PRICE_COLUMNS, rows_to_columns, epoch_ms
+from metrics import phase
+from rollups import ROLLUP_TIERS, ROLLUP_ORIGIN_MS, ceil_boundary, floor_boundary, from_ms, rollup, tier_step
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "prisma")
+TICK_STORE_PATH = os.getenv("TICK_STORE_PATH", "data/ticks")
+
+# On-disk dtype of every memmap column; datetime is int64 epoch milliseconds.
+COLUMN_DTYPES = {"datetime": "<i8", "open": "<f8", "high": "<f8", "low": "<f8", "close": "<f8", "volume": "<i8"}
+
+
+# Bars travel as one array per column; datetimes as epoch ms so offsets cannot be dropped.
+UPSERT_SOURCE = (
+    "SELECT s, to_timestamp(t / 1000.0) AT TIME ZONE 'UTC', o, h, l, c, v "
+    "FROM unnest($1::int[], $2::bigint[], $3::float8[], $4::float8[], $5::float8[], $6::float8[], $7::int[]) "
+    "AS u(s, t, o, h, l, c, v)"
+)
+UPSERT_INSERT = f'INSERT INTO "stock_data" ("stockId", "datetime", "open", "high", "low", "close", "volume") {UPSERT_SOURCE} '
+VALUE_COLUMNS = PRICE_COLUMNS + ("volume",)
+# Rows identical to the stored bar are left alone, so replays report them as skipped.
+UPSERT_CONFLICT = 'ON CONFLICT ("stockId", "datetime") DO UPDATE SET {} WHERE ({}) IS DISTINCT FROM ({}) '.format(
+    ", ".join(f'"{name}" = EXCLUDED."{name}"' for name in VALUE_COLUMNS),
+    ", ".join(f'"stock_data"."{name}"' for name in VALUE_COLUMNS),
+    ", ".join(f'EXCLUDED."{name}"' for name in VALUE_COLUMNS),
+)
+IGNORE_CONFLICT = 'ON CONFLICT ("stockId", "datetime") DO NOTHING '
+# xmax is zero only on freshly inserted tuples, which separates inserts from updates.
+# The keys of the written bars tell callers which incoming rows the store kept.
+UPSERT_COUNTS = (
+    'RETURNING "stockId", (EXTRACT(EPOCH FROM "datetime") * 1000)::bigint AS "t", (xmax = 0) AS "inserted") '
+    'SELECT COUNT(*) FILTER (WHERE "inserted")::int AS "inserted", '
+    'COUNT(*) FILTER (WHERE NOT "inserted")::int AS "updated", '
+    'array_agg("stockId") AS "stockIds", array_agg("t") AS "times" FROM written'
+)
+
+# Maintained by triggers on stock_data, so this is a primary-key lookup instead of a scan.
+STOCK_VERSION = (
+    'SELECT "stockId", "rows" AS "count", (EXTRACT(EPOCH FROM "latest") * 1000)::bigint AS "latest", "version" '
+    'FROM "stock_version"'
+)
+
+ROLLUP_COLUMNS = '"stockId", "interval", "bucket", "open", "high", "low", "close", "volume", "count", "firstAt", "lastAt"'
+# Folds a batch of new bars into existing buckets: open/close follow the
+# earliest/latest bar, extremes widen, volume and count add up.
+ROLLUP_MERGE = (
+    f'INSERT INTO "stock_rollup" ({ROLLUP_COLUMNS}) '
+    "SELECT s, $1, to_timestamp(b / 1000.0) AT TIME ZONE 'UTC', o, h, l, c, v, n, "
+    "to_timestamp(f / 1000.0) AT TIME ZONE 'UTC', to_timestamp(z / 1000.0) AT TIME ZONE 'UTC' "
+    "FROM unnest($2::int[], $3::bigint[], $4::float8[], $5::float8[], $6::float8[], $7::float8[], $8::bigint[], $9::int[], $10::bigint[], $11::bigint[]) "
+    "AS u(s, b, o, h, l, c, v, n, f, z) "
+    'ON CONFLICT ("stockId", "interval", "bucket") DO UPDATE SET '
+    '"open" = CASE WHEN EXCLUDED."firstAt" < "stock_rollup"."firstAt" THEN EXCLUDED."open" ELSE "stock_rollup"."open" END, '
+    '"close" = CASE WHEN EXCLUDED."lastAt" > "stock_rollup"."lastAt" THEN EXCLUDED."close" ELSE "stock_rollup"."close" END, '
+    '"high" = GREATEST("stock_rollup"."high", EXCLUDED."high"), '
+    '"low" = LEAST("stock_rollup"."low", EXCLUDED."low"), '
+    '"volume" = "stock_rollup"."volume" + EXCLUDED."volume", '
+    '"count" = "stock_rollup"."count" + EXCLUDED."count", '
+    '"firstAt" = LEAST("stock_rollup"."firstAt", EXCLUDED."firstAt"), '
+    '"lastAt" = GREATEST("stock_rollup"."lastAt", EXCLUDED."lastAt")'
+)
+ROLLUP_REPLACE = (
+    'ON CONFLICT ("stockId", "interval", "bucket") DO UPDATE SET '
+    + ", ".join(f'"{name}" = EXCLUDED."{name}"' for name in ("open", "high", "low", "close", "volume", "count", "firstAt", "lastAt"))
+)
+BAR_TIME, BUCKET_TIME = '"datetime"', '"bucket"'
+ROLLUP_BIN = f"date_bin($5::bigint * interval '1 millisecond', {{time}}, timestamp '{from_ms(ROLLUP_ORIGIN_MS):%Y-%m-%d}')"
+# $1 stock, $2 tier, $3/$4 millisecond range [from, to), $5 tier step in ms, $6 source tier.
+ROLLUP_FROM_BARS = (
+    f'INSERT INTO "stock_rollup" ({ROLLUP_COLUMNS}) '
+    f'SELECT "stockId", $2, {ROLLUP_BIN.format(time=BAR_TIME)} AS "slot", '
+    '(array_agg("open" ORDER BY "datetime"))[1], MAX("high"), MIN("low"), (array_agg("close" ORDER BY "datetime" DESC))[1], '
+    'SUM("volume"), COUNT(*)::int, MIN("datetime"), MAX("datetime") '
+    'FROM "stock_data" WHERE "stockId" = $1 '
+    "AND \"datetime\" >= to_timestamp($3 / 1000.0) AT TIME ZONE 'UTC' AND \"datetime\" < to_timestamp($4 / 1000.0) AT TIME ZONE 'UTC' "
+    'GROUP BY "stockId", "slot" '
+    + ROLLUP_REPLACE
+)
+ROLLUP_FROM_TIER = (
+    f'INSERT INTO "stock_rollup" ({ROLLUP_COLUMNS}) '
+    f'SELECT "stockId", $2, {ROLLUP_BIN.format(time=BUCKET_TIME)} AS "slot", '
+    '(array_agg("open" ORDER BY "bucket"))[1], MAX("high"), MIN("low"), (array_agg("close" ORDER BY "bucket" DESC))[1], '
+    'SUM("volume"), SUM("count")::int, MIN("firstAt"), MAX("lastAt") '
+    'FROM "stock_rollup" WHERE "stockId" = $1 AND "interval" = $6 '
+    "AND \"bucket\" >= to_timestamp($3 / 1000.0) AT TIME ZONE 'UTC' AND \"bucket\" < to_timestamp($4 / 1000.0) AT TIME ZONE 'UTC' "
+    'GROUP BY "stockId", "slot" '
+    + ROLLUP_REPLACE
+)
+
+
+def stock_data_where(stock_id, start=None, end=None, cursor=None):
+    datetime_filter = {}
+    if start is not None:
+        datetime_filter["gte"] = start
+    if end is not None:
+        datetime_filter["lte"] = end
+    if cursor is not None:
+        datetime_filter["gt"] = cursor
+
+    where = {"stockId": stock_id}
+    if datetime_filter:
+        where["datetime"] = datetime_filter
+    return where
+
+
+class PrismaStorage:
+    """Stocks and bars in Postgres through the Prisma client.
+
+    Rows come back as objects, so series reads pay a per-row conversion and
+    the endpoints keep hot series in the in-process cache. Writes also keep
+    the ``stock_rollup`` tiers current so long ranges read few rows.
+    """
+
+    columnar = False
+    rollups = True
+
+    def __init__(self, db):
+        self.db = db
+
+    async def connect(self):
+        await self.db.connect()
+
+    async def disconnect(self):
+        await self.db.disconnect()
+
+    async def get_stock(self, instrument):
+        return await self.db.stock.find_unique(where={"instrument": instrument})
+
+    async def get_stock_by_id(self, stock_id):
+        return await self.db.stock.find_unique(where={"id": stock_id})
+
+    async def find_stocks(self, ids=None, instruments=None):
+        if ids is not None:
+            return await self.db.stock.find_many(where={"id": {"in": ids}})
+        if instruments is not None:
+            return await self.db.stock.find_many(where={"instrument": {"in": instruments}})
+        return await self.db.stock.find_many()
+
+    async def create_stock(self, instrument):
+        return await self.db.stock.create(data={"instrument": instrument})
+
+    async def fingerprint(self, stock_id):
+        """``(row count, latest bar in epoch ms, write version)`` of a stock's bars."""
+        rows = await self.db.query_raw(f'{STOCK_VERSION} WHERE "stockId" = $1', stock_id)
+        if not rows:
+            return 0, None, 0
+        return rows[0]["count"], rows[0]["latest"], rows[0]["version"]
+
+    async def fingerprints(self, stock_ids):
+        """``fingerprint`` for many stocks in one query."""
+        rows = await self.db.query_raw(f'{STOCK_VERSION} WHERE "stockId" = ANY($1::int[])', list(stock_ids))
+        found = {row["stockId"]: (row["count"], row["latest"], row["version"]) for row in rows}
+        return {stock_id: found.get(stock_id, (0, None, 0)) for stock_id in stock_ids}
+
+    async def read_rows(self, stock_id, start=None, end=None, cursor=None, limit=None):
+        """Datetime-ordered rows; with a ``cursor`` this is one keyset page."""
+        return await self.db.stockdata.find_many(
+            where=stock_data_where(stock_id, start, end, cursor),
+            order={"datetime": "asc"},
+            **({"take": limit} if limit is not None else {}),
+        )
+
+    async def load_series(self, stock_id):
+        stock_data = await self.read_rows(stock_id)
+        with phase("arrays"):
+            return rows_to_columns(stock_data)
+
+    async def load_series_many(self, stock_ids):
+        stock_data = await self.db.stockdata.find_many(
+            where={"stockId": {"in": stock_ids}},
+            order=[{"stockId": "asc"}, {"datetime": "asc"}],
+        )
+        with phase("arrays"):
+            return {stock_id: rows_to_columns(list(rows)) for stock_id, rows in groupby(stock_data, key=lambda row: row.stockId)}
+
+    async def insert(self, data):
+        return await self.db.stockdata.create(data=data)
+
+    async def insert_many(self, rows):
+        return await self.db.stockdata.create_many(data=rows)
+
+    async def upsert_many(self, rows, ignore=False):
+        """Insert bars, updating (or with ``ignore`` skipping) existing ones.
+
+        Returns inserted, updated and skipped counts from a single statement,
+        and under ``written`` the positions in ``rows`` of the bars it wrote.
+        """
+        conflict = IGNORE_CONFLICT if ignore else UPSERT_CONFLICT
+        stock_ids = [row["stockId"] for row in rows]
+        timestamps = [epoch_ms(row["datetime"]) for row in rows]
+        result = await self.db.query_raw(
+            f"WITH written AS ({UPSERT_INSERT}{conflict}{UPSERT_COUNTS}",
+            stock_ids,
+            timestamps,
+            *([row[name] for row in rows] for name in VALUE_COLUMNS),
+        )
+        inserted, updated = result[0]["inserted"], result[0]["updated"]
+        # array_agg over no rows is NULL.
+        keys = set(zip(result[0]["stockIds"] or [], result[0]["times"] or []))
+        written = [i for i, key in enumerate(zip(stock_ids, timestamps)) if key in keys]
+        return {"inserted": inserted, "updated": updated, "skipped": len(rows) - inserted - updated, "written": written}
+
+    async def read_rollups(self, stock_id, tier, first=None, last=None):
+        """Rollup buckets of ``tier`` starting within the inclusive ``[first, last]``."""
+        bucket_filter = {}
+        if first is not None:
+            bucket_filter["gte"] = first
+        if last is not None:
+            bucket_filter["lte"] = last
+        where = {"stockId": stock_id, "interval": tier}
+        if bucket_filter:
+            where["bucket"] = bucket_filter
+        return await self.db.stockrollup.find_many(where=where, order={"bucket": "asc"})
+
+    async def merge_rollups(self, series):
+        """Fold newly inserted bars, ``{stock_id: columns}``, into every tier.
+
+        Only valid for bars that did not exist before; overwritten bars need
+        ``rebuild_rollups``.
+        """
+        for tier in ROLLUP_TIERS:
+            parts = [(stock_id, rollup(columns, tier)) for stock_id, columns in series.items()]
+            parts = [(stock_id, buckets) for stock_id, buckets in parts if buckets is not None]
+            if not parts:
+                return
+            buckets = {name: np.concatenate([part[name] for _, part in parts]) for name in parts[0][1]}
+            stock_ids = np.concatenate([np.full(len(part["count"]), stock_id) for stock_id, part in parts])
+            await self.db.execute_raw(
+                ROLLUP_MERGE,
+                tier,
+                stock_ids.tolist(),
+                buckets["datetime"].view(np.int64).tolist(),
+                *(buckets[name].tolist() for name in VALUE_COLUMNS),
+                buckets["count"].tolist(),
+                buckets["first"].tolist(),
+                buckets["last"].tolist(),
+            )
+
+    async def rebuild_rollups(self, stock_id, first_ms, last_ms):
+        """Recompute every bucket touching ``[first_ms, last_ms]`` from the tier below."""
+        source = None
+        for tier in ROLLUP_TIERS:
+            step = tier_step(tier)
+            sql = ROLLUP_FROM_BARS if source is None else ROLLUP_FROM_TIER
+            params = (stock_id, tier, floor_boundary(first_ms, step), ceil_boundary(last_ms + 1, step), step)
+            await self.db.execute_raw(sql, *params, *((source,) if source else ()))
+            source = tier
+
+
+@dataclass
+class Stock:
+    id: int
+    instrument: str
+
+
+class BarExists(ValueError):
+    """An insert hit a (stockId, datetime) that is already stored."""
+
+
+class MemmapStorage:
+    """Append-only per-column files under ``root``, read through ``np.memmap``.
+
+    Each stock gets a directory holding one raw little-endian file per OHLCV
+    column. Bars are kept sorted by datetime, so the datetime file doubles as
+    the range index: ``searchsorted`` over the mapping touches a handful of
+    pages and the selected slices are views straight onto the page cache.
+
+    Writes are expected from one process at a time; readers in other
+    processes notice them through the per-stock version file. Appends past
+    the last bar are written in place; anything earlier rewrites the files
+    through a temporary copy, which leaves arrays already handed out mapping
+    the old inode.
+    """
+
+    columnar = True
+    # Resampling mapped arrays is a sequential scan of the page cache already.
+    rollups = False
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._maps = {}
+        os.makedirs(root, exist_ok=True)
+        self._catalog_path = os.path.join(root, "stocks.json")
+        self._stocks = {}
+        if os.path.exists(self._catalog_path):
+            with open(self._catalog_path) as handle:
+                for item in json.load(handle):
+                    self._stocks[item["id"]] = Stock(**item)
+
+    async def connect(self):
+        pass
+
+    async def disconnect(self):
+        self._maps.clear()
+
+    async def get_stock(self, instrument):
+        return next((stock for stock in self._stocks.values() if stock.instrument == instrument), None)
+
+    async def get_stock_by_id(self, stock_id):
+        return self._stocks.get(stock_id)
+
+    async def find_stocks(self, ids=None, instruments=None):
+        stocks = sorted(self._stocks.values(), key=lambda stock: stock.id)
+        if ids is not None:
+            return [stock for stock in stocks if stock.id in set(ids)]
+        if instruments is not None:
+            return [stock for stock in stocks if stock.instrument in set(instruments)]
+        return stocks
+
+    async def create_stock(self, instrument):
+        with self._lock:
+            stock = Stock(id=max(self._stocks, default=0) + 1, instrument=instrument)
+            os.makedirs(self._stock_dir(stock.id), exist_ok=True)
+            self._stocks[stock.id] = stock
+            self._write_atomic(self._catalog_path, json.dumps([vars(item) for item in self._stocks.values()]).encode())
+        return stock
+
+    async def fingerprint(self, stock_id):
+        timestamps = self.columns(stock_id)["datetime"].view(np.int64)
+        return len(timestamps), int(timestamps[-1]) if len(timestamps) else None, self.version(stock_id)
+
+    async def fingerprints(self, stock_ids):
+        return {stock_id: await self.fingerprint(stock_id) for stock_id in stock_ids}
+
+    async def load_series(self, stock_id):
+        return self.columns(stock_id)
+
+    async def load_series_many(self, stock_ids):
+        series = {stock_id: self.columns(stock_id) for stock_id in stock_ids}
+        return {stock_id: columns for stock_id, columns in series.items() if len(columns["close"])}
+
+    async def insert(self, data):
+        await self.insert_many([data])
+        return data
+
+    async def insert_many(self, rows):
+        """Store new bars; like the unique index on Postgres, one existing bar fails the batch."""
+        rows = sorted(rows, key=lambda row: (row["stockId"], epoch_ms(row["datetime"])))
+        series = {
+            stock_id: rows_to_columns([Bar(row) for row in group])
+            for stock_id, group in groupby(rows, key=lambda row: row["stockId"])
+        }
+        for stock_id, columns in series.items():
+            stored, incoming = self.columns(stock_id)["datetime"].view(np.int64), columns["datetime"].view(np.int64)
+            positions = np.minimum(np.searchsorted(stored, incoming), max(len(stored) - 1, 0))
+            if (len(stored) and (stored[positions] == incoming).any()) or (incoming[1:] == incoming[:-1]).any():
+                raise BarExists(f"Stock {stock_id} already has a bar at one of these datetimes")
+        for stock_id, columns in series.items():
+            self.append(stock_id, columns)
+        return len(rows)
+
+    async def upsert_many(self, rows, ignore=False):
+        counts = {"inserted": 0, "updated": 0, "skipped": 0, "written": []}
+        order = sorted(range(len(rows)), key=lambda i: (rows[i]["stockId"], epoch_ms(rows[i]["datetime"])))
+        for stock_id, group in groupby(order, key=lambda i: rows[i]["stockId"]):
+            indexes = list(group)
+            columns = rows_to_columns([Bar(rows[i]) for i in indexes])
+            current = self.columns(stock_id)
+            stored, incoming = current["datetime"].view(np.int64), columns["datetime"].view(np.int64)
+            positions = np.minimum(np.searchsorted(stored, incoming), max(len(stored) - 1, 0))
+            exists = stored[positions] == incoming if len(stored) else np.zeros(len(incoming), dtype=bool)
+            write = ~exists
+            if not ignore and exists.any():
+                differs = np.zeros(int(exists.sum()), dtype=bool)
+                for name in VALUE_COLUMNS:
+                    differs |= current[name][positions[exists]] != columns[name][exists]
+                write[exists] = differs
+                counts["updated"] += int(differs.sum())
+            counts["inserted"] += int((~exists).sum())
+            counts["skipped"] += int(len(incoming) - write.sum())
+            counts["written"].extend(i for i, kept in zip(indexes, write) if kept)
+            if write.any():
+                self.append(stock_id, {name: array[write] for name, array in columns.items()})
+        counts["written"].sort()
+        return counts
+
+    def columns(self, stock_id):
+        """Read-only memory-mapped OHLCV arrays for a stock.
+
+        Mappings are reused until the stock's version moves, which also
+        picks up bars another process (the bulk loader) wrote.
+        """
+        with self._lock:
+            version = self.version(stock_id)
+            mapped = self._maps.get(stock_id)
+            if mapped is None or mapped[0] != version:
+                mapped = self._maps[stock_id] = (version, self._open(stock_id))
+            return mapped[1]
+
+    def version(self, stock_id):
+        """Write counter of a stock; every append bumps it, in-place rewrites included."""
+        try:
+            with open(self._version_path(stock_id)) as handle:
+                return int(handle.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def append(self, stock_id, columns):
+        """Store datetime-sorted bars; bars at an existing datetime replace it."""
+        if len(columns["datetime"]) == 0:
+            return
+        with self._lock:
+            current = self._open(stock_id)
+            new_times = columns["datetime"].view(np.int64)
+            old_times = current["datetime"].view(np.int64)
+            if len(old_times) == 0 or new_times[0] > old_times[-1]:
+                for name in COLUMNS:
+                    with open(self._column_path(stock_id, name), "ab") as handle:
+                        handle.write(self._raw(name, columns[name]))
+            else:
+                merged = self._merge(current, columns)
+                for name in COLUMNS:
+                    self._write_atomic(self._column_path(stock_id, name), self._raw(name, merged[name]))
+            self._write_atomic(self._version_path(stock_id), str(self.version(stock_id) + 1).encode())
+            # The next read maps the files again at their new length.
+            self._maps.pop(stock_id, None)
+
+    def _open(self, stock_id):
+        columns = {}
+        for name in COLUMNS:
+            path = self._column_path(stock_id, name)
+            if os.path.exists(path) and os.path.getsize(path):
+                array = np.memmap(path, dtype=COLUMN_DTYPES[name], mode="r")
+            else:
+                array = np.empty(0, dtype=COLUMN_DTYPES[name])
+            columns[name] = array
+        # A crash between column writes leaves ragged files; trust the shortest.
+        length = min(len(array) for array in columns.values())
+        columns = {name: array[:length] for name, array in columns.items()}
+        columns["datetime"] = columns["datetime"].view("datetime64[ms]")
+        return columns
+
+    @staticmethod
+    def _merge(current, columns):
+        combined = {name: np.concatenate((current[name], columns[name])) for name in COLUMNS}
+        timestamps = combined["datetime"].view(np.int64)
+        # Stable sort keeps new bars after old ones at the same datetime; keep the last.
+        order = np.argsort(timestamps, kind="stable")
+        sorted_times = timestamps[order]
+        keep = np.append(sorted_times[1:] != sorted_times[:-1], True)
+        return {name: array[order][keep] for name, array in combined.items()}
+
+    @staticmethod
+    def _raw(name, array):
+        array = np.asarray(array)
+        if array.dtype.kind == "M":
+            array = array.astype("datetime64[ms]").view(np.int64)
+        return np.ascontiguousarray(array, dtype=COLUMN_DTYPES[name]).tobytes()
+
+    @staticmethod
+    def _write_atomic(path, payload):
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as handle:
+            handle.write(payload)
+        os.replace(temporary, path)
+
+    def _stock_dir(self, stock_id):
+        return os.path.join(self.root, str(stock_id))
+
+    def _column_path(self, stock_id, name):
+        return os.path.join(self._stock_dir(stock_id), f"{name}.bin")
+
+    def _version_path(self, stock_id):
+        return os.path.join(self._stock_dir(stock_id), "version")
+
+
+class Bar:
+    """Attribute access over a bar dict so ``rows_to_columns`` accepts it."""
+
+    def __init__(self, data):
+        self.__dict__.update(data)
+
+
+def create_storage(db, backend=STORAGE_BACKEND, path=TICK_STORE_PATH):
+    if backend == "memmap":
+        return MemmapStorage(path)
+    if backend == "prisma":
+        return PrismaStorage(db)
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}', expected prisma or memmap")
@@ -1,17 +1,49 @@
 import unittest
 from unittest import mock
 import numpy as np
+import pandas as pd
 import datetime
 from fastapi.testclient import TestClient
 import sys
 import os
 import json
+import asyncio
+import threading
+import tempfile
+import types
+from concurrent.futures import ThreadPoolExecutor
 
 # Import your app
-from main import app, db, startup, shutdown
+from main import app, db, startup, shutdown, series_cache, series_versions, strategy_states, registry, correlation_cache
+import main
+from series import rows_to_columns, resample, downsample, epoch_ms
+from engine import moving_average, best_buy_sell, best_trades, StrategyState
+from indicators import parse_indicators, compute_indicators, to_json
+from cache import SeriesCache
+import executor
+import http_cache
+import storage
+import broadcast
+import benchmark
+import metrics
+import rollups
+import backtest
+import correlation
+import loader
+import httpx
+from coalesce import SingleFlight
+import io
+from formats import encode_packed, decode_packed, encode_arrow, negotiate
 
 client = TestClient(app)
 
+def reset_caches():
+    series_cache.clear()
+    strategy_states.clear()
+    registry.clear()
+    correlation_cache.clear()
+    series_versions.clear()
+
 class MockPrismaStock:
     def __init__(self, id, instrument):
         self.id = id
@@ -28,6 +60,23 @@ class MockPrismaStockData:
         self.open = open
         self.volume = volume
 
+def stock_versions(rows):
+    """A ``db.query_raw`` side effect answering version lookups from ``rows``.
+
+    Other raw queries fall through to the mock's ``return_value``. Each bar
+    counts as one write, so the version follows the row count.
+    """
+    def query_raw(sql, *args):
+        if '"stock_version"' not in sql:
+            return mock.DEFAULT
+        found = []
+        for stock_id in args[0] if isinstance(args[0], list) else [args[0]]:
+            times = [epoch_ms(row.datetime) for row in rows if row.stockId == stock_id]
+            if times:
+                found.append({"stockId": stock_id, "count": len(times), "latest": max(times), "version": len(times)})
+        return found
+    return query_raw
+
 class TestAppSetup(unittest.TestCase):
     @mock.patch('main.db.connect')
     async def test_startup(self, mock_connect):
@@ -151,6 +200,427 @@ class TestGetStockData(unittest.TestCase):
         response = client.post("/get-stock-data?instrument=HINDALCO")
         self.assertEqual(response.status_code, 405)  # Method not allowed
 
+class TestGetStockDataPagination(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+
+    def make_rows(self, count):
+        start = datetime.datetime(2024, 1, 1, 9, 15)
+        return [
+            MockPrismaStockData(id=i + 1, stockId=1, datetime=start + datetime.timedelta(minutes=i), close=100.0 + i, high=101.0 + i, low=99.0 + i, open=100.0 + i, volume=1000)
+            for i in range(count)
+        ]
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_range_and_ordering_are_pushed_to_query(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.make_rows(3)
+        mock_query_raw.return_value = []
+
+        response = client.get("/get-stock-data", params={"instrument": "HINDALCO", "from": "2024-01-01T00:00:00", "to": "2024-01-02T00:00:00", "limit": 10})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data["data"]), 3)
+        self.assertIsNone(data["nextCursor"])
+
+        kwargs = mock_find_many.call_args.kwargs
+        self.assertEqual(kwargs["order"], {"datetime": "asc"})
+        self.assertEqual(kwargs["take"], 11)
+        self.assertEqual(kwargs["where"]["stockId"], 1)
+        self.assertEqual(kwargs["where"]["datetime"]["gte"], datetime.datetime(2024, 1, 1))
+        self.assertEqual(kwargs["where"]["datetime"]["lte"], datetime.datetime(2024, 1, 2))
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_next_cursor_when_more_rows(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.make_rows(3)
+        mock_query_raw.return_value = []
+
+        response = client.get("/get-stock-data", params={"instrument": "HINDALCO", "limit": 2})
+        data = response.json()
+        self.assertEqual(len(data["data"]), 2)
+        self.assertEqual(data["nextCursor"], "2024-01-01T09:16:00.000Z")
+
+        client.get("/get-stock-data", params={"instrument": "HINDALCO", "limit": 2, "cursor": data["nextCursor"]})
+        self.assertEqual(mock_find_many.call_args.kwargs["where"]["datetime"], {"gt": datetime.datetime(2024, 1, 1, 9, 16, tzinfo=datetime.timezone.utc)})
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_cached_and_database_pages_match(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_query_raw.return_value = []
+        rows = self.make_rows(5)
+        params = {"instrument": "HINDALCO", "from": "2024-01-01T09:16:00Z", "limit": 2}
+
+        mock_find_many.return_value = rows[1:4]
+        from_database = client.get("/get-stock-data", params=params)
+        mock_find_many.return_value = rows
+        asyncio.run(main.load_series(1))
+        from_cache = client.get("/get-stock-data", params=params)
+
+        self.assertEqual(from_cache.json(), from_database.json())
+        self.assertEqual(from_cache.json()["data"][0], {"datetime": "2024-01-01T09:16:00Z", "open": 101.0, "high": 102.0, "low": 100.0, "close": 101.0, "volume": 1000})
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_sub_second_bars_keep_milliseconds(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_query_raw.return_value = []
+        rows = self.make_rows(2)
+        rows[1].datetime = rows[0].datetime + datetime.timedelta(milliseconds=250)
+        mock_find_many.return_value = rows
+
+        data = client.get("/get-stock-data", params={"instrument": "HINDALCO"}).json()["data"]
+        self.assertEqual([row["datetime"] for row in data], ["2024-01-01T09:15:00.000Z", "2024-01-01T09:15:00.250Z"])
+
+    def test_limit_is_capped(self):
+        response = client.get("/get-stock-data", params={"instrument": "HINDALCO", "limit": 1000000})
+        self.assertEqual(response.status_code, 422)
+
+class TestResampling(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+
+    def make_rows(self, count, step=datetime.timedelta(minutes=30)):
+        start = datetime.datetime(2024, 1, 1, 9, 0)
+        return [
+            MockPrismaStockData(id=i + 1, stockId=1, datetime=start + step * i, close=100.0 + i, high=101.0 + i, low=99.0 - i, open=100.5 + i, volume=10)
+            for i in range(count)
+        ]
+
+    def test_hourly_buckets(self):
+        columns = resample(rows_to_columns(self.make_rows(5)), "1h")
+        np.testing.assert_array_equal(columns["open"], [100.5, 102.5, 104.5])
+        np.testing.assert_array_equal(columns["close"], [101.0, 103.0, 104.0])
+        np.testing.assert_array_equal(columns["high"], [102.0, 104.0, 105.0])
+        np.testing.assert_array_equal(columns["low"], [98.0, 96.0, 95.0])
+        np.testing.assert_array_equal(columns["volume"], [20, 20, 10])
+        self.assertEqual(str(columns["datetime"][1]), "2024-01-01T10:00:00.000")
+
+    def test_weekly_buckets_start_on_monday(self):
+        columns = resample(rows_to_columns(self.make_rows(10, datetime.timedelta(days=1))), "1w")
+        # 2024-01-01 is a Monday, so ten daily bars span two weeks.
+        self.assertEqual(len(columns["close"]), 2)
+        self.assertEqual(str(columns["datetime"][1]), "2024-01-08T00:00:00.000")
+        np.testing.assert_array_equal(columns["volume"], [70, 30])
+
+    def test_invalid_interval(self):
+        with self.assertRaises(ValueError):
+            resample(rows_to_columns(self.make_rows(2)), "3y")
+
+    def test_downsample_keeps_extremes(self):
+        columns = rows_to_columns(self.make_rows(1000))
+        reduced = downsample(columns, 100)
+        self.assertEqual(len(reduced["close"]), 100)
+        self.assertEqual(reduced["high"].max(), columns["high"].max())
+        self.assertEqual(reduced["low"].min(), columns["low"].min())
+        self.assertEqual(reduced["volume"].sum(), columns["volume"].sum())
+
+    def test_downsample_short_series_unchanged(self):
+        columns = rows_to_columns(self.make_rows(10))
+        self.assertIs(downsample(columns, 100), columns)
+
+    @mock.patch.object(main.store, 'rollups', False)
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_endpoint_resamples(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.make_rows(5)
+        mock_query_raw.return_value = []
+
+        response = client.get("/get-stock-data", params={"instrument": "HINDALCO", "interval": "1h"})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()["data"]
+        self.assertEqual(len(data), 3)
+        self.assertEqual(data[0], {"datetime": "2024-01-01T09:00:00Z", "open": 100.5, "high": 102.0, "low": 98.0, "close": 101.0, "volume": 20})
+        self.assertNotIn("take", mock_find_many.call_args.kwargs)
+
+        response = client.get("/get-stock-data", params={"instrument": "HINDALCO", "interval": "fortnight"})
+        self.assertEqual(response.status_code, 400)
+
+class TestExportStockData(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+        start = datetime.datetime(2024, 1, 1)
+        self.rows = [
+            MockPrismaStockData(id=i + 1, stockId=1, datetime=start + datetime.timedelta(minutes=i), close=100.0 + i, high=101.0 + i, low=99.0 + i, open=100.5 + i, volume=10 * i)
+            for i in range(5)
+        ]
+
+    def paged_find_many(self, where, order, take):
+        rows = self.rows
+        if "datetime" in where:
+            rows = [row for row in rows if row.datetime > where["datetime"]["gt"]]
+        return rows[:take]
+
+    @mock.patch('main.EXPORT_PAGE_SIZE', 2)
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_ndjson_export_pages_through_database(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_query_raw.side_effect = stock_versions(self.rows)
+        mock_find_many.side_effect = self.paged_find_many
+
+        response = client.get("/export-stock-data?instrument=HINDALCO")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("application/x-ndjson"))
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([line["close"] for line in lines], [100.0, 101.0, 102.0, 103.0, 104.0])
+        self.assertEqual(mock_find_many.call_count, 3)
+        self.assertEqual(mock_find_many.call_args.kwargs["where"]["datetime"], {"gt": self.rows[3].datetime})
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_csv_export(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_query_raw.side_effect = stock_versions(self.rows)
+        mock_find_many.side_effect = self.paged_find_many
+
+        response = client.get("/export-stock-data?instrument=HINDALCO&format=csv")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('filename="HINDALCO.csv"', response.headers["content-disposition"])
+        lines = response.text.splitlines()
+        self.assertEqual(lines[0], "datetime,open,high,low,close,volume")
+        self.assertEqual(lines[1], "2024-01-01T00:00:00Z,100.5,101.0,99.0,100.0,0")
+        self.assertEqual(len(lines), 6)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_export_sees_writes_from_another_process(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.side_effect = lambda **kwargs: self.paged_find_many(**kwargs) if "take" in kwargs else self.rows
+        mock_query_raw.side_effect = stock_versions(self.rows)
+        client.get("/strategy?instrument=HINDALCO")
+        self.assertIn(1, series_cache)
+
+        # The bulk loader appended a bar; this process never saw the write.
+        self.rows.append(MockPrismaStockData(id=6, stockId=1, datetime=datetime.datetime(2024, 1, 1, 0, 5), close=105.0, high=106.0, low=104.0, open=105.5, volume=50))
+        response = client.get("/export-stock-data?instrument=HINDALCO")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([line["close"] for line in lines], [100.0, 101.0, 102.0, 103.0, 104.0, 105.0])
+
+    def test_export_rejects_unknown_format(self):
+        response = client.get("/export-stock-data?instrument=HINDALCO&format=xml")
+        self.assertEqual(response.status_code, 422)
+
+    @mock.patch('main.db.stock.find_unique')
+    def test_export_stock_not_found(self, mock_find_unique):
+        mock_find_unique.return_value = None
+        response = client.get("/export-stock-data?instrument=NONEXISTENT")
+        self.assertEqual(response.status_code, 404)
+
+class TestBinaryFormats(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+        start = datetime.datetime(2024, 1, 1)
+        self.rows = [
+            MockPrismaStockData(id=i + 1, stockId=1, datetime=start + datetime.timedelta(days=i), close=100.0 + i, high=101.0 + i, low=99.0 + i, open=100.5 + i, volume=1000 + i)
+            for i in range(6)
+        ]
+
+    def test_packed_round_trip(self):
+        columns = rows_to_columns(self.rows)
+        payload = encode_packed(columns, {"note": "x"})
+        decoded, metadata = decode_packed(payload)
+        self.assertEqual(metadata, {"note": "x"})
+        for name, array in columns.items():
+            np.testing.assert_array_equal(decoded[name], array)
+            self.assertEqual(decoded[name].dtype, array.dtype)
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate(None), "json")
+        self.assertEqual(negotiate("application/json"), "json")
+        self.assertEqual(negotiate("application/x-ohlcv-packed"), "packed")
+        self.assertEqual(negotiate("application/vnd.apache.arrow.stream, */*;q=0.1"), "arrow")
+
+    def test_arrow_round_trip(self):
+        import pyarrow as pa
+        columns = rows_to_columns(self.rows)
+        table = pa.ipc.open_stream(encode_arrow(columns, {"note": "x"})).read_all()
+        self.assertEqual(table.column_names, list(columns))
+        np.testing.assert_array_equal(table["close"].to_numpy(), columns["close"])
+        self.assertEqual(json.loads(table.schema.metadata[b"metadata"]), {"note": "x"})
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_stock_data_packed(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows
+        mock_query_raw.return_value = []
+
+        response = client.get("/get-stock-data", params={"instrument": "HINDALCO", "limit": 5}, headers={"Accept": "application/x-ohlcv-packed"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/x-ohlcv-packed")
+        arrays, metadata = decode_packed(response.content)
+        np.testing.assert_array_equal(arrays["close"], [100.0, 101.0, 102.0, 103.0, 104.0])
+        self.assertEqual(str(arrays["datetime"][0]), "2024-01-01T00:00:00.000")
+        self.assertEqual(metadata["stock"], {"id": 1, "instrument": "HINDALCO"})
+        self.assertIsNotNone(metadata["nextCursor"])
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_stock_data_arrow(self, mock_find_unique, mock_find_many, mock_query_raw):
+        import pyarrow as pa
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows
+        mock_query_raw.return_value = []
+
+        response = client.get("/get-stock-data", params={"instrument": "HINDALCO"}, headers={"Accept": "application/vnd.apache.arrow.stream"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/vnd.apache.arrow.stream")
+        table = pa.ipc.open_stream(response.content).read_all()
+        self.assertEqual(table["close"].to_pylist(), [100.0, 101.0, 102.0, 103.0, 104.0, 105.0])
+        self.assertEqual(json.loads(table.schema.metadata[b"metadata"])["stock"], {"id": 1, "instrument": "HINDALCO"})
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_strategy_packed(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows
+
+        response = client.get("/strategy", params={"instrument": "HINDALCO", "indicators": "macd"}, headers={"Accept": "application/x-ohlcv-packed"})
+        arrays, metadata = decode_packed(response.content)
+        self.assertEqual(metadata["BestBuySell"], {"BuyIndex": 0, "SellIndex": 5, "Profit": 5.0})
+        self.assertEqual(len(arrays["MovingAverage"]), 6)
+        self.assertTrue(np.isnan(arrays["MovingAverage"][:2]).all())
+        self.assertAlmostEqual(arrays["MovingAverage"][2], 101.0)
+        self.assertIn("macd:12:26:9.signal", arrays)
+
+    @mock.patch('main.ARROW_AVAILABLE', False)
+    def test_arrow_unavailable(self):
+        response = client.get("/get-stock-data", params={"instrument": "HINDALCO"}, headers={"Accept": "application/vnd.apache.arrow.stream"})
+        self.assertEqual(response.status_code, 406)
+
+class TestConditionalRequests(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+        start = datetime.datetime(2024, 1, 1)
+        self.rows = [
+            MockPrismaStockData(id=i + 1, stockId=1, datetime=start + datetime.timedelta(minutes=i), close=100.0 + i, high=101.0 + i, low=99.0 + i, open=100.5 + i, volume=1000 + i)
+            for i in range(200)
+        ]
+
+    @mock.patch('main.db.stock.create')
+    @mock.patch('main.db.stock.find_unique')
+    @mock.patch('main.db.stock.find_many')
+    def test_get_all_stocks_etag(self, mock_find_many, mock_find_unique, mock_create):
+        mock_find_many.return_value = [MockPrismaStock(id=1, instrument="HINDALCO"), MockPrismaStock(id=2, instrument="TATASTEEL")]
+        mock_find_unique.return_value = None
+
+        first = client.get("/get-all-stocks")
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers["Cache-Control"], "public, no-cache")
+        second = client.get("/get-all-stocks", headers={"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b"")
+
+        mock_create.return_value = MockPrismaStock(id=3, instrument="NEW")
+        client.post("/create-stock", json={"instrument": "NEW"})
+        third = client.get("/get-all-stocks", headers={"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(third.status_code, 200)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_stock_data_not_modified_skips_rows(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows
+        mock_query_raw.return_value = [{"stockId": 1, "count": 200, "latest": 1704079140000, "version": 7}]
+
+        first = client.get("/get-stock-data?instrument=HINDALCO")
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers["ETag"]
+        # Revalidation reads the trigger-maintained version row, never the bars.
+        sql = mock_query_raw.call_args.args[0]
+        self.assertIn('"stock_version"', sql)
+        self.assertNotIn("COUNT", sql)
+
+        second = client.get("/get-stock-data?instrument=HINDALCO", headers={"If-None-Match": etag})
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.headers["ETag"], etag)
+        mock_find_many.assert_called_once()
+
+        other_page = client.get("/get-stock-data?instrument=HINDALCO&limit=5", headers={"If-None-Match": etag})
+        self.assertEqual(other_page.status_code, 200)
+
+        mock_query_raw.return_value = [{"stockId": 1, "count": 201, "latest": 1704079200000, "version": 8}]
+        changed = client.get("/get-stock-data?instrument=HINDALCO", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_in_place_update_changes_etag(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows
+        mock_query_raw.return_value = [{"stockId": 1, "count": 200, "latest": 1704079140000, "version": 7}]
+        etag = client.get("/get-stock-data?instrument=HINDALCO").headers["ETag"]
+
+        # An upsert that rewrote an old bar leaves the count and latest bar alone.
+        mock_query_raw.return_value = [{"stockId": 1, "count": 200, "latest": 1704079140000, "version": 8}]
+        changed = client.get("/get-stock-data?instrument=HINDALCO", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["ETag"], etag)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_closed_range_is_cacheable(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows[:10]
+        mock_query_raw.return_value = [{"stockId": 1, "count": 200, "latest": 1704079140000, "version": 7}]
+
+        params = {"instrument": "HINDALCO", "to": "2024-01-01T00:09:00"}
+        self.assertEqual(client.get("/get-stock-data", params=params).headers["Cache-Control"], "public, no-cache")
+        with mock.patch('main.CLOSED_RANGE_MAX_AGE', 3600):
+            response = client.get("/get-stock-data", params=params)
+        self.assertEqual(response.headers["Cache-Control"], "public, max-age=3600")
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_gzip_compression(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows
+        mock_query_raw.return_value = []
+
+        response = client.get("/get-stock-data?instrument=HINDALCO", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(len(response.json()["data"]), 200)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_brotli_compression(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows
+        mock_query_raw.return_value = []
+
+        response = client.get("/get-stock-data?instrument=HINDALCO", headers={"Accept-Encoding": "br, gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        raw = client.get("/get-stock-data?instrument=HINDALCO", headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", raw.headers)
+        self.assertEqual(response.json(), raw.json())
+
+    def test_accepts_encoding(self):
+        self.assertTrue(http_cache.accepts_encoding({"accept-encoding": "gzip, br;q=0.8"}, "br"))
+        self.assertFalse(http_cache.accepts_encoding({"accept-encoding": "gzip, br;q=0"}, "br"))
+        self.assertFalse(http_cache.accepts_encoding({"accept-encoding": "gzip"}, "br"))
+
 class TestCreateStock(unittest.TestCase):
     @mock.patch('main.db.stock.create')
     @mock.patch('main.db.stock.find_unique')
@@ -310,6 +780,182 @@ class TestAddStockData(unittest.TestCase):
         response = client.get("/add-stock-data")
         self.assertEqual(response.status_code, 405)  # Method not allowed
 
+class TestAddStockDataBulk(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+        self.rows = [
+            {"stockId": 1, "datetime": "2014-01-24T00:00:00", "close": 114.0, "high": 115.35, "low": 113.0, "open": 113.15, "volume": 5737135},
+            {"stockId": 1, "datetime": "2014-01-27T00:00:00", "close": 111.1, "high": 112.7, "low": 109.3, "open": 112.0, "volume": 8724577},
+            {"stockId": 2, "datetime": "2014-01-28T00:00:00", "close": 113.8, "high": 115.0, "low": 109.75, "open": 110.0, "volume": 4513345},
+        ]
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.execute_raw')
+    @mock.patch('main.db.stockdata.create_many')
+    @mock.patch('main.db.stock.find_many')
+    def test_bulk_mixes_naive_and_offset_datetimes(self, mock_find_many, mock_create_many, mock_execute_raw, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_many.return_value = [MockPrismaStock(id=1, instrument="HINDALCO")]
+        mock_create_many.side_effect = lambda data: len(data)
+        rows = [dict(self.rows[1], datetime="2014-01-27T00:00:00Z"), self.rows[0]]
+
+        response = client.post("/add-stock-data/bulk", json=rows)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["inserted"], 2)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.execute_raw')
+    @mock.patch('main.db.stockdata.create_many')
+    @mock.patch('main.db.stock.find_many')
+    def test_bulk_json_array(self, mock_find_many, mock_create_many, mock_execute_raw, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_many.return_value = [MockPrismaStock(id=1, instrument="HINDALCO")]
+        mock_create_many.side_effect = lambda data: len(data)
+
+        response = client.post("/add-stock-data/bulk", json=self.rows)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["inserted"], 2)
+        self.assertEqual(data["batches"], [{"batch": 0, "count": 2}])
+        self.assertEqual(data["rejected"], [{"row": 2, "error": "Stock not found"}])
+        mock_find_many.assert_called_once_with(where={"id": {"in": [1, 2]}})
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.execute_raw')
+    @mock.patch('main.db.stockdata.create_many')
+    @mock.patch('main.db.stock.find_many')
+    def test_bulk_csv(self, mock_find_many, mock_create_many, mock_execute_raw, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_many.return_value = [MockPrismaStock(id=1, instrument="HINDALCO")]
+        mock_create_many.side_effect = lambda data: len(data)
+
+        body = "stockId,datetime,open,high,low,close,volume\n"
+        body += "1,2014-01-24T00:00:00,113.15,115.35,113.0,114.0,5737135\n"
+        body += "1,2014-01-27T00:00:00,112.0,112.7,109.3,,8724577\n"
+        response = client.post("/add-stock-data/bulk", content=body, headers={"Content-Type": "text/csv"})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["inserted"], 1)
+        self.assertEqual(len(data["rejected"]), 1)
+        self.assertEqual(data["rejected"][0]["row"], 1)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.execute_raw')
+    @mock.patch('main.db.stockdata.create_many')
+    @mock.patch('main.db.stock.find_many')
+    def test_bulk_ndjson_with_bad_lines(self, mock_find_many, mock_create_many, mock_execute_raw, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_many.return_value = [MockPrismaStock(id=1, instrument="HINDALCO")]
+        mock_create_many.side_effect = lambda data: len(data)
+
+        lines = [json.dumps(self.rows[0]), "{not json", json.dumps(self.rows[0])]
+        response = client.post("/add-stock-data/bulk", content="\n".join(lines), headers={"Content-Type": "application/x-ndjson"})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["inserted"], 1)
+        self.assertEqual([item["row"] for item in data["rejected"]], [1, 2])
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.execute_raw')
+    @mock.patch('main.db.stockdata.create_many')
+    @mock.patch('main.db.stock.find_many')
+    def test_bulk_chunks_large_batches(self, mock_find_many, mock_create_many, mock_execute_raw, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_many.return_value = [MockPrismaStock(id=1, instrument="HINDALCO")]
+        mock_create_many.side_effect = lambda data: len(data)
+
+        start = datetime.datetime(2020, 1, 1)
+        rows = [
+            dict(self.rows[0], datetime=(start + datetime.timedelta(minutes=i)).isoformat())
+            for i in range(12000)
+        ]
+        response = client.post("/add-stock-data/bulk", json=rows)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["inserted"], 12000)
+        self.assertEqual([batch["count"] for batch in data["batches"]], [5000, 5000, 2000])
+        mock_find_many.assert_called_once()
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.execute_raw')
+    @mock.patch('main.db.stockdata.create_many')
+    @mock.patch('main.db.stock.find_many')
+    def test_bulk_reports_failed_batches(self, mock_find_many, mock_create_many, mock_execute_raw, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_many.return_value = [MockPrismaStock(id=1, instrument="HINDALCO")]
+        mock_create_many.side_effect = [5000, Exception("Unique constraint failed on the fields: (`stockId`,`datetime`)"), 2000]
+
+        start = datetime.datetime(2020, 1, 1)
+        rows = [
+            dict(self.rows[0], datetime=(start + datetime.timedelta(minutes=i)).isoformat())
+            for i in range(12000)
+        ]
+        response = client.post("/add-stock-data/bulk", json=rows)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["inserted"], 7000)
+        self.assertEqual([batch["count"] for batch in data["batches"]], [5000, 0, 2000])
+        self.assertIn("Unique constraint", data["batches"][1]["error"])
+        self.assertEqual([item["row"] for item in data["rejected"]], list(range(5000, 10000)))
+        self.assertEqual(data["rejected"][0]["error"], "Batch 1 failed")
+        # Only the bars that were written reach the rollups.
+        self.assertEqual(sum(mock_execute_raw.call_args_list[0].args[9]), 7000)
+
+    def test_bulk_rejects_non_array_body(self):
+        response = client.post("/add-stock-data/bulk", json=self.rows[0])
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch('main.db.execute_raw')
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stock.find_many')
+    def test_bulk_upsert_reports_counts(self, mock_find_many, mock_query_raw, mock_execute_raw):
+        mock_find_many.return_value = [MockPrismaStock(id=1, instrument="HINDALCO")]
+        mock_query_raw.return_value = [{"inserted": 1, "updated": 0, "stockIds": [1], "times": [1390521600000]}]
+        mock_query_raw.side_effect = stock_versions([])
+        series_cache.put(1, rows_to_columns([MockPrismaStockData(id=1, stockId=1, datetime=datetime.datetime(2014, 1, 27), close=1.0, high=1.0, low=1.0, open=1.0, volume=1)]))
+
+        response = client.post("/add-stock-data/bulk?mode=upsert", json=self.rows[:2])
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data["inserted"], data["updated"], data["skipped"]), (1, 0, 1))
+        self.assertEqual(data["batches"], [{"batch": 0, "count": 1}])
+
+        sql, stock_ids, timestamps = mock_query_raw.call_args_list[0].args[:3]
+        self.assertIn('ON CONFLICT ("stockId", "datetime") DO UPDATE', sql)
+        self.assertIn("IS DISTINCT FROM", sql)
+        self.assertEqual(stock_ids, [1, 1])
+        self.assertEqual(timestamps, [1390521600000, 1390780800000])
+        # The new bar landed before the end of the cached series, so it was dropped.
+        self.assertNotIn(1, series_cache)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stock.find_many')
+    def test_bulk_ignore_replay_keeps_cache(self, mock_find_many, mock_query_raw):
+        mock_find_many.return_value = [MockPrismaStock(id=1, instrument="HINDALCO")]
+        mock_query_raw.return_value = [{"inserted": 0, "updated": 0, "stockIds": None, "times": None}]
+        series_cache.put(1, rows_to_columns([MockPrismaStockData(id=1, stockId=1, datetime=datetime.datetime(2014, 1, 27), close=1.0, high=1.0, low=1.0, open=1.0, volume=1)]))
+
+        data = client.post("/add-stock-data/bulk?mode=ignore", json=self.rows[:2]).json()
+        self.assertEqual((data["inserted"], data["updated"], data["skipped"]), (0, 0, 2))
+        self.assertIn("DO NOTHING", mock_query_raw.call_args.args[0])
+        self.assertIn(1, series_cache)
+
+    def test_bulk_rejects_unknown_mode(self):
+        response = client.post("/add-stock-data/bulk?mode=merge", json=self.rows)
+        self.assertEqual(response.status_code, 422)
+
+    @mock.patch('main.db.execute_raw')
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stock.find_unique')
+    def test_single_row_upsert(self, mock_find_unique, mock_query_raw, mock_execute_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_query_raw.return_value = [{"inserted": 0, "updated": 1, "stockIds": [1], "times": [1390521600000]}]
+        mock_query_raw.side_effect = stock_versions([])
+
+        response = client.post("/add-stock-data?mode=upsert", json=self.rows[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["updated"], 1)
+
 class TestStrategyEndpoint(unittest.TestCase):
     @mock.patch('main.db.stockdata.find_many')
     @mock.patch('main.db.stock.find_unique')
@@ -505,15 +1151,1353 @@ class TestStrategyEndpoint(unittest.TestCase):
         # This won't result in a 422 because FastAPI automatically converts path params to strings
         self.assertEqual(response.status_code, 404)  # Will return "Stock not found"
 
+class TestStrategyTrades(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+        start = datetime.datetime(2024, 1, 1)
+        self.rows = [
+            MockPrismaStockData(id=i, stockId=1, datetime=start + datetime.timedelta(days=i), close=c, high=c, low=c, open=c, volume=1)
+            for i, c in enumerate([3.0, 2.0, 6.0, 5.0, 0.0, 3.0])
+        ]
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_strategy_reports_trades(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows
+
+        data = client.get("/strategy", params={"instrument": "HINDALCO"}).json()
+        self.assertNotIn("Trades", data)
+
+        data = client.get("/strategy", params={"instrument": "HINDALCO", "trades": "true"}).json()
+        self.assertEqual({key: data[key] for key in ("Trades", "TotalProfit")}, best_trades(np.array([row.close for row in self.rows])))
+        self.assertEqual(len(data["Trades"]), 2)
+
+        data = client.get("/strategy", params={"instrument": "HINDALCO", "max_trades": 1}).json()
+        self.assertEqual(data["Trades"], [data["BestBuySell"]])
+        self.assertEqual(data["TotalProfit"], 4.0)
+
+        data = client.get("/strategy", params={"instrument": "HINDALCO", "max_trades": 2, "fee": 0.5}).json()
+        self.assertEqual([(trade["BuyIndex"], trade["SellIndex"]) for trade in data["Trades"]], [(1, 2), (4, 5)])
+        self.assertEqual(data["TotalProfit"], 6.0)
+
+        data = client.get("/strategy", params={"instrument": "HINDALCO", "cooldown": 1}).json()
+        self.assertEqual([(trade["BuyIndex"], trade["SellIndex"]) for trade in data["Trades"]], [(1, 2), (4, 5)])
+        # Two bars of cooldown after selling at 2 rule out buying at 4.
+        data = client.get("/strategy", params={"instrument": "HINDALCO", "cooldown": 2}).json()
+        self.assertEqual([(trade["BuyIndex"], trade["SellIndex"]) for trade in data["Trades"]], [(1, 2)])
+
+        response = client.get("/strategy", params={"instrument": "HINDALCO", "fee": -1})
+        self.assertEqual(response.status_code, 422)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('engine.BEST_TRADES_MAX_CELLS', 4)
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_strategy_rejects_oversized_trade_search(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows
+        response = client.get("/strategy", params={"instrument": "HINDALCO", "max_trades": 2})
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_packed_strategy_carries_trades(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows
+        response = client.get("/strategy", params={"instrument": "HINDALCO", "max_trades": 2}, headers={"Accept": "application/x-ohlcv-packed"})
+        _, metadata = decode_packed(response.content)
+        self.assertEqual(metadata["TotalProfit"], 7.0)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.TRADES_PROCESS_MIN_BARS', 0)
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_looping_solver_runs_in_process(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows
+        with mock.patch('main.executor.run_in_process', wraps=executor.run_in_process) as run_in_process:
+            data = client.get("/strategy", params={"instrument": "HINDALCO", "cooldown": 1}).json()
+            self.assertEqual(run_in_process.call_args.args[0], best_trades)
+            self.assertEqual([(trade["BuyIndex"], trade["SellIndex"]) for trade in data["Trades"]], [(1, 2), (4, 5)])
+
+            client.get("/strategy", params={"instrument": "HINDALCO", "max_trades": 2, "cooldown": 1})
+            run_in_process.assert_called_once()
+
+
+class TestSeriesCache(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+        start = datetime.datetime(2024, 1, 1)
+        self.rows = [
+            MockPrismaStockData(id=i + 1, stockId=1, datetime=start + datetime.timedelta(days=i), close=100.0 + i, high=101.0 + i, low=99.0 + i, open=100.0 + i, volume=1000 + i)
+            for i in range(5)
+        ]
+
+    def make_columns(self, size):
+        return {"close": np.zeros(size), "volume": np.zeros(size, dtype=np.int64)}
+
+    def test_lru_eviction_under_budget(self):
+        cache = SeriesCache(max_bytes=3 * 160)
+        for stock_id in (1, 2, 3):
+            cache.put(stock_id, self.make_columns(10))
+        cache.get(1)
+        cache.put(4, self.make_columns(10))
+        self.assertIn(1, cache)
+        self.assertNotIn(2, cache)
+        self.assertEqual(cache.nbytes, 3 * 160)
+
+    def test_oversized_entry_is_not_cached(self):
+        cache = SeriesCache(max_bytes=100)
+        cache.put(1, self.make_columns(10))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_appends_fill_spare_capacity(self):
+        cache = SeriesCache(max_bytes=1 << 20)
+        bars = rows_to_columns(self.rows)
+        cache.put(1, bars)
+        snapshot = cache.get(1)
+        buffers = []
+        for day in range(100):
+            bar = rows_to_columns([MockPrismaStockData(id=0, stockId=1, datetime=datetime.datetime(2024, 2, 1) + datetime.timedelta(days=day), close=float(day), high=1.0, low=1.0, open=1.0, volume=1)])
+            self.assertTrue(cache.append(1, bar))
+            base = cache.get(1)["close"].base
+            if not any(base is buffer for buffer in buffers):
+                buffers.append(base)
+        columns = cache.get(1)
+        self.assertEqual(len(columns["close"]), 105)
+        np.testing.assert_array_equal(columns["close"][5:], np.arange(100.0))
+        np.testing.assert_array_equal(columns["close"][:5], bars["close"])
+        # Doubling from 5 bars reaches 160 in five reallocations, not one per bar.
+        self.assertEqual(len(buffers), 5)
+        self.assertEqual(cache.nbytes, 160 * sum(array.itemsize for array in columns.values()))
+        self.assertEqual(len(snapshot["close"]), 5)
+        with self.assertRaises(ValueError):
+            columns["close"][0] = 1.0
+
+    def test_cached_arrays_are_read_only(self):
+        cache = SeriesCache(max_bytes=1024)
+        columns = self.make_columns(4)
+        cache.put(1, columns)
+        with self.assertRaises(ValueError):
+            cache.get(1)["close"][0] = 1.0
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_hot_instrument_skips_database(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows
+        mock_query_raw.return_value = [{"stockId": 1, "count": len(self.rows), "latest": epoch_ms(self.rows[-1].datetime), "version": 1}]
+
+        first = client.get("/strategy?instrument=HINDALCO").json()
+        second = client.get("/strategy?instrument=HINDALCO").json()
+        self.assertEqual(first, second)
+        mock_find_many.assert_called_once()
+
+        response = client.get("/get-stock-data", params={"instrument": "HINDALCO", "from": "2024-01-02T00:00:00", "limit": 2})
+        data = response.json()
+        self.assertEqual([row["close"] for row in data["data"]], [101.0, 102.0])
+        self.assertEqual(data["data"][0]["datetime"], "2024-01-02T00:00:00Z")
+        self.assertEqual(data["nextCursor"], "2024-01-03T00:00:00.000Z")
+        mock_find_many.assert_called_once()
+
+        response = client.get("/get-stock-data", params={"instrument": "HINDALCO", "cursor": data["nextCursor"], "limit": 2})
+        self.assertEqual([row["close"] for row in response.json()["data"]], [103.0, 104.0])
+        self.assertIsNone(response.json()["nextCursor"])
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_external_write_drops_cached_state(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows
+        latest = epoch_ms(self.rows[-1].datetime)
+        mock_query_raw.return_value = [{"stockId": 1, "count": 5, "latest": latest, "version": 5}]
+        client.get("/strategy?instrument=HINDALCO")
+        self.assertIn(1, series_cache)
+
+        # The bulk loader rewrote a bar in place: same count and latest bar, new version.
+        self.rows[0].close = 200.0
+        mock_query_raw.return_value = [{"stockId": 1, "count": 5, "latest": latest, "version": 6}]
+        data = client.get("/get-stock-data?instrument=HINDALCO").json()
+        self.assertEqual(data["data"][0]["close"], 200.0)
+        self.assertEqual(mock_find_many.call_count, 2)
+        self.assertEqual(len(strategy_states), 0)
+
+    @mock.patch('main.db.execute_raw')
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_rewrite_drops_states_of_evicted_series(self, mock_find_unique, mock_find_many, mock_query_raw, mock_execute_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        rows = [
+            MockPrismaStockData(id=i + 1, stockId=1, datetime=datetime.datetime(2024, 1, 1 + i), close=c, high=c, low=c, open=c, volume=1)
+            for i, c in enumerate([10.0, 5.0, 20.0, 8.0])
+        ]
+        mock_find_many.return_value = rows
+        mock_query_raw.side_effect = stock_versions(rows)
+        mock_query_raw.return_value = [{"inserted": 0, "updated": 1, "stockIds": [1], "times": [1704240000000]}]
+        best = client.get("/strategy?instrument=HINDALCO").json()["BestBuySell"]
+        self.assertEqual(best, {"BuyIndex": 1, "SellIndex": 2, "Profit": 15.0})
+
+        # The series left the cache under the memory budget; its strategy state stayed.
+        series_cache.invalidate(1)
+        rows[2].close = 6.0
+        bar = {"stockId": 1, "datetime": "2024-01-03T00:00:00", "close": 6.0, "high": 6.0, "low": 6.0, "open": 6.0, "volume": 1}
+        self.assertEqual(client.post("/add-stock-data?mode=upsert", json=bar).status_code, 200)
+        best = client.get("/strategy?instrument=HINDALCO").json()["BestBuySell"]
+        self.assertEqual(best, {"BuyIndex": 1, "SellIndex": 3, "Profit": 3.0})
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.execute_raw')
+    @mock.patch('main.db.stockdata.create')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_writes_append_or_invalidate(self, mock_find_unique, mock_find_many, mock_create, mock_execute_raw, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows
+        mock_query_raw.side_effect = stock_versions(self.rows)
+        mock_create.side_effect = lambda data: self.rows.append(MockPrismaStockData(id=len(self.rows) + 1, **data)) or self.rows[-1]
+        bar = {"stockId": 1, "close": 1.0, "high": 1.0, "low": 1.0, "open": 1.0, "volume": 1}
+
+        client.get("/strategy?instrument=HINDALCO")
+        self.assertIn(1, series_cache)
+
+        client.post("/add-stock-data", json=dict(bar, datetime="2024-02-01T00:00:00"))
+        self.assertEqual(len(series_cache.get(1)["close"]), 6)
+        self.assertEqual(series_cache.get(1)["close"][-1], 1.0)
+
+        client.post("/add-stock-data", json=dict(bar, datetime="2023-12-01T00:00:00"))
+        self.assertNotIn(1, series_cache)
+        self.assertEqual(len(strategy_states), 0)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.execute_raw')
+    @mock.patch('main.db.stockdata.create_many')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_failed_write_drops_cached_state(self, mock_find_unique, mock_find_stocks, mock_find_many, mock_create_many, mock_execute_raw, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_stocks.return_value = [MockPrismaStock(id=1, instrument="HINDALCO")]
+        mock_find_many.return_value = self.rows
+        mock_create_many.side_effect = lambda data: len(data)
+        mock_execute_raw.side_effect = Exception("connection reset")
+        bar = {"stockId": 1, "datetime": "2024-02-01T00:00:00", "close": 1.0, "high": 1.0, "low": 1.0, "open": 1.0, "volume": 1}
+
+        client.get("/strategy?instrument=HINDALCO")
+        self.assertIn(1, series_cache)
+        # The bars are committed before the rollup update fails.
+        with self.assertRaises(Exception):
+            client.post("/add-stock-data/bulk", json=[bar])
+        self.assertNotIn(1, series_cache)
+        self.assertEqual(len(strategy_states), 0)
+
+class TestIncrementalStrategy(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+
+    def make_columns(self, close_prices):
+        close_prices = np.asarray(close_prices, dtype=np.float64)
+        return {
+            "datetime": np.arange(len(close_prices), dtype=np.int64).view("datetime64[ms]"),
+            "close": close_prices,
+        }
+
+    def test_appends_match_full_recompute(self):
+        rng = np.random.default_rng(5)
+        close_prices = np.round(100 + rng.normal(size=400).cumsum(), 1)
+        for window_size in (1, 3, 20):
+            state = StrategyState(window_size)
+            for end in (1, 2, 3, 10, 11, 150, 151, 152, 400):
+                columns = self.make_columns(close_prices[:end])
+                self.assertTrue(state.matches(columns))
+                state.update(columns)
+                np.testing.assert_allclose(state.moving_average(), moving_average(close_prices[:end], window_size))
+                self.assertEqual(state.best_buy_sell(), reference_best_buy_sell(close_prices[:end]))
+
+    def test_modified_prefix_is_detected(self):
+        state = StrategyState(3).update(self.make_columns([1.0, 2.0, 3.0]))
+        shifted = self.make_columns([1.0, 2.0, 3.0])
+        shifted["datetime"] = shifted["datetime"] + np.timedelta64(1, "ms")
+        self.assertFalse(state.matches(shifted))
+        self.assertFalse(state.matches(self.make_columns([1.0, 2.0])))
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.execute_raw')
+    @mock.patch('main.db.stockdata.create')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_endpoint_folds_appended_bars(self, mock_find_unique, mock_find_many, mock_create, mock_execute_raw, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        start = datetime.datetime(2024, 1, 1)
+        mock_find_many.return_value = [
+            MockPrismaStockData(id=i, stockId=1, datetime=start + datetime.timedelta(days=i), close=c, high=c, low=c, open=c, volume=1)
+            for i, c in enumerate([100.0, 90.0, 95.0, 110.0])
+        ]
+        rows = mock_find_many.return_value
+        mock_query_raw.side_effect = stock_versions(rows)
+        mock_create.side_effect = lambda data: rows.append(MockPrismaStockData(id=len(rows), **data)) or rows[-1]
+
+        client.get("/strategy?instrument=HINDALCO")
+        state = strategy_states[(1, 3)]
+        client.post("/add-stock-data", json={"stockId": 1, "datetime": "2024-01-05T00:00:00", "close": 120.0, "high": 120.0, "low": 120.0, "open": 120.0, "volume": 1})
+        data = client.get("/strategy?instrument=HINDALCO").json()
+
+        self.assertIs(strategy_states[(1, 3)], state)
+        self.assertEqual(state.count, 5)
+        self.assertEqual(data["BestBuySell"], {"BuyIndex": 1, "SellIndex": 4, "Profit": 30.0})
+        self.assertEqual(len(data["MovingAverage"]), 3)
+        mock_find_many.assert_called_once()
+
+class TestStrategyBatch(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+        self.stocks = [MockPrismaStock(id=1, instrument="HINDALCO"), MockPrismaStock(id=2, instrument="TATASTEEL"), MockPrismaStock(id=3, instrument="EMPTY")]
+        start = datetime.datetime(2024, 1, 1)
+        self.rows = [
+            MockPrismaStockData(id=i, stockId=stock_id, datetime=start + datetime.timedelta(days=i), close=c, high=c, low=c, open=c, volume=1)
+            for stock_id, closes in ((1, [100.0, 90.0, 95.0, 110.0]), (2, [50.0, 60.0, 40.0, 45.0]))
+            for i, c in enumerate(closes)
+        ]
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_many')
+    def test_batch_fetches_once(self, mock_stock_find_many, mock_find_many, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_stock_find_many.return_value = self.stocks[:2]
+        mock_find_many.return_value = self.rows
+
+        response = client.post("/strategy/batch", json={"instruments": ["HINDALCO", "TATASTEEL", "UNKNOWN"], "include_moving_average": True})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["results"]["HINDALCO"]["BestBuySell"], {"BuyIndex": 1, "SellIndex": 3, "Profit": 20.0})
+        self.assertEqual(data["results"]["TATASTEEL"]["BestBuySell"], {"BuyIndex": 0, "SellIndex": 1, "Profit": 10.0})
+        self.assertEqual(len(data["results"]["HINDALCO"]["MovingAverage"]), 2)
+        self.assertEqual(data["missing"], ["UNKNOWN"])
+        mock_find_many.assert_called_once_with(
+            where={"stockId": {"in": [1, 2]}},
+            order=[{"stockId": "asc"}, {"datetime": "asc"}],
+        )
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_many')
+    def test_batch_all_reports_stocks_without_data(self, mock_stock_find_many, mock_find_many, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_stock_find_many.return_value = self.stocks
+        mock_find_many.return_value = self.rows
+
+        data = client.post("/strategy/batch", json={"instruments": "all"}).json()
+        self.assertEqual(set(data["results"]), {"HINDALCO", "TATASTEEL"})
+        self.assertNotIn("MovingAverage", data["results"]["HINDALCO"])
+        self.assertEqual(data["missing"], ["EMPTY"])
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('executor.ANALYTICS_PROCESSES', 2)
+    @mock.patch('main.BATCH_PROCESS_MIN_BARS', 0)
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_many')
+    def test_batch_uses_process_pool(self, mock_stock_find_many, mock_find_many, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_stock_find_many.return_value = self.stocks[:2]
+        mock_find_many.return_value = self.rows
+        try:
+            data = client.post("/strategy/batch", json={"instruments": "all"}).json()
+        finally:
+            executor.shutdown()
+        self.assertEqual(data["results"]["HINDALCO"]["BestBuySell"]["Profit"], 20.0)
+        self.assertEqual(data["results"]["TATASTEEL"]["BestBuySell"]["Profit"], 10.0)
+
+    def test_balanced_chunks(self):
+        chunks = executor.balanced_chunks(["a", "b", "c", "d"], [100, 10, 60, 50], 2)
+        self.assertEqual(sorted(map(sorted, chunks)), [["a", "b"], ["c", "d"]])
+
+    def test_batch_rejects_bad_request(self):
+        response = client.post("/strategy/batch", json={"instruments": "some"})
+        self.assertEqual(response.status_code, 422)
+
+class TestAnalyticsExecutor(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+
+    def test_pending_jobs_are_bounded(self):
+        pool = executor.AnalyticsPool("test", lambda: ThreadPoolExecutor(max_workers=1), max_pending=1)
+        release = threading.Event()
+
+        async def scenario():
+            first = asyncio.ensure_future(pool.run(release.wait, 5))
+            await asyncio.sleep(0)
+            with self.assertRaises(executor.ExecutorSaturated):
+                await pool.run(sum, [1, 2])
+            release.set()
+            self.assertTrue(await first)
+            self.assertEqual(await pool.run(sum, [1, 2]), 3)
+            self.assertEqual(pool.pending, 0)
+
+        try:
+            asyncio.run(scenario())
+        finally:
+            pool.shutdown()
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch.object(executor.threads, 'max_pending', 0)
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_saturated_pool_returns_503(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = [
+            MockPrismaStockData(id=1, stockId=1, datetime=datetime.datetime(2024, 1, 1), close=1.0, high=1.0, low=1.0, open=1.0, volume=1)
+        ]
+
+        response = client.get("/strategy?instrument=HINDALCO")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(client.get("/").status_code, 200)
+
+class TestMemmapStorage(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.store = storage.MemmapStorage(self.tmp.name)
+
+    def bar(self, minute, close, stock_id=1):
+        return {"stockId": stock_id, "datetime": datetime.datetime(2024, 1, 1, 9, minute), "close": close,
+                "high": close + 1, "low": close - 1, "open": close, "volume": 100}
+
+    def test_appends_and_reopens(self):
+        stock = asyncio.run(self.store.create_stock("HINDALCO"))
+        asyncio.run(self.store.insert_many([self.bar(0, 10.0), self.bar(1, 11.0)]))
+        asyncio.run(self.store.insert(self.bar(2, 12.0)))
+
+        reopened = storage.MemmapStorage(self.tmp.name)
+        self.assertEqual(asyncio.run(reopened.get_stock("HINDALCO")), stock)
+        columns = reopened.columns(stock.id)
+        self.assertIsInstance(columns["close"], np.memmap)
+        self.assertEqual(columns["close"].tolist(), [10.0, 11.0, 12.0])
+        self.assertEqual(columns["datetime"].dtype, np.dtype("datetime64[ms]"))
+        self.assertEqual(asyncio.run(reopened.fingerprint(stock.id)), (3, int(columns["datetime"].view(np.int64)[-1]), 2))
+
+    def test_out_of_order_bars_are_merged(self):
+        stock = asyncio.run(self.store.create_stock("HINDALCO"))
+        asyncio.run(self.store.insert_many([self.bar(0, 10.0), self.bar(2, 12.0)]))
+        before = self.store.columns(stock.id)
+        asyncio.run(self.store.upsert_many([self.bar(1, 11.0), self.bar(2, 20.0)]))
+
+        self.assertEqual(self.store.columns(stock.id)["close"].tolist(), [10.0, 11.0, 20.0])
+        self.assertEqual(before["close"].tolist(), [10.0, 12.0])
+
+    def test_insert_rejects_existing_bars(self):
+        stock = asyncio.run(self.store.create_stock("HINDALCO"))
+        asyncio.run(self.store.insert_many([self.bar(0, 10.0), self.bar(2, 12.0)]))
+
+        with self.assertRaises(storage.BarExists):
+            asyncio.run(self.store.insert(self.bar(2, 20.0)))
+        with self.assertRaises(storage.BarExists):
+            asyncio.run(self.store.insert_many([self.bar(1, 11.0), self.bar(2, 20.0)]))
+        with self.assertRaises(storage.BarExists):
+            asyncio.run(self.store.insert_many([self.bar(3, 13.0), self.bar(3, 14.0)]))
+        self.assertEqual(self.store.columns(stock.id)["close"].tolist(), [10.0, 12.0])
+
+    def test_upsert_counts(self):
+        stock = asyncio.run(self.store.create_stock("HINDALCO"))
+        asyncio.run(self.store.insert_many([self.bar(0, 10.0), self.bar(1, 11.0)]))
+
+        counts = asyncio.run(self.store.upsert_many([self.bar(0, 10.0), self.bar(1, 15.0), self.bar(2, 12.0)]))
+        self.assertEqual(counts, {"inserted": 1, "updated": 1, "skipped": 1, "written": [1, 2]})
+        self.assertEqual(self.store.columns(stock.id)["close"].tolist(), [10.0, 15.0, 12.0])
+
+        counts = asyncio.run(self.store.upsert_many([self.bar(1, 99.0), self.bar(3, 13.0)], ignore=True))
+        self.assertEqual(counts, {"inserted": 1, "updated": 0, "skipped": 1, "written": [1]})
+        self.assertEqual(self.store.columns(stock.id)["close"].tolist(), [10.0, 15.0, 12.0, 13.0])
+
+    def test_in_place_upsert_moves_fingerprint(self):
+        stock = asyncio.run(self.store.create_stock("HINDALCO"))
+        asyncio.run(self.store.insert_many([self.bar(0, 10.0), self.bar(1, 11.0)]))
+        before = asyncio.run(self.store.fingerprint(stock.id))
+
+        asyncio.run(self.store.upsert_many([self.bar(0, 9.0)]))
+        after = asyncio.run(self.store.fingerprint(stock.id))
+        self.assertEqual(after[:2], before[:2])
+        self.assertNotEqual(after, before)
+
+        asyncio.run(self.store.upsert_many([self.bar(0, 9.0)]))
+        self.assertEqual(asyncio.run(self.store.fingerprint(stock.id)), after)
+
+    def test_writes_from_another_process_are_mapped(self):
+        stock = asyncio.run(self.store.create_stock("HINDALCO"))
+        asyncio.run(self.store.insert_many([self.bar(0, 10.0), self.bar(1, 11.0)]))
+        self.assertEqual(self.store.columns(stock.id)["close"].tolist(), [10.0, 11.0])
+
+        loader_store = storage.MemmapStorage(self.tmp.name)
+        asyncio.run(loader_store.upsert_many([self.bar(0, 9.0), self.bar(2, 12.0)]))
+        self.assertEqual(self.store.columns(stock.id)["close"].tolist(), [9.0, 11.0, 12.0])
+
+    def test_unknown_stock_is_empty(self):
+        self.assertEqual(len(self.store.columns(99)["close"]), 0)
+        self.assertEqual(asyncio.run(self.store.fingerprint(99)), (0, None, 0))
+        self.assertEqual(asyncio.run(self.store.load_series_many([99])), {})
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            storage.create_storage(db, backend="redis")
+
+    def test_endpoints_on_memmap_storage(self):
+        with mock.patch('main.store', self.store), mock.patch.object(registry, 'store', self.store):
+            stock = client.post("/create-stock", json={"instrument": "HINDALCO"}).json()
+            for minute, close in enumerate([10.0, 8.0, 12.0, 11.0]):
+                bar = dict(self.bar(minute, close, stock["id"]), datetime=f"2024-01-01T09:0{minute}:00")
+                self.assertEqual(client.post("/add-stock-data", json=bar).status_code, 200)
+
+            page = client.get("/get-stock-data", params={"instrument": "HINDALCO", "limit": 2}).json()
+            self.assertEqual([row["close"] for row in page["data"]], [10.0, 8.0])
+            self.assertIsNotNone(page["nextCursor"])
+            strategy = client.get("/strategy", params={"instrument": "HINDALCO", "window": 2}).json()
+            self.assertEqual(strategy["BestBuySell"], {"BuyIndex": 1, "SellIndex": 2, "Profit": 4.0})
+
+            rewrite = dict(self.bar(1, 5.0, stock["id"]), datetime="2024-01-01T09:01:00")
+            self.assertEqual(client.post("/add-stock-data", json=rewrite).status_code, 400)
+            client.post("/add-stock-data?mode=upsert", json=rewrite)
+            strategy = client.get("/strategy", params={"instrument": "HINDALCO", "window": 2}).json()
+            self.assertEqual(strategy["BestBuySell"]["Profit"], 7.0)
+        self.assertEqual(len(series_cache), 0)
+
+class TestPriceStream(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.store = storage.MemmapStorage(self.tmp.name)
+
+    def bar(self, stock_id, minute, close):
+        return {"stockId": stock_id, "datetime": f"2024-01-01T09:0{minute}:00", "close": close,
+                "high": close, "low": close, "open": close, "volume": 100}
+
+    def test_subscribers_receive_ingested_bars(self):
+        with mock.patch('main.store', self.store), mock.patch.object(registry, 'store', self.store), TestClient(app) as live:
+            stock = live.post("/create-stock", json={"instrument": "HINDALCO"}).json()
+            for minute, close in enumerate([10.0, 8.0]):
+                live.post("/add-stock-data", json=self.bar(stock["id"], minute, close))
+
+            with live.websocket_connect("/ws/stocks") as first, live.websocket_connect("/ws/stocks") as second:
+                first.send_json({"action": "subscribe", "instruments": ["HINDALCO", "NOPE"], "window": 2})
+                self.assertEqual(first.receive_json(), {"type": "subscribed", "instruments": ["HINDALCO"], "missing": ["NOPE"], "window": 2})
+                second.send_json({"action": "subscribe", "instruments": ["HINDALCO"]})
+                self.assertEqual(second.receive_json()["window"], 3)
+
+                with mock.patch('main.executor.run_in_thread', wraps=executor.run_in_thread) as run_in_thread:
+                    live.post("/add-stock-data", json=self.bar(stock["id"], 2, 12.0))
+                self.assertEqual(run_in_thread.call_args.args[0], main.stream_messages)
+                message = first.receive_json()
+                self.assertEqual(message["type"], "bars")
+                self.assertEqual(message["data"][0]["close"], 12.0)
+                self.assertEqual(message["MovingAverage"], [10.0])
+                self.assertEqual(message["BestBuySell"], {"BuyIndex": 1, "SellIndex": 2, "Profit": 4.0})
+                self.assertEqual(second.receive_json()["MovingAverage"], [10.0])
+
+                first.send_json({"action": "unsubscribe", "instruments": ["HINDALCO"]})
+                self.assertEqual(first.receive_json()["type"], "unsubscribed")
+                first.send_text("not json")
+                self.assertEqual(first.receive_json()["type"], "error")
+
+    def test_failed_publish_keeps_the_write(self):
+        with mock.patch('main.store', self.store), mock.patch.object(registry, 'store', self.store), TestClient(app) as live:
+            stock = live.post("/create-stock", json={"instrument": "HINDALCO"}).json()
+            with live.websocket_connect("/ws/stocks") as subscriber:
+                subscriber.send_json({"action": "subscribe", "instruments": ["HINDALCO"]})
+                subscriber.receive_json()
+                with mock.patch.object(executor.threads, 'max_pending', 0), self.assertLogs('main', level='ERROR'):
+                    response = live.post("/add-stock-data", json=self.bar(stock["id"], 0, 10.0))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.store.columns(stock["id"])["close"].tolist(), [10.0])
+
+    def test_skipped_bars_are_not_published(self):
+        with mock.patch('main.store', self.store), mock.patch.object(registry, 'store', self.store):
+            stock = client.post("/create-stock", json={"instrument": "HINDALCO"}).json()
+            client.post("/add-stock-data", json=self.bar(stock["id"], 0, 10.0))
+            body = [self.bar(stock["id"], 0, 999.0), self.bar(stock["id"], 1, 11.0)]
+            with mock.patch('main.publish_bars', wraps=main.publish_bars) as publish:
+                data = client.post("/add-stock-data/bulk?mode=ignore", json=body).json()
+
+        self.assertEqual(data["skipped"], 1)
+        self.assertEqual(publish.call_args.args[1]["close"].tolist(), [11.0])
+        self.assertEqual(self.store.columns(stock["id"])["close"].tolist(), [10.0, 11.0])
+
+    def test_slow_subscriber_drops_oldest(self):
+        hub = broadcast.BroadcastHub(queue_size=2)
+        subscriber = hub.connect()
+        hub.subscribe(subscriber, "HINDALCO", 3)
+        for value in range(3):
+            hub.publish("HINDALCO", 3, {"value": value})
+        hub.publish("HINDALCO", 5, {"value": "other window"})
+
+        self.assertEqual(subscriber.dropped, 1)
+        self.assertEqual([json.loads(subscriber.queue.get_nowait())["value"] for _ in range(2)], [1, 2])
+        hub.disconnect(subscriber)
+        self.assertEqual(hub.windows("HINDALCO"), set())
+
+class TestInstrumentRegistry(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stock.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_lookups_skip_the_database(self, mock_find_unique, mock_find_many, mock_query_raw, mock_data_find_many):
+        mock_find_many.return_value = [MockPrismaStock(id=1, instrument="HINDALCO")]
+        mock_query_raw.return_value = [{"stockId": 1, "count": 0, "latest": None, "version": 0}]
+        mock_data_find_many.return_value = []
+        asyncio.run(registry.load())
+
+        for _ in range(3):
+            self.assertEqual(client.get("/get-stock-data", params={"instrument": "HINDALCO"}).status_code, 200)
+            self.assertEqual(len(client.get("/get-all-stocks").json()), 1)
+        mock_find_unique.assert_not_called()
+        mock_find_many.assert_called_once()
+
+    @mock.patch('main.db.stock.find_unique')
+    def test_misses_fall_through_and_are_remembered(self, mock_find_unique):
+        mock_find_unique.return_value = None
+        for _ in range(3):
+            self.assertEqual(client.get("/strategy", params={"instrument": "NOPE"}).status_code, 404)
+        mock_find_unique.assert_called_once_with(where={"instrument": "NOPE"})
+
+        mock_find_unique.return_value = MockPrismaStock(id=7, instrument="LATE")
+        self.assertEqual(asyncio.run(registry.get_by_id(7)).instrument, "LATE")
+        self.assertEqual(asyncio.run(registry.get("LATE")).id, 7)
+
+    @mock.patch('main.db.stock.create')
+    @mock.patch('main.db.stock.find_unique')
+    def test_created_stock_is_registered(self, mock_find_unique, mock_create):
+        mock_find_unique.return_value = None
+        self.assertIsNone(asyncio.run(registry.get("NEWSTOCK")))
+        mock_create.return_value = MockPrismaStock(id=5, instrument="NEWSTOCK")
+        client.post("/create-stock", json={"instrument": "NEWSTOCK"})
+
+        self.assertEqual(asyncio.run(registry.get("NEWSTOCK")).id, 5)
+        self.assertEqual(client.post("/create-stock", json={"instrument": "NEWSTOCK"}).status_code, 400)
+
+    @mock.patch('main.db.stock.find_many')
+    def test_find_fetches_unknown_in_one_query(self, mock_find_many):
+        registry.add(MockPrismaStock(id=1, instrument="HINDALCO"))
+        mock_find_many.return_value = [MockPrismaStock(id=2, instrument="TATASTEEL")]
+
+        stocks = asyncio.run(registry.find(instruments=["HINDALCO", "TATASTEEL", "NOPE"]))
+        self.assertEqual([stock.id for stock in stocks], [1, 2])
+        mock_find_many.assert_called_once_with(where={"instrument": {"in": ["TATASTEEL", "NOPE"]}})
+        asyncio.run(registry.find(instruments=["TATASTEEL", "NOPE"]))
+        mock_find_many.assert_called_once()
+
+class TestBenchmarkHarness(unittest.TestCase):
+    def test_synthetic_series_is_deterministic_ohlc(self):
+        first = benchmark.synthetic_series(500, seed=3, interval="5m")
+        second = benchmark.synthetic_series(500, seed=3, interval="5m")
+        for name in first:
+            np.testing.assert_array_equal(first[name], second[name])
+        self.assertFalse(np.array_equal(first["close"], benchmark.synthetic_series(500, seed=4)["close"]))
+
+        self.assertTrue(np.all(first["high"] >= np.maximum(first["open"], first["close"])))
+        self.assertTrue(np.all(first["low"] <= np.minimum(first["open"], first["close"])))
+        self.assertTrue(np.all(np.diff(first["datetime"].view(np.int64)) == 300_000))
+        self.assertEqual(first["datetime"].dtype, np.dtype("datetime64[ms]"))
+
+    def test_universe_names_and_sizes(self):
+        universe = benchmark.synthetic_universe(3, 10)
+        self.assertEqual(list(universe), ["BENCH0000", "BENCH0001", "BENCH0002"])
+        self.assertTrue(all(len(series["close"]) == 10 for series in universe.values()))
+
+    def test_measure_and_compare(self):
+        result = benchmark.measure(lambda: np.ones(1000).sum(), repeat=3, items=1000)
+        self.assertEqual(result["repeat"], 3)
+        self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+        self.assertGreater(result["peak_mb"], 0)
+
+        baseline = {"a": {"p50_ms": 10.0}, "b": {"p50_ms": 10.0}}
+        rows = benchmark.compare({"a": {"p50_ms": 10.5}, "b": {"p50_ms": 12.0}, "c": {"p50_ms": 1.0}}, baseline)
+        self.assertEqual([(name, regressed) for name, _, _, _, regressed in rows], [("a", False), ("b", True)])
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+        main.metrics.reset()
+
+    def sample(self, text, name, **labels):
+        prefix = name + "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) if labels else name + " "
+        for line in text.splitlines():
+            if line.startswith(prefix):
+                return float(line.rsplit(" ", 1)[1])
+        return None
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_requests_are_timed_by_route_and_phase(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_query_raw.return_value = [{"stockId": 1, "count": 3, "latest": 0, "version": 1}]
+        mock_find_many.return_value = [
+            MockPrismaStockData(id=i, stockId=1, datetime=datetime.datetime(2024, 1, 1, 9, i), close=10.0 + i, high=11.0, low=9.0, open=10.0, volume=1)
+            for i in range(3)
+        ]
+        client.get("/get-stock-data", params={"instrument": "HINDALCO"})
+        client.get("/strategy", params={"instrument": "HINDALCO"})
+        client.get("/strategy", params={"instrument": "MISSING", "window": 0})
+
+        text = client.get("/metrics").text
+        self.assertEqual(self.sample(text, "http_request_duration_seconds_count", method="GET", route="/get-stock-data", status="200"), 1)
+        self.assertEqual(self.sample(text, "http_request_duration_seconds_count", method="GET", route="/strategy", status="422"), 1)
+        for phase in ("db", "arrays", "compute", "serialize"):
+            self.assertEqual(self.sample(text, "http_request_phase_seconds_count", route="/strategy", phase=phase), 1, phase)
+        self.assertEqual(self.sample(text, "http_response_rows_sum", route="/get-stock-data"), 3)
+        self.assertGreater(self.sample(text, "http_response_bytes_sum", route="/strategy"), 0)
+        self.assertIsNotNone(self.sample(text, "series_cache_entries"))
+
+    def test_unknown_paths_share_one_label(self):
+        client.get("/no-such-path-1")
+        client.get("/no-such-path-2")
+        text = client.get("/metrics").text
+        self.assertEqual(self.sample(text, "http_request_duration_seconds_count", method="GET", route="unmatched", status="404"), 2)
+
+    def test_nested_phases_record_self_time(self):
+        stats = metrics.RequestStats()
+        token = metrics.current.set(stats)
+        try:
+            with metrics.phase("db"):
+                with metrics.phase("arrays"):
+                    threading.Event().wait(0.02)
+        finally:
+            metrics.current.reset(token)
+        self.assertGreaterEqual(stats.phases["arrays"], 0.02)
+        self.assertLess(stats.phases["db"], 0.02)
+
+    def test_histogram_buckets_are_cumulative(self):
+        family = metrics.HistogramFamily("demo_seconds", "Demo.", ("route",), (0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            family.observe(("/x",), value)
+        lines = family.render()
+        self.assertIn('demo_seconds_bucket{route="/x",le="0.1"} 1', lines)
+        self.assertIn('demo_seconds_bucket{route="/x",le="1.0"} 2', lines)
+        self.assertIn('demo_seconds_bucket{route="/x",le="+Inf"} 3', lines)
+        self.assertIn('demo_seconds_count{route="/x"} 3', lines)
+
+    def test_profiling_is_opt_in(self):
+        response = client.get("/", headers={"X-Profile": "1"})
+        self.assertNotIn("x-profile-id", response.headers)
+
+        with mock.patch('main.profiles', metrics.Profiles()) as profiles:
+            middleware = metrics.MetricsMiddleware(app.router, main.metrics, profiles)
+            profiled = TestClient(middleware).get("/", headers={"X-Profile": "1"})
+            profile_id = profiled.headers["x-profile-id"]
+            report = client.get(f"/metrics/profiles/{profile_id}")
+        self.assertEqual(report.status_code, 200)
+        self.assertIn("GET / 200", report.text)
+        self.assertEqual(client.get("/metrics/profiles/1").status_code, 404)
+
+class TestRollups(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+
+    def test_choose_tier(self):
+        self.assertEqual(rollups.choose_tier("1h"), "1h")
+        self.assertEqual(rollups.choose_tier("4h"), "1h")
+        self.assertEqual(rollups.choose_tier("1d"), "1d")
+        self.assertEqual(rollups.choose_tier("3d"), "1d")
+        self.assertEqual(rollups.choose_tier("2w"), "1w")
+        self.assertIsNone(rollups.choose_tier("15m"))
+        with self.assertRaises(ValueError):
+            rollups.choose_tier("fortnight")
+
+    def test_plan_range_reads_edges_raw(self):
+        ms = lambda text: int(np.datetime64(text, "ms").astype(np.int64))
+        start = datetime.datetime(2024, 1, 1, 9, 15, tzinfo=datetime.timezone.utc)
+        end = datetime.datetime(2024, 1, 3, 10, 30, tzinfo=datetime.timezone.utc)
+        self.assertEqual(rollups.plan_range("1d", start, end), [
+            ("raw", ms("2024-01-01T09:15"), ms("2024-01-02") - 1),
+            ("rollup", ms("2024-01-02"), ms("2024-01-03") - 1),
+            ("raw", ms("2024-01-03"), ms("2024-01-03T10:30")),
+        ])
+        self.assertEqual(rollups.plan_range("1d", None, None), [("rollup", None, None)])
+        inside = datetime.datetime(2024, 1, 1, 12, tzinfo=datetime.timezone.utc)
+        self.assertEqual(rollups.plan_range("1d", start, inside), [("raw", ms("2024-01-01T09:15"), ms("2024-01-01T12:00"))])
+
+    def test_rollup_matches_resample(self):
+        columns = benchmark.synthetic_series(3000, seed=3)
+        buckets = rollups.rollup(columns, "1h")
+        expected = resample(columns, "1h")
+        for name in ("datetime", "open", "high", "low", "close", "volume"):
+            np.testing.assert_array_equal(buckets[name], expected[name])
+        self.assertEqual(buckets["count"].sum(), 3000)
+        self.assertEqual(buckets["first"][1], buckets["datetime"][1].astype(np.int64))
+        self.assertIsNone(rollups.rollup({name: array[:0] for name, array in columns.items()}, "1h"))
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockrollup.find_many')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_endpoint_combines_rollups_and_raw_tail(self, mock_find_unique, mock_find_many, mock_rollups, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_rollups.return_value = [
+            types.SimpleNamespace(bucket=datetime.datetime(2024, 1, day), open=10.0 * day, high=10.0 * day + 5, low=10.0 * day - 5, close=10.0 * day + 1, volume=100)
+            for day in (1, 2)
+        ]
+        mock_find_many.return_value = [
+            MockPrismaStockData(id=i, stockId=1, datetime=datetime.datetime(2024, 1, 3, i), close=30.0 + i, high=40.0, low=20.0, open=30.0, volume=5)
+            for i in range(3)
+        ]
+
+        response = client.get("/get-stock-data", params={"instrument": "HINDALCO", "interval": "1d", "from": "2024-01-01T00:00:00Z", "to": "2024-01-03T06:00:00Z"})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()["data"]
+        self.assertEqual([bar["datetime"] for bar in data], ["2024-01-01T00:00:00Z", "2024-01-02T00:00:00Z", "2024-01-03T00:00:00Z"])
+        self.assertEqual(data[1], {"datetime": "2024-01-02T00:00:00Z", "open": 20.0, "high": 25.0, "low": 15.0, "close": 21.0, "volume": 100})
+        self.assertEqual(data[2]["close"], 32.0)
+        self.assertEqual(data[2]["volume"], 15)
+
+        where = mock_rollups.call_args.kwargs["where"]
+        self.assertEqual(where["interval"], "1d")
+        self.assertEqual(where["bucket"]["lte"], datetime.datetime(2024, 1, 2, 23, 59, 59, 999000, tzinfo=datetime.timezone.utc))
+        raw_where = mock_find_many.call_args.kwargs["where"]
+        self.assertEqual(raw_where["datetime"]["gte"], datetime.datetime(2024, 1, 3, tzinfo=datetime.timezone.utc))
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.execute_raw')
+    @mock.patch('main.db.stockdata.create_many')
+    @mock.patch('main.db.stock.find_many')
+    def test_bulk_insert_merges_rollups(self, mock_find_many, mock_create_many, mock_execute_raw, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_many.return_value = [MockPrismaStock(id=1, instrument="HINDALCO")]
+        mock_create_many.return_value = 2
+        rows = [
+            {"stockId": 1, "datetime": f"2024-01-01T09:{minute:02d}:00Z", "open": 1.0, "high": 2.0, "low": 0.5, "close": 1.5, "volume": 10}
+            for minute in (15, 45)
+        ]
+
+        self.assertEqual(client.post("/add-stock-data/bulk", json=rows).status_code, 200)
+        self.assertEqual([call.args[1] for call in mock_execute_raw.call_args_list], ["1h", "1d", "1w"])
+        sql, tier, stock_ids, buckets, *_, counts, first, last = mock_execute_raw.call_args_list[0].args
+        self.assertIn("GREATEST", sql)
+        self.assertEqual((stock_ids, counts), ([1], [2]))
+        self.assertEqual(buckets, [1704099600000])
+        self.assertEqual((first, last), ([1704100500000], [1704102300000]))
+
+    @mock.patch('main.db.execute_raw')
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stock.find_many')
+    def test_bulk_upsert_rebuilds_rollups(self, mock_find_many, mock_query_raw, mock_execute_raw):
+        mock_find_many.return_value = [MockPrismaStock(id=1, instrument="HINDALCO")]
+        mock_query_raw.return_value = [{"inserted": 0, "updated": 1, "stockIds": [1], "times": [1704100500000]}]
+        mock_query_raw.side_effect = stock_versions([])
+        row = {"stockId": 1, "datetime": "2024-01-01T09:15:00Z", "open": 1.0, "high": 2.0, "low": 0.5, "close": 1.5, "volume": 10}
+
+        self.assertEqual(client.post("/add-stock-data/bulk?mode=upsert", json=[row]).status_code, 200)
+        calls = mock_execute_raw.call_args_list
+        self.assertEqual([call.args[0] for call in calls], [storage.ROLLUP_FROM_BARS, storage.ROLLUP_FROM_TIER, storage.ROLLUP_FROM_TIER])
+        self.assertEqual(calls[0].args[1:], (1, "1h", 1704099600000, 1704103200000, 3600000))
+        self.assertEqual(calls[2].args[-1], "1d")
+
+        mock_execute_raw.reset_mock()
+        mock_query_raw.return_value = [{"inserted": 0, "updated": 0, "stockIds": None, "times": None}]
+        client.post("/add-stock-data/bulk?mode=ignore", json=[row])
+        mock_execute_raw.assert_not_called()
+
+
+class TestBacktest(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+        self.columns = benchmark.synthetic_series(300, seed=5, interval="1d", volatility=0.02)
+
+    def series(self, close):
+        close = np.asarray(close, dtype=np.float64)
+        return {
+            "datetime": np.datetime64("2024-01-01", "ms") + np.arange(len(close)) * np.timedelta64(1, "D"),
+            "open": close, "high": close, "low": close, "close": close,
+            "volume": np.ones(len(close), dtype=np.int64),
+        }
+
+    def test_position_follows_signal_one_bar_later(self):
+        position, returns = backtest.simulate(np.array([0.0, 1.0, 1.0, 0.0]), np.array([10.0, 11.0, 12.1, 6.0]), 0.0)
+        np.testing.assert_array_equal(position, [0.0, 0.0, 1.0, 1.0])
+        np.testing.assert_allclose(returns, [0.0, 0.0, 0.1, 6.0 / 12.1 - 1.0])
+        _, with_fee = backtest.simulate(np.array([0.0, 1.0, 1.0, 0.0]), np.array([10.0, 11.0, 12.1, 6.0]), 0.01)
+        np.testing.assert_allclose(with_fee - returns, [0.0, 0.0, -0.01, 0.0])
+
+    def test_breakout_holds_until_exit_channel(self):
+        close = np.array([10.0, 10.0, 12.0, 11.0, 11.5, 9.0, 9.5, 13.0])
+        upper = backtest.channel_matrix(close, [2], "max")[0]
+        lower = backtest.channel_matrix(close, [2], "min")[0]
+        np.testing.assert_array_equal(backtest.breakout_signal(close, upper, lower), [0, 0, 1, 1, 1, 0, 0, 1])
+
+    def test_run_backtest_reports_trades(self):
+        stats, trades, curve = backtest.run_backtest("ma_crossover", self.series([1, 2, 3, 4, 3, 2, 1, 2, 3]), {"fast": 1, "slow": 2})
+        self.assertEqual([(trade["entryPrice"], trade["exitPrice"], trade["open"]) for trade in trades], [(2.0, 3.0, False), (2.0, 3.0, True)])
+        self.assertEqual(stats["trades"], 2)
+        self.assertEqual(stats["winRate"], 1.0)
+        self.assertAlmostEqual(stats["totalReturn"], curve["equity"][-1] - 1.0)
+        self.assertAlmostEqual(stats["maxDrawdown"], curve["drawdown"].min())
+
+    def test_sweep_matches_single_runs(self):
+        for strategy, first, second in (("ma_crossover", [2, 5, 8], [10, 20]), ("breakout", [5, 15], [3, 10, 30])):
+            grid = backtest.sweep(strategy, self.columns, np.array(first), np.array(second), 0.001)
+            names = list(backtest.STRATEGY_PARAMS[strategy])
+            for i, a in enumerate(first):
+                for j, b in enumerate(second):
+                    stats, _, _ = backtest.run_backtest(strategy, self.columns, {names[0]: a, names[1]: b}, 0.001)
+                    for metric in ("totalReturn", "sharpe", "maxDrawdown", "trades", "exposure"):
+                        self.assertAlmostEqual(grid[metric][i, j], stats[metric], msg=(strategy, a, b, metric))
+
+    def test_sweep_blocks_match_one_pass(self):
+        first, second = np.arange(2, 12), np.arange(12, 40, 3)
+        whole = backtest.sweep("ma_crossover", self.columns, first, second)
+        with mock.patch('backtest.GRID_CHUNK_CELLS', 1000):
+            blocked = backtest.sweep("ma_crossover", self.columns, first, second)
+        np.testing.assert_allclose(blocked["sharpe"], whole["sharpe"])
+
+    def test_rank_grid_skips_invalid_pairs(self):
+        first, second = np.array([5, 10, 20]), np.array([10, 30])
+        grid = backtest.sweep("ma_crossover", self.columns, first, second)
+        ranked, combinations = backtest.rank_grid("ma_crossover", first, second, grid, "totalReturn", top=10)
+        self.assertEqual(combinations, 4)
+        self.assertTrue(all(row["fast"] < row["slow"] for row in ranked))
+        self.assertEqual([row["totalReturn"] for row in ranked], sorted((row["totalReturn"] for row in ranked), reverse=True))
+
+    def test_invalid_params(self):
+        with self.assertRaises(ValueError):
+            backtest.resolve_params("ma_crossover", {"fast": 50, "slow": 10})
+        with self.assertRaises(ValueError):
+            backtest.resolve_params("breakout", {"fast": 5})
+        self.assertEqual(backtest.resolve_params("breakout", {"exit": 5}), {"entry": 20, "exit": 5})
+
+    def rows(self):
+        return [
+            MockPrismaStockData(id=i, stockId=1, datetime=value.astype(datetime.datetime), close=c, high=h, low=l, open=o, volume=int(v))
+            for i, (value, o, h, l, c, v) in enumerate(zip(*(self.columns[name] for name in ("datetime", "open", "high", "low", "close", "volume"))))
+        ]
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_backtest_endpoint(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows()
+
+        response = client.post("/backtest", json={"instrument": "HINDALCO", "strategy": "breakout", "params": {"entry": 10}, "fee": 0.001})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["params"], {"entry": 10, "exit": 10})
+        self.assertEqual(len(data["curve"]["equity"]), 300)
+        self.assertEqual(data["curve"]["datetime"][0], "2020-01-01T00:00:00Z")
+        self.assertEqual(data["stats"]["trades"], len(data["trades"]))
+
+        response = client.post("/backtest", json={"instrument": "HINDALCO", "strategy": "ma_crossover", "interval": "1w", "from": "2020-03-01T00:00:00Z"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["curve"]["datetime"][0], "2020-02-24T00:00:00Z")
+
+        response = client.post("/backtest", json={"instrument": "HINDALCO", "strategy": "ma_crossover", "params": {"fast": 9, "slow": 3}})
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_backtest_grid_endpoint(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows()
+
+        body = {"instrument": "HINDALCO", "strategy": "ma_crossover", "grid": {"fast": list(range(2, 12)), "slow": list(range(5, 60, 5))}, "top": 5}
+        response = client.post("/backtest/grid", json=body)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data["results"]), 5)
+        self.assertEqual(data["combinations"], sum(fast < slow for fast in range(2, 12) for slow in range(5, 60, 5)))
+        sharpes = [row["sharpe"] for row in data["results"]]
+        self.assertEqual(sharpes, sorted(sharpes, reverse=True))
+
+        with mock.patch('main.BACKTEST_MAX_COMBINATIONS', 10):
+            self.assertEqual(client.post("/backtest/grid", json=body).status_code, 400)
+        body["grid"]["window"] = [3]
+        self.assertEqual(client.post("/backtest/grid", json=body).status_code, 400)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('executor.ANALYTICS_PROCESSES', 2)
+    @mock.patch('main.BACKTEST_PROCESS_MIN_CELLS', 0)
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_backtest_grid_uses_process_pool(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        mock_find_many.return_value = self.rows()
+        first, second = np.arange(5, 30, 5), np.array([8, 16, 32])
+        try:
+            data = client.post("/backtest/grid", json={"instrument": "HINDALCO", "strategy": "breakout", "grid": {"entry": first.tolist(), "exit": second.tolist()}, "metric": "totalReturn", "top": 1}).json()
+        finally:
+            executor.shutdown()
+        expected = backtest.sweep("breakout", self.columns, first, second)["totalReturn"].max()
+        self.assertEqual(data["combinations"], 15)
+        self.assertAlmostEqual(data["results"][0]["totalReturn"], expected)
+
+
+class TestCorrelation(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+        self.stocks = [MockPrismaStock(id=1, instrument="HINDALCO"), MockPrismaStock(id=2, instrument="TATASTEEL"), MockPrismaStock(id=3, instrument="EMPTY")]
+        start = datetime.datetime(2024, 1, 1)
+        closes = {1: [100.0, 101.0, 99.0, 102.0, 104.0, 103.0], 2: [50.0, 50.6, 49.4, 51.1, 52.0, 51.4]}
+        self.rows = [
+            MockPrismaStockData(id=i, stockId=stock_id, datetime=start + datetime.timedelta(days=i), close=c, high=c, low=c, open=c, volume=1)
+            for stock_id, values in closes.items()
+            for i, c in enumerate(values)
+        ]
+
+    def test_pairwise_moments_match_pandas(self):
+        rng = np.random.default_rng(2)
+        returns = rng.normal(0, 0.01, (200, 6))
+        returns[:, 1] += returns[:, 0]
+        returns[rng.random(returns.shape) < 0.1] = np.nan
+        returns[:150, 4] = np.nan
+        returns[:, 5] = np.nan
+        covariance, matrix, counts = correlation.pairwise_moments(returns)
+        frame = pd.DataFrame(returns)
+        np.testing.assert_allclose(matrix, frame.corr().to_numpy(), atol=1e-12)
+        np.testing.assert_allclose(covariance, frame.cov().to_numpy(), atol=1e-15)
+        self.assertEqual(counts[0, 4], int((~np.isnan(returns[:, 0]) & ~np.isnan(returns[:, 4])).sum()))
+        self.assertTrue(np.isnan(matrix[5]).all())
+
+    def test_align_closes_on_union_index(self):
+        a = {"datetime": np.array([0, 1, 3], dtype="datetime64[ms]"), "close": np.array([1.0, 2.0, 3.0])}
+        b = {"datetime": np.array([1, 2, 3], dtype="datetime64[ms]"), "close": np.array([5.0, 6.0, 7.0])}
+        timestamps, closes = correlation.align_closes([a, b])
+        np.testing.assert_array_equal(timestamps, [0, 1, 2, 3])
+        np.testing.assert_array_equal(closes, [[1.0, np.nan], [2.0, 5.0], [np.nan, 6.0], [3.0, 7.0]])
+        timestamps, closes = correlation.align_closes([a, b], window=1)
+        np.testing.assert_array_equal(closes, [[np.nan, 6.0], [3.0, 7.0]])
+        with mock.patch('correlation.CORRELATION_MAX_CELLS', 4):
+            with self.assertRaises(ValueError):
+                correlation.align_closes([a, b])
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_many')
+    def test_endpoint_caches_until_data_changes(self, mock_stock_find_many, mock_find_many, mock_query_raw):
+        mock_stock_find_many.return_value = self.stocks
+        mock_find_many.side_effect = lambda **kwargs: list(self.rows)
+        mock_query_raw.side_effect = stock_versions(self.rows)
+        body = {"instruments": ["HINDALCO", "TATASTEEL", "EMPTY", "UNKNOWN"]}
+
+        with mock.patch('main.correlation_matrix', wraps=correlation.correlation_matrix) as computed:
+            data = client.post("/correlation", json=body).json()
+            self.assertEqual(data["instruments"], ["HINDALCO", "TATASTEEL"])
+            self.assertEqual(data["missing"], ["EMPTY", "UNKNOWN"])
+            self.assertEqual(data["observations"], 5)
+            self.assertEqual(data["start"], "2024-01-01T00:00:00Z")
+            self.assertEqual(data["correlation"][0][0], 1.0)
+            closes = np.array([[row.close for row in self.rows if row.stockId == stock_id] for stock_id in (1, 2)])
+            expected = np.corrcoef(np.diff(np.log(closes), axis=1))
+            np.testing.assert_allclose(data["correlation"], expected)
+
+            self.assertEqual(client.post("/correlation", json=body).json(), data)
+            self.assertEqual(computed.call_count, 1)
+
+            # A bar written by another process moves the version, so the cached
+            # series and the matrix are both dropped.
+            self.rows.append(MockPrismaStockData(id=99, stockId=1, datetime=datetime.datetime(2024, 1, 7), close=105.0, high=105.0, low=105.0, open=105.0, volume=1))
+            data = client.post("/correlation", json=body).json()
+            self.assertEqual(computed.call_count, 2)
+            self.assertEqual(data["observations"], 6)
+
+            data = client.post("/correlation", json={**body, "window": 3}).json()
+            self.assertEqual((data["observations"], data["start"]), (3, "2024-01-04T00:00:00Z"))
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_many')
+    def test_writes_drop_cached_matrices(self, mock_stock_find_many, mock_find_many, mock_query_raw):
+        mock_stock_find_many.return_value = self.stocks
+        mock_find_many.side_effect = lambda **kwargs: list(self.rows)
+        mock_query_raw.side_effect = stock_versions(self.rows)
+        client.post("/correlation", json={"instruments": ["HINDALCO", "TATASTEEL"]})
+        client.post("/correlation", json={"instruments": ["HINDALCO"]})
+        self.assertEqual(len(correlation_cache), 2)
+
+        bar = MockPrismaStockData(id=99, stockId=2, datetime=datetime.datetime(2024, 1, 7), close=52.0, high=52.0, low=52.0, open=52.0, volume=1)
+        main.series_appended(2, rows_to_columns([bar]), (7, epoch_ms(bar.datetime), 7))
+        self.assertEqual([key[0] for key in correlation_cache], [(1,)])
+        main.invalidate_stock(1)
+        self.assertEqual(len(correlation_cache), 0)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_many')
+    def test_endpoint_validates_request(self, mock_stock_find_many, mock_find_many, mock_query_raw):
+        mock_stock_find_many.return_value = self.stocks
+        mock_find_many.return_value = self.rows
+        mock_query_raw.side_effect = stock_versions(self.rows)
+        self.assertEqual(client.post("/correlation", json={"instruments": "all", "interval": "fortnight"}).status_code, 400)
+        self.assertEqual(client.post("/correlation", json={"instruments": "all", "window": 1}).status_code, 422)
+        data = client.post("/correlation", json={"instruments": "all", "interval": "2d"}).json()
+        # Epoch-aligned 2d buckets split Jan 1-6 into four bars.
+        self.assertEqual((data["observations"], data["missing"]), (3, ["EMPTY"]))
+
+
+class TestLoader(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.options = {
+            "mode": "ignore", "chunk_rows": 4, "instrument": None, "columns": {"datetime": "Date"},
+            "backend": "memmap", "store_path": os.path.join(self.root.name, "store"),
+        }
+
+    def write_csv(self, name, rows):
+        path = os.path.join(self.root.name, name)
+        pd.DataFrame(rows).to_csv(path, index=False)
+        return path
+
+    def bars(self, count, **extra):
+        return [
+            {"Date": f"2024-01-01T00:{minute:02d}:00Z", "open": 1.0, "high": 2.0, "low": 0.5, "close": 1.0 + minute, "volume": 10, **extra}
+            for minute in range(count)
+        ]
+
+    def stored(self, instrument):
+        store = storage.MemmapStorage(self.options["store_path"])
+        stock = asyncio.run(store.get_stock(instrument))
+        return store.columns(stock.id)
+
+    def test_clean_chunk_validates_and_deduplicates(self):
+        frame = pd.DataFrame({
+            "instrument": ["0005", "0005", "0005", "", "0005", "0005"],
+            "Date": ["2024-01-01T00:00:00Z", "2024-01-01T05:30:00+05:30", "bad", "2024-01-02", "2024-01-03", "2024-01-04"],
+            "open": [1, 2, 3, 4, "x", 6], "high": 1, "low": 1, "close": 1, "volume": [1, 2, 3, 4, 5, 6.5],
+        })
+        cleaned, rejected = loader.clean_chunk(frame, {"datetime": "Date"})
+        self.assertEqual(rejected, {"duplicate": 1, "invalid datetime": 1, "missing instrument": 1, "invalid price": 1, "invalid volume": 1})
+        self.assertEqual(cleaned["open"].tolist(), [2.0])
+        self.assertEqual(str(cleaned["datetime"].iloc[0]), "2024-01-01 00:00:00+00:00")
+
+        fallback, _ = loader.clean_chunk(frame.drop(columns="instrument"), {"datetime": "Date"}, fallback_instrument="HINDALCO")
+        self.assertEqual(set(fallback["instrument"]), {"HINDALCO"})
+        with self.assertRaises(ValueError):
+            loader.clean_chunk(frame.drop(columns="instrument"), {"datetime": "Date"})
+
+    def test_loads_files_and_maps_instruments(self):
+        paths = [
+            self.write_csv("HINDALCO.csv", self.bars(10)),
+            self.write_csv("mixed.csv", self.bars(3, instrument="0005") + self.bars(2, instrument="TATASTEEL")),
+        ]
+        out = io.StringIO()
+        self.assertEqual(loader.run(paths, self.options, out=out), {})
+        np.testing.assert_array_equal(self.stored("HINDALCO")["close"], np.arange(1.0, 11.0))
+        self.assertEqual(len(self.stored("0005")["close"]), 3)
+        self.assertEqual(len(self.stored("TATASTEEL")["close"]), 2)
+        self.assertIn("HINDALCO.csv: done, 10 inserted", out.getvalue())
+
+    def test_checkpoint_resumes_after_failure(self):
+        path = self.write_csv("HINDALCO.csv", self.bars(10))
+        checkpoint = os.path.join(self.root.name, "load.json")
+        write_chunk = loader.write_chunk
+        calls = []
+
+        async def failing_write(store, frame, known, mode):
+            calls.append(len(frame))
+            if len(calls) == 2:
+                raise RuntimeError("database went away")
+            return await write_chunk(store, frame, known, mode)
+
+        with mock.patch('loader.write_chunk', failing_write):
+            errors = loader.run([path], self.options, checkpoint_path=checkpoint, out=io.StringIO())
+        self.assertIn("database went away", errors[os.path.abspath(path)])
+        with open(checkpoint) as handle:
+            self.assertEqual(json.load(handle)["files"][os.path.abspath(path)]["chunks"], 1)
+
+        out = io.StringIO()
+        self.assertEqual(loader.run([path], self.options, checkpoint_path=checkpoint, out=out), {})
+        self.assertNotIn("chunk 0", out.getvalue())
+        self.assertIn("chunk 1", out.getvalue())
+        np.testing.assert_array_equal(self.stored("HINDALCO")["close"], np.arange(1.0, 11.0))
+
+        out = io.StringIO()
+        loader.run([path], self.options, checkpoint_path=checkpoint, out=out)
+        self.assertIn("already loaded", out.getvalue())
+
+    def test_reads_parquet_in_batches(self):
+        path = os.path.join(self.root.name, "bars.parquet")
+        pd.DataFrame(self.bars(10, instrument="HINDALCO")).to_parquet(path)
+        self.assertEqual([len(frame) for frame in loader.read_chunks(path, 4, skip_chunks=1)], [4, 2])
+
+    def test_concurrent_stock_creation_falls_back_to_lookup(self):
+        store = mock.Mock()
+        store.find_stocks = mock.AsyncMock(side_effect=[[], [MockPrismaStock(id=7, instrument="HINDALCO")]])
+        store.create_stock = mock.AsyncMock(side_effect=RuntimeError("unique constraint"))
+        known = {}
+        asyncio.run(loader.resolve_stocks(store, known, ["HINDALCO"]))
+        self.assertEqual(known, {"HINDALCO": 7})
+
+    def test_column_mapping(self):
+        self.assertEqual(loader.parse_columns("datetime=Date, close=Close"), {"datetime": "Date", "close": "Close"})
+        with self.assertRaises(ValueError):
+            loader.parse_columns("price=Close")
+
+
+class TestCoalescing(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+        start = datetime.datetime(2024, 1, 1)
+        self.rows = [
+            MockPrismaStockData(id=i, stockId=1, datetime=start + datetime.timedelta(days=i), close=c, high=c, low=c, open=c, volume=1)
+            for i, c in enumerate([3.0, 2.0, 6.0, 5.0, 0.0, 3.0])
+        ]
+
+    def test_concurrent_calls_share_one_flight(self):
+        calls = []
+
+        async def work(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return {"value": value}
+
+        async def scenario():
+            flights = SingleFlight()
+            first = await asyncio.gather(*[flights.do("a", work, 1) for _ in range(5)], flights.do("b", work, 2))
+            self.assertEqual(len(flights), 0)
+            second = await flights.do("a", work, 3)
+            return flights, first, second
+
+        flights, first, second = asyncio.run(scenario())
+        self.assertEqual(calls, [1, 2, 3])
+        self.assertEqual(first, [{"value": 1}] * 5 + [{"value": 2}])
+        self.assertIs(first[0], first[4])
+        self.assertEqual(second, {"value": 3})
+        self.assertEqual((flights.started, flights.shared), (3, 4))
+
+    def test_errors_reach_every_waiter(self):
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        async def scenario():
+            flights = SingleFlight()
+            return await asyncio.gather(*[flights.do("a", fail) for _ in range(3)], return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, ValueError) for result in asyncio.run(scenario())))
+
+    def test_cancelled_caller_does_not_cancel_the_flight(self):
+        async def work():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        async def scenario():
+            flights = SingleFlight()
+            leader = asyncio.ensure_future(flights.do("a", work))
+            follower = asyncio.ensure_future(flights.do("a", work))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await follower, leader.cancelled()
+
+        self.assertEqual(asyncio.run(scenario()), ("done", True))
+
+    def test_forget_starts_a_fresh_flight(self):
+        calls = []
+
+        async def work(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value
+
+        async def scenario():
+            flights = SingleFlight()
+            stale = asyncio.ensure_future(flights.do(("strategy", 1), work, "before"))
+            await asyncio.sleep(0)
+            flights.forget(lambda key: key[1] == 1)
+            fresh = await flights.do(("strategy", 1), work, "after")
+            return await stale, fresh
+
+        self.assertEqual(asyncio.run(scenario()), ("before", "after"))
+        self.assertEqual(calls, ["before", "after"])
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_concurrent_requests_share_queries(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_query_raw.return_value = []
+        async def find_unique(**kwargs):
+            await asyncio.sleep(0.01)
+            return MockPrismaStock(id=1, instrument="HINDALCO")
+
+        async def find_many(**kwargs):
+            await asyncio.sleep(0.01)
+            return self.rows
+
+        mock_find_unique.side_effect = find_unique
+        mock_find_many.side_effect = find_many
+
+        async def scenario():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                params = {"instrument": "HINDALCO", "max_trades": 2}
+                return await asyncio.gather(*[http.get("/strategy", params=params) for _ in range(5)])
+
+        responses = asyncio.run(scenario())
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(len({response.content for response in responses}), 1)
+        self.assertEqual(mock_find_unique.call_count, 1)
+        self.assertEqual(mock_find_many.call_count, 1)
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_coalesced_binary_responses_compress_independently(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        start = datetime.datetime(2024, 1, 1)
+        rows = [
+            MockPrismaStockData(id=i, stockId=1, datetime=start + datetime.timedelta(minutes=i), close=100.0 + i % 7, high=101.0, low=99.0, open=100.0, volume=1)
+            for i in range(500)
+        ]
+
+        async def find_many(**kwargs):
+            await asyncio.sleep(0.01)
+            return rows
+
+        mock_find_many.side_effect = find_many
+        mock_query_raw.return_value = []
+
+        async def scenario(path, params):
+            transport = httpx.ASGITransport(app=app)
+            headers = {"Accept": "application/x-ohlcv-packed", "Accept-Encoding": "gzip"}
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                return await asyncio.gather(*[http.get(path, params=params, headers=headers) for _ in range(4)])
+
+        for path, params in (("/strategy", {"instrument": "HINDALCO", "indicators": "rsi:14,ema:50"}), ("/get-stock-data", {"instrument": "HINDALCO"})):
+            reset_caches()
+            shared = main.flights.shared
+            responses = asyncio.run(scenario(path, params))
+            self.assertEqual(main.flights.shared - shared, 3)
+            for response in responses:
+                self.assertEqual(response.headers["content-encoding"], "gzip")
+                arrays, _ = decode_packed(response.content)
+                self.assertEqual(len(arrays["datetime"]), 500)
+
+
 class TestMovingAverageAlgorithm(unittest.TestCase):
     def test_moving_average_calculation(self):
         close_prices = np.array([100.0, 105.0, 110.0, 115.0, 120.0])
         
         expected_ma = np.array([105.0, 110.0, 115.0])
         
-        window_size = 3
-        weights = np.ones(window_size) / window_size
-        calculated_ma = np.convolve(close_prices, weights, mode="valid")
+        calculated_ma = moving_average(close_prices, window_size=3)
         
         np.testing.assert_array_almost_equal(calculated_ma, expected_ma)
     
@@ -527,143 +2511,237 @@ class TestMovingAverageAlgorithm(unittest.TestCase):
             (111.75 + 108.1 + 109.55) / 3
         ])
         
-        window_size = 3
-        weights = np.ones(window_size) / window_size
-        calculated_ma = np.convolve(close_prices, weights, mode="valid")
+        calculated_ma = moving_average(close_prices, window_size=3)
         
         np.testing.assert_array_almost_equal(calculated_ma, expected_ma)
     
     def test_moving_average_insufficient_data(self):
         close_prices = np.array([100.0, 105.0])
         
-        window_size = 3
-        weights = np.ones(window_size) / window_size
-        calculated_ma = np.convolve(close_prices, weights, mode="valid")
+        calculated_ma = moving_average(close_prices, window_size=3)
         
         self.assertEqual(len(calculated_ma), 0)
     
     def test_moving_average_exact_window_size(self):
         close_prices = np.array([100.0, 105.0, 110.0])
         
-        window_size = 3
-        weights = np.ones(window_size) / window_size
-        calculated_ma = np.convolve(close_prices, weights, mode="valid")
+        calculated_ma = moving_average(close_prices, window_size=3)
         
         self.assertEqual(len(calculated_ma), 1)
         self.assertAlmostEqual(calculated_ma[0], 105.0)
 
+    def test_moving_average_matches_convolution(self):
+        close_prices = 100 + np.random.default_rng(3).normal(size=5000).cumsum()
+        for window_size in (1, 3, 50, 200):
+            weights = np.ones(window_size) / window_size
+            np.testing.assert_allclose(
+                moving_average(close_prices, window_size),
+                np.convolve(close_prices, weights, mode="valid"),
+                rtol=1e-9,
+            )
+
+class TestIndicators(unittest.TestCase):
+    def setUp(self):
+        reset_caches()
+        rng = np.random.default_rng(11)
+        close = 100 + rng.normal(size=500).cumsum()
+        self.columns = {
+            "close": close,
+            "high": close + rng.uniform(0, 2, size=500),
+            "low": close - rng.uniform(0, 2, size=500),
+        }
+
+    def test_parse_indicators(self):
+        specs = parse_indicators("sma:20, ema:50,macd,bbands:10:2.5")
+        self.assertEqual([key for key, _, _ in specs], ["sma:20", "ema:50", "macd:12:26:9", "bbands:10:2.5"])
+        for spec in ("foo:3", "sma:0", "sma:x", "sma:1:2"):
+            with self.assertRaises(ValueError):
+                parse_indicators(spec)
+
+    def test_indicators_match_pandas(self):
+        close = pd.Series(self.columns["close"])
+        results = compute_indicators(self.columns, parse_indicators("sma:20,ema:10,bbands:20:2,rsi:14,atr:14,macd"))
+
+        np.testing.assert_allclose(results["sma:20"], close.rolling(20).mean(), rtol=1e-9)
+        np.testing.assert_allclose(results["ema:10"], close.ewm(span=10, adjust=False).mean(), rtol=1e-9)
+        np.testing.assert_allclose(results["bbands:20:2"]["upper"], close.rolling(20).mean() + 2 * close.rolling(20).std(ddof=0), rtol=1e-9)
+        self.assertTrue(np.isnan(results["rsi:14"][:14]).all())
+        self.assertTrue(((results["rsi:14"][14:] >= 0) & (results["rsi:14"][14:] <= 100)).all())
+        self.assertTrue(np.isnan(results["atr:14"][:13]).all())
+        self.assertTrue((results["atr:14"][13:] > 0).all())
+        np.testing.assert_allclose(
+            results["macd:12:26:9"]["histogram"],
+            results["macd:12:26:9"]["macd"] - results["macd:12:26:9"]["signal"],
+        )
+
+    def test_to_json_replaces_nan(self):
+        self.assertEqual(to_json(np.array([np.nan, 1.5])), [None, 1.5])
+
+    @mock.patch('main.db.query_raw')
+    @mock.patch('main.db.stockdata.find_many')
+    @mock.patch('main.db.stock.find_unique')
+    def test_strategy_with_indicators(self, mock_find_unique, mock_find_many, mock_query_raw):
+        mock_query_raw.return_value = []
+        mock_find_unique.return_value = MockPrismaStock(id=1, instrument="HINDALCO")
+        start = datetime.datetime(2024, 1, 1)
+        mock_find_many.return_value = [
+            MockPrismaStockData(id=i, stockId=1, datetime=start + datetime.timedelta(days=i), close=float(c), high=float(c) + 1, low=float(c) - 1, open=float(c), volume=100)
+            for i, c in enumerate([100, 102, 101, 105, 107, 106])
+        ]
+
+        response = client.get("/strategy", params={"instrument": "HINDALCO", "window": 2, "indicators": "sma:3,macd"})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["MovingAverage"], [101.0, 101.5, 103.0, 106.0, 106.5])
+        self.assertEqual(data["Indicators"]["sma:3"][:3], [None, None, 101.0])
+        self.assertEqual(set(data["Indicators"]["macd:12:26:9"]), {"macd", "signal", "histogram"})
+        mock_find_many.assert_called_once()
+
+        response = client.get("/strategy", params={"instrument": "HINDALCO", "indicators": "vwap"})
+        self.assertEqual(response.status_code, 400)
+
+def reference_best_buy_sell(close_prices):
+    # The original per-element scan, kept as the oracle for the vectorized kernel.
+    min_price = np.inf
+    min_index = 0 
+    max_profit = 0 
+    buy_index = 0 
+    sell_index = 0
+
+    for i in range(len(close_prices)):
+        if close_prices[i] < min_price:
+            min_price = close_prices[i]
+            min_index = i
+        elif close_prices[i] - min_price > max_profit:
+            max_profit = close_prices[i] - min_price
+            buy_index = min_index
+            sell_index = i
+    return {"BuyIndex": buy_index, "SellIndex": sell_index, "Profit": max_profit}
+
 class TestBestBuySellAlgorithm(unittest.TestCase):
     def test_best_buy_sell_calculation(self):
         close_prices = np.array([100.0, 90.0, 95.0, 110.0, 105.0])
         
-        expected_buy_index = 1
-        expected_sell_index = 3
-        expected_profit = 20.0
-        
-        min_price = np.inf
-        min_index = 0 
-        max_profit = 0 
-        buy_index = 0 
-        sell_index = 0
-
-        for i in range(len(close_prices)):
-            if close_prices[i] < min_price:
-                min_price = close_prices[i]
-                min_index = i
-            elif close_prices[i] - min_price > max_profit:
-                max_profit = close_prices[i] - min_price
-                buy_index = min_index
-                sell_index = i
-        
-        self.assertEqual(buy_index, expected_buy_index)
-        self.assertEqual(sell_index, expected_sell_index)
-        self.assertEqual(max_profit, expected_profit)
+        result = best_buy_sell(close_prices)
+        
+        self.assertEqual(result["BuyIndex"], 1)
+        self.assertEqual(result["SellIndex"], 3)
+        self.assertEqual(result["Profit"], 20.0)
     
     def test_best_buy_sell_with_real_data(self):
         close_prices = np.array([114.0, 111.1, 113.8, 111.75, 108.1, 109.55])
         
-        min_price = np.inf
-        min_index = 0 
-        max_profit = 0 
-        buy_index = 0 
-        sell_index = 0
-
-        for i in range(len(close_prices)):
-            if close_prices[i] < min_price:
-                min_price = close_prices[i]
-                min_index = i
-            elif close_prices[i] - min_price > max_profit:
-                max_profit = close_prices[i] - min_price
-                buy_index = min_index
-                sell_index = i
-        
-        self.assertEqual(buy_index, 4)
-        self.assertEqual(sell_index, 5)
-        self.assertAlmostEqual(max_profit, 1.45)
+        result = best_buy_sell(close_prices)
+        
+        # Buying at 111.1 and selling at 113.8 beats the 108.1 -> 109.55 pair.
+        self.assertEqual(result["BuyIndex"], 1)
+        self.assertEqual(result["SellIndex"], 2)
+        self.assertAlmostEqual(result["Profit"], 2.7)
+        self.assertEqual(result, reference_best_buy_sell(close_prices))
     
     def test_best_buy_sell_declining_market(self):
         close_prices = np.array([100.0, 95.0, 90.0, 85.0, 80.0])
         
-        min_price = np.inf
-        min_index = 0 
-        max_profit = 0 
-        buy_index = 0 
-        sell_index = 0
-
-        for i in range(len(close_prices)):
-            if close_prices[i] < min_price:
-                min_price = close_prices[i]
-                min_index = i
-            elif close_prices[i] - min_price > max_profit:
-                max_profit = close_prices[i] - min_price
-                buy_index = min_index
-                sell_index = i
+        result = best_buy_sell(close_prices)
         
-        self.assertEqual(max_profit, 0)
+        self.assertEqual(result["Profit"], 0)
+        self.assertEqual(result, reference_best_buy_sell(close_prices))
     
     def test_best_buy_sell_single_point(self):
         close_prices = np.array([100.0])
         
-        min_price = np.inf
-        min_index = 0 
-        max_profit = 0 
-        buy_index = 0 
-        sell_index = 0
-
-        for i in range(len(close_prices)):
-            if close_prices[i] < min_price:
-                min_price = close_prices[i]
-                min_index = i
-            elif close_prices[i] - min_price > max_profit:
-                max_profit = close_prices[i] - min_price
-                buy_index = min_index
-                sell_index = i
-        
-        self.assertEqual(buy_index, 0)
-        self.assertEqual(sell_index, 0)
-        self.assertEqual(max_profit, 0)
+        result = best_buy_sell(close_prices)
+        
+        self.assertEqual(result["BuyIndex"], 0)
+        self.assertEqual(result["SellIndex"], 0)
+        self.assertEqual(result["Profit"], 0)
     
     def test_best_buy_sell_increasing_market(self):
         close_prices = np.array([80.0, 85.0, 90.0, 95.0, 100.0])
         
-        min_price = np.inf
-        min_index = 0 
-        max_profit = 0 
-        buy_index = 0 
-        sell_index = 0
-
-        for i in range(len(close_prices)):
-            if close_prices[i] < min_price:
-                min_price = close_prices[i]
-                min_index = i
-            elif close_prices[i] - min_price > max_profit:
-                max_profit = close_prices[i] - min_price
-                buy_index = min_index
-                sell_index = i
-        
-        self.assertEqual(buy_index, 0)
-        self.assertEqual(sell_index, 4)
-        self.assertEqual(max_profit, 20.0)
+        result = best_buy_sell(close_prices)
+        
+        self.assertEqual(result["BuyIndex"], 0)
+        self.assertEqual(result["SellIndex"], 4)
+        self.assertEqual(result["Profit"], 20.0)
+
+    def test_best_buy_sell_empty(self):
+        self.assertEqual(best_buy_sell(np.array([])), {"BuyIndex": 0, "SellIndex": 0, "Profit": 0})
+
+    def test_best_buy_sell_matches_reference_scan(self):
+        rng = np.random.default_rng(7)
+        for size in (2, 3, 10, 257):
+            for _ in range(50):
+                # Rounded prices force ties, which is where index choice matters.
+                close_prices = np.round(100 + rng.normal(size=size).cumsum(), 0)
+                self.assertEqual(best_buy_sell(close_prices), reference_best_buy_sell(close_prices))
+
+
+def reference_best_trades(close_prices, max_trades, fee, cooldown):
+    """Exhaustive search over trade sets, for small inputs only."""
+    n = len(close_prices)
+    def best(start, remaining):
+        if remaining == 0:
+            return 0.0
+        result = 0.0
+        for buy in range(start, n):
+            for sell in range(buy + 1, n):
+                profit = close_prices[sell] - close_prices[buy] - fee
+                if profit > 0:
+                    result = max(result, profit + best(sell + cooldown + 1, remaining - 1))
+        return result
+    return best(0, max_trades or n)
+
+
+class TestBestTrades(unittest.TestCase):
+    def test_k_trades(self):
+        close_prices = np.array([3.0, 2.0, 6.0, 5.0, 0.0, 3.0])
+        self.assertEqual(best_trades(close_prices, max_trades=2), {
+            "Trades": [{"BuyIndex": 1, "SellIndex": 2, "Profit": 4.0}, {"BuyIndex": 4, "SellIndex": 5, "Profit": 3.0}],
+            "TotalProfit": 7.0,
+        })
+        self.assertEqual(best_trades(close_prices, max_trades=1)["Trades"], [best_buy_sell(close_prices)])
+
+    def test_fee_and_cooldown(self):
+        close_prices = np.array([1.0, 3.0, 2.0, 8.0, 4.0, 9.0])
+        self.assertEqual(best_trades(close_prices, fee=2.0)["TotalProfit"], 8.0)
+        cooldown = best_trades(np.array([1.0, 2.0, 3.0, 0.0, 2.0]), cooldown=1)
+        self.assertEqual([(trade["BuyIndex"], trade["SellIndex"]) for trade in cooldown["Trades"]], [(0, 1), (3, 4)])
+
+    def test_cooldown_longer_than_series(self):
+        close_prices = np.arange(20.0)
+        for cooldown in (19, 20, 37, 100):
+            result = best_trades(close_prices, max_trades=2, cooldown=cooldown)
+            self.assertEqual(result["Trades"], [{"BuyIndex": 0, "SellIndex": 19, "Profit": 19.0}])
+
+    def test_unlimited_without_costs_takes_every_rise(self):
+        close_prices = np.array([1.0, 2.0, 3.0, 2.0, 2.0, 5.0, 4.0])
+        result = best_trades(close_prices)
+        self.assertEqual([(trade["BuyIndex"], trade["SellIndex"]) for trade in result["Trades"]], [(0, 2), (4, 5)])
+        self.assertEqual(result["TotalProfit"], 5.0)
+        self.assertEqual(best_trades(np.array([5.0, 4.0, 3.0]), max_trades=3), {"Trades": [], "TotalProfit": 0})
+
+    def test_matches_exhaustive_search(self):
+        rng = np.random.default_rng(11)
+        for _ in range(150):
+            close_prices = np.round(rng.uniform(1, 10, rng.integers(1, 9)), 0)
+            for max_trades in (1, 2, None):
+                for fee in (0.0, 1.0):
+                    for cooldown in (0, 2, 20):
+                        result = best_trades(close_prices, max_trades, fee, cooldown)
+                        self.assertAlmostEqual(result["TotalProfit"], reference_best_trades(close_prices, max_trades, fee, cooldown))
+                        last_sell = -cooldown - 1
+                        for trade in result["Trades"]:
+                            self.assertGreater(trade["BuyIndex"], last_sell + cooldown)
+                            self.assertLess(trade["BuyIndex"], trade["SellIndex"])
+                            last_sell = trade["SellIndex"]
+                        self.assertLessEqual(len(result["Trades"]), max_trades or len(close_prices))
+
+    def test_rejects_oversized_layers(self):
+        with mock.patch('engine.BEST_TRADES_MAX_CELLS', 100):
+            with self.assertRaises(ValueError):
+                best_trades(np.arange(100.0), max_trades=10)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -1,4 +1,6 @@
 #!/bin/sh
+# A failed migration must stop the container instead of serving an old schema.
+set -e
 
 echo "Waiting for database to be ready..."
 
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { useParams } from 'react-router-dom';
-import { getStockdata, getStockPerformance } from '../Server/server';
+import { getStockdata, getStockPerformance, subscribeStockData } from '../Server/server';
 
 function Stockdata() {
     const [stockdata, setStockdata] = useState([]);
@@ -43,6 +43,12 @@ function Stockdata() {
         fetchStocks();
         // fetchStockPerformance();
         // console.log(instrument);
+        return subscribeStockData(instrument, ({ data }) => {
+            setStockdata((rows) => {
+                const updated = new Set(data.map((bar) => new Date(bar.datetime).getTime()));
+                return [...rows.filter((row) => !updated.has(new Date(row.datetime).getTime())), ...data];
+            });
+        });
     }, [instrument]);
 
 
@@ -226,7 +232,7 @@ function Stockdata() {
                                 </thead>
                                 <tbody className="bg-neutral-800/20 divide-y divide-neutral-700/50">
                                     {stockdata.map((stock, index) => (
-                                        <tr key={stock.id} className="hover:bg-neutral-700/20 transition-colors">
+                                        <tr key={stock.datetime} className="hover:bg-neutral-700/20 transition-colors">
                                             <td className="px-6 py-4 whitespace-nowrap text-sm text-neutral-400">{index + 1}</td>
                                             <td className="px-6 py-4 whitespace-nowrap">
                                                 <div className="flex items-center">
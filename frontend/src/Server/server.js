@@ -10,9 +10,12 @@ const getAllStocks = async () => {
   return response?.data;
 }
 
-const getStockdata = async (instrument) => {
-  const response = await axios.get(`${backendUrl}/get-stock-data?instrument=${instrument}`);
-  return response?.data?.data;
+// Long histories come back as at most maxPoints OHLCV buckets that keep their true highs and lows.
+const getStockdata = async (instrument, { from, to, maxPoints = 2000 } = {}) => {
+  const response = await axios.get(`${backendUrl}/get-stock-data`, {
+    params: { instrument, from, to, max_points: maxPoints },
+  });
+  return response?.data?.data ?? [];
 }
 const getStockPerformance = async (instrument) => {
   try {
@@ -31,8 +34,24 @@ const getStockPerformance = async (instrument) => {
   }
 }
 
+// Calls onBars with each batch of newly ingested bars; returns an unsubscribe function.
+const subscribeStockData = (instrument, onBars, { window = 3 } = {}) => {
+  const socket = new WebSocket(`${backendUrl.replace(/^http/, 'ws')}/ws/stocks`);
+  socket.onopen = () => {
+    socket.send(JSON.stringify({ action: 'subscribe', instruments: [instrument], window }));
+  };
+  socket.onmessage = (event) => {
+    const message = JSON.parse(event.data);
+    if (message.type === 'bars' && message.instrument === instrument) {
+      onBars(message);
+    }
+  };
+  return () => socket.close();
+}
+
 export {
     getAllStocks,
     getStockdata,
-    getStockPerformance
+    getStockPerformance,
+    subscribeStockData
 }
\ No newline at end of file